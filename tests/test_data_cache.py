@@ -0,0 +1,109 @@
+import pathlib
+import tempfile
+
+import numpy as np
+
+from visualpic import DataContainer
+from visualpic.data_handling.data_cache import DataCache, data_cache
+from visualpic.data_handling.disk_cache import DiskCache
+
+
+def test_data_cache():
+    """Test that field and particle data is served from the data cache."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    data_cache.clear()
+    data_cache.reset_stats()
+
+    field = diags.get_field("Ez")
+    it = field.timesteps[0]
+    fld_1, md_1 = field.get_data(it)
+    fld_2, md_2 = field.get_data(it)
+    np.testing.assert_array_equal(fld_1, fld_2)
+    assert md_1 is not md_2
+    assert data_cache.get_stats()["hits"] == 1
+    # The returned data can be modified without affecting the cache.
+    fld_2 *= 2
+    np.testing.assert_array_equal(field.get_data(it)[0], fld_1)
+    assert data_cache.get_stats()["hits"] == 2
+
+    species = diags.get_species("electrons")
+    data_1 = species.get_data(it, ["x", "y"])
+    data_2 = species.get_data(it, ["x", "y", "z"])
+    np.testing.assert_array_equal(data_1["x"][0], data_2["x"][0])
+    assert data_cache.get_stats()["hits"] == 4
+
+    data_cache.invalidate(field)
+    fld_3, _ = field.get_data(it)
+    assert data_cache.get_stats()["hits"] == 4
+    np.testing.assert_array_equal(fld_3, fld_1)
+
+    # The entries of deleted objects are removed.
+    n_entries = data_cache.get_stats()["entries"]
+    del diags, species
+    assert data_cache.get_stats()["entries"] < n_entries
+
+
+def test_data_cache_eviction():
+    """Test the LRU eviction of a cache with a small byte budget."""
+    cache = DataCache(max_bytes=2000)
+    keys = [cache.make_key("owner", i) for i in range(3)]
+    for key in keys:
+        cache.put(key, np.zeros(100), {})
+    stats = cache.get_stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) is not None
+    # The arrays returned by the cache are always writeable.
+    data, _ = cache.get(keys[2])
+    assert data.flags.writeable
+    data, _ = cache.put(cache.make_key("owner", 3), np.zeros(1000), {})
+    assert data.flags.writeable
+    assert cache.get_stats()["entries"] == 2
+    disabled_cache = DataCache(max_bytes=0)
+    data, _ = disabled_cache.put(
+        disabled_cache.make_key("owner", 0), np.zeros(10), {})
+    assert data.flags.writeable
+    assert disabled_cache.get_stats()["entries"] == 0
+    # Data is stored with the type given in the key.
+    key = cache.make_key("owner", 0, dtype=np.float32)
+    assert key != keys[0]
+    data, _ = cache.put(key, np.zeros(10), {})
+    assert data.dtype == np.float32
+    assert cache.get(key)[0].dtype == np.float32
+
+
+def test_disk_cache_metadata(tmp_path):
+    """Test that the metadata is stored in the disk cache without pickle."""
+    cache = DiskCache(str(tmp_path))
+    metadata = {
+        "field": {"units": "V/m", "axis_labels": ["z", "r"], "thetaMode": 1},
+        "axis": {"z": {"array": np.linspace(0, 1, 5), "min": np.float64(0),
+                       "spacing": 0.25, "units": "m"}},
+        "time": {"value": np.float32(1.5), "units": None},
+        "grid": {"range": ([0, 1], (2, 3)), "labels": np.array(["a", "b"])},
+        1: True
+    }
+    key = cache.make_key("entry")
+    cache.put(key, np.arange(10.), metadata)
+    data, md = cache.get(key)
+    np.testing.assert_array_equal(data, np.arange(10.))
+    np.testing.assert_array_equal(md["axis"]["z"]["array"],
+                                  metadata["axis"]["z"]["array"])
+    np.testing.assert_array_equal(md["grid"]["labels"], ["a", "b"])
+    assert md["field"] == metadata["field"]
+    assert md["grid"]["range"] == ([0, 1], (2, 3))
+    assert type(md["time"]["value"]) is np.float32
+    assert md["time"]["units"] is None
+    assert md[1] is True
+    # Entries with unsupported metadata are not stored.
+    cache.put(cache.make_key("other"), np.arange(10.), {"obj": object()})
+    assert cache.get(cache.make_key("other")) is None
+
+
+if __name__ == "__main__":
+    test_data_cache()
+    test_data_cache_eviction()
+    test_disk_cache_metadata(pathlib.Path(tempfile.mkdtemp()))
@@ -1,5 +1,20 @@
+import os
+import shutil
+import asyncio
+import threading
+import pathlib
+import tempfile
+
+import numpy as np
+import h5py
 import scipy.constants as ct
+from scipy.signal import hilbert
 from visualpic import DataContainer
+from visualpic.data_handling.data_cache import data_cache
+from visualpic.analysis.slice_analysis import analyze_beam
+from visualpic.analysis.field_evolution import analyze_field_evolution
+from visualpic.analysis.beam_evolution import analyze_beam_evolution
+from visualpic.analysis.analysis_helpers import AnalysisCheckpoint
 
 
 # Intensity
@@ -66,5 +81,667 @@ def test_data_container():
             sp_data = species.get_data(it)
 
 
+def test_get_fields():
+    """Test that fields read together match those read individually."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    field_names = ["Ez", "I", "A", "a"]
+    it = diags.get_field("I").timesteps[0]
+    fields_data = diags.get_fields(
+        field_names, it, field_units=[None, "W/cm^2", None, None])
+    assert list(fields_data.keys()) == field_names
+    data_cache.clear()
+    for field_name, units in zip(field_names, [None, "W/cm^2", None, None]):
+        fld, md = diags.get_field(field_name).get_data(it, field_units=units)
+        np.testing.assert_allclose(fields_data[field_name][0], fld)
+        assert fields_data[field_name][1]["field"]["units"] == (
+            md["field"]["units"])
+    # All base fields (Ez, Ex and Ey) are read from their file at once.
+    data_cache.clear()
+    field_reader = diags.get_field("Ez").field_reader
+    read_fields = field_reader.read_fields
+    read_files = []
+
+    def read_fields_in_file(file_path, *args, **kwargs):
+        read_files.append(file_path)
+        return read_fields(file_path, *args, **kwargs)
+
+    field_reader.read_fields = read_fields_in_file
+    fields_data_2 = diags.get_fields(
+        field_names, it, field_units=[None, "W/cm^2", None, None])
+    del field_reader.read_fields
+    assert len(read_files) == 1
+    for field_name in field_names:
+        np.testing.assert_array_equal(fields_data_2[field_name][0],
+                                      fields_data[field_name][0])
+
+
+def test_out_of_core(tmp_path):
+    """Test the slab-wise evaluation of a derived field."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    field = diags.get_field("I")
+    it = field.timesteps[0]
+    fld, md = field.get_data(it, field_units="W/cm^2")
+    fld_ooc, md_ooc = field.get_data_out_of_core(
+        it, field_units="W/cm^2", slab_size=10)
+    np.testing.assert_allclose(fld_ooc, fld)
+    assert md_ooc["field"]["units"] == "W/cm^2"
+    # HDF5 output files are not kept open for writing.
+    output_path = str(tmp_path / "fields.h5")
+    fld_h5, _ = field.get_data_out_of_core(
+        it, output_path, field_units="W/cm^2", slab_size=10)
+    assert fld_h5.file.mode == "r"
+    np.testing.assert_allclose(fld_h5[()], fld)
+    fld_h5.file.close()
+    with h5py.File(output_path, "a") as f:
+        np.testing.assert_allclose(f["I"][()], fld)
+    chunk = (slice(None), slice(2, 8), slice(10, 20))
+    fld_chunk, md_chunk = field.get_data_chunk(it, chunk)
+    np.testing.assert_allclose(fld_chunk, field.get_data(it)[0][chunk])
+    assert len(md_chunk["axis"]["z"]["array"]) == 10
+
+
+def test_derived_particle_data():
+    """Test derived particle components sharing their requirements."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    species = diags.get_species("electrons")
+    it = species.timesteps[0]
+    comps = ["px", "py", "pz", "gamma", "ekin", "beta_z", "x_prime"]
+    data = species.get_data(it, comps, data_units=["SI"] * 4 + ["MeV", "SI", "SI"])
+    px, py, pz = [data[comp][0] for comp in ["px", "py", "pz"]]
+    gamma = np.sqrt(1 + px**2 + py**2 + pz**2)
+    np.testing.assert_allclose(data["gamma"][0], gamma)
+    np.testing.assert_allclose(data["ekin"][0], (gamma - 1) * 0.51099895, rtol=1e-6)
+    np.testing.assert_allclose(data["beta_z"][0], pz / gamma)
+    np.testing.assert_allclose(data["x_prime"][0], px / pz)
+    assert data["ekin"][1]["units"] == "MeV"
+
+
+def test_iter_timesteps():
+    """Test reading several time steps with read-ahead."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    field = diags.get_field("Ez")
+    timesteps = []
+    for it, fld, md in field.iter_timesteps(max_in_flight=3):
+        np.testing.assert_array_equal(fld, field.get_data(it)[0])
+        timesteps.append(it)
+    np.testing.assert_array_equal(timesteps, field.timesteps)
+    fld_stack, md_list = field.iter_timesteps(stack=True)
+    assert fld_stack.shape[0] == len(field.timesteps) == len(md_list)
+    species = diags.get_species("electrons")
+    for it, data in species.iter_timesteps(components_list=["x", "pz"]):
+        assert list(data.keys()) == ["x", "pz"]
+
+
+def test_lineout_and_probe():
+    """Test lineouts and probes against the full field data."""
+    data_path = "./test_data/example-thetaMode/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    field = diags.get_field("Ez")
+    lineouts, md = field.get_lineout("z", theta=0.5)
+    probes, _ = field.get_probe({"z": 0.0}, theta=0.5)
+    assert lineouts.shape[0] == probes.shape[0] == len(field.timesteps)
+    # Without workers, the time steps are read in the calling thread.
+    lineouts_2, _ = field.get_lineout("z", theta=0.5, n_workers=0)
+    np.testing.assert_array_equal(lineouts_2, lineouts)
+    for i, it in enumerate(field.timesteps):
+        fld, fld_md = field.get_data(it, theta=0.5)
+        i_r = len(fld_md["axis"]["r"]["array"]) // 2
+        i_z = np.argmin(np.abs(fld_md["axis"]["z"]["array"]))
+        np.testing.assert_allclose(lineouts[i], fld[i_r])
+        np.testing.assert_allclose(probes[i], fld[i_r, i_z])
+        np.testing.assert_allclose(
+            md["axis"]["z"]["array"][i], fld_md["axis"]["z"]["array"])
+
+
+def test_theta_mode_3d():
+    """Test the 3D reconstruction of derived fields in thetaMode."""
+    data_path = "./test_data/example-thetaMode/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    diags.add_derived_field({
+        "name": "Ez_sum",
+        "units": "V/m",
+        "requirements": {"thetaMode": ["Ez", "Er"]},
+        "recipe": {"thetaMode": "Ez + 2 * Er"},
+    })
+    it = diags.get_field("Ez").timesteps[0]
+    ez, md = diags.get_field("Ez").get_data(it, theta=None)
+    er, _ = diags.get_field("Er").get_data(it, theta=None)
+    fld, fld_md = diags.get_field("Ez_sum").get_data(it, theta=None)
+    np.testing.assert_allclose(fld, ez + 2 * er, rtol=1e-12)
+    for axis in ["x", "y", "z"]:
+        np.testing.assert_array_equal(
+            fld_md["axis"][axis]["array"], md["axis"][axis]["array"])
+    it = diags.get_field("Ez").timesteps[-1]
+    ez, et, er = [diags.get_field(name).get_data(it, theta=None)[0]
+                  for name in ["Ez", "Et", "Er"]]
+    intensity, _ = diags.get_field("I").get_data(it, theta=None)
+    np.testing.assert_allclose(
+        intensity, ct.c * ct.epsilon_0 / 2 * (ez**2 + er**2 + et**2),
+        rtol=1e-12)
+    assert intensity.min() >= 0
+    a, _ = diags.get_field("a").get_data(it, theta=None)
+    np.testing.assert_allclose(
+        a, np.sqrt(ez**2 + er**2 + et**2) * 0.8e-6 * ct.e / (
+            2 * np.pi * ct.m_e * ct.c**2), rtol=1e-12)
+    fld, fld_md = diags.get_field("I").get_data(
+        it, theta=None, max_resolution_3d=[32, 20])
+    assert fld.shape == tuple(
+        len(fld_md["axis"][axis]["array"]) for axis in ["x", "y", "z"])
+
+
+def test_laser_envelope():
+    """Test the FFT-based laser envelope against scipy.signal.hilbert."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    field = diags.get_field("a_env")
+    it = field.timesteps[0]
+    ex, _ = diags.get_field("Ex").get_data(it, field_units="SI")
+    ey, _ = diags.get_field("Ey").get_data(it, field_units="SI")
+    envelope = np.sqrt(np.abs(hilbert(ex)) ** 2 + np.abs(hilbert(ey)) ** 2)
+    a_env, _ = field.get_data(it)
+    np.testing.assert_allclose(
+        a_env, envelope * 0.8e-6 * ct.e / (2 * np.pi * ct.m_e * ct.c**2))
+    # Chunks are not split along z for non-pointwise recipes.
+    chunk = (slice(2, 6), slice(None), slice(10, 20))
+    a_env_chunk, md = field.get_data_chunk(it, chunk)
+    np.testing.assert_allclose(a_env_chunk, a_env[chunk])
+    assert len(md["axis"]["z"]["array"]) == 10
+    # Out of core, the field is split along x instead of z, so that each
+    # slab of the base fields is read only once.
+    ex_field = diags.get_field("Ex")
+    read_chunks = []
+    get_ex_chunk = ex_field.get_data_chunk
+    ex_field.get_data_chunk = lambda it, chunk, **kw: (
+        read_chunks.append(chunk) or get_ex_chunk(it, chunk, **kw))
+    a_env_ooc, _ = field.get_data_out_of_core(it, slab_size=10)
+    del ex_field.get_data_chunk
+    np.testing.assert_allclose(a_env_ooc, a_env)
+    assert len(read_chunks) == int(np.ceil(a_env.shape[0] / 10))
+    assert sum(chunk[0].stop - chunk[0].start
+               for chunk in read_chunks) == a_env.shape[0]
+    # Slices along z are taken after computing the envelope.
+    i_z = int(round(a_env.shape[2] * 0.3))
+    a_env_slice, md = field.get_data(it, slice_dir_i="z", slice_i=0.3)
+    np.testing.assert_allclose(a_env_slice, a_env[:, :, i_z])
+    assert md["field"]["axis_labels"] == ["x", "y"]
+
+
+def test_reduce():
+    """Test chunked reductions against those of the full array."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    field = diags.get_field("I")
+    it = field.timesteps[0]
+    fld, md = field.get_data(it)
+    results = field.reduce(
+        it, ["min", "max", "sum", "std", "p99.9", "integral"],
+        max_chunk_bytes=10000)
+    np.testing.assert_allclose(results["min"], fld.min())
+    np.testing.assert_allclose(results["max"], fld.max())
+    np.testing.assert_allclose(results["sum"], fld.sum())
+    np.testing.assert_allclose(results["std"], fld.std())
+    np.testing.assert_allclose(
+        results["p99.9"], np.percentile(fld, 99.9), rtol=0.01)
+    cell_volume = np.prod([md["axis"][ax]["spacing"] for ax in "xyz"])
+    np.testing.assert_allclose(results["integral"], fld.sum() * cell_volume)
+    z = md["axis"]["z"]["array"]
+    results = field.reduce(it, "max", region={"z": [z[10], z[19]]})
+    np.testing.assert_allclose(results["max"], fld[..., 10:20].max())
+
+
+def test_aggregate_over_time():
+    """Test time-aggregated statistics against those of the stacked data."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    field = diags.get_field("Ez")
+    stats = field.aggregate_over_time(
+        stats=["mean", "rms", "max"], field_units="GV/m", max_in_flight=3)
+    fld_stack, _ = field.iter_timesteps(stack=True, field_units="GV/m")
+    np.testing.assert_allclose(stats["mean"][0], fld_stack.mean(axis=0))
+    np.testing.assert_allclose(
+        stats["rms"][0], np.sqrt(np.mean(fld_stack**2, axis=0)))
+    np.testing.assert_allclose(stats["max"][0], fld_stack.max(axis=0))
+    stats_2 = field.aggregate_over_time(stats=["mean", "abs_max"],
+                                        field_units="GV/m")
+    np.testing.assert_allclose(stats_2["mean"][0], stats["mean"][0])
+    np.testing.assert_allclose(stats_2["abs_max"][0],
+                               np.abs(fld_stack).max(axis=0))
+    md = stats["mean"][1]
+    assert md["field"]["units"] == "GV/m"
+    np.testing.assert_array_equal(md["time"]["timesteps"], field.timesteps)
+
+
+def test_async_access():
+    """Test that the async API returns the same data as the blocking one."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    it = diags.get_field("Ez").timesteps[0]
+    species = diags.get_species("electrons")
+
+    async def gather_data():
+        return await asyncio.gather(
+            diags.get_fields_async(["Ez", "I"], it, max_concurrency=2),
+            species.get_data_async(it, ["x", "pz"]))
+
+    data_cache.clear()
+    fields_data, sp_data = asyncio.run(gather_data())
+    for field_name in ["Ez", "I"]:
+        fld, md = diags.get_field(field_name).get_data(it)
+        np.testing.assert_array_equal(fields_data[field_name][0], fld)
+    np.testing.assert_array_equal(
+        sp_data["x"][0], species.get_data(it, ["x"])["x"][0])
+    # Cached data is also looked up outside of the event loop thread.
+    field = diags.get_field("I")
+    lookup_threads = []
+    get_cached_data = field.get_cached_data
+    field.get_cached_data = lambda *args, **kwargs: (
+        lookup_threads.append(threading.current_thread()) or
+        get_cached_data(*args, **kwargs))
+    fields_data, _ = asyncio.run(gather_data())
+    del field.get_cached_data
+    assert len(lookup_threads) == 1
+    assert lookup_threads[0] is not threading.main_thread()
+
+
+def test_lazy_data():
+    """Test that indexing lazy field data matches the full data."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    for field_name in ["Ez", "I"]:
+        field = diags.get_field(field_name)
+        it = field.timesteps[1]
+        fld, md = field.get_data(it, field_units="SI")
+        lazy_fld, lazy_md = field.get_data(it, field_units="SI", lazy=True)
+        assert lazy_fld.shape == fld.shape
+        for key in [np.s_[..., 10:20], np.s_[3], np.s_[-1, ::-3],
+                    np.s_[[1, 5, 2], None, 4:9:2]]:
+            np.testing.assert_allclose(lazy_fld[key], fld[key], rtol=1e-12)
+        np.testing.assert_allclose(np.asarray(lazy_fld), fld, rtol=1e-12)
+
+
+def test_deposition():
+    """Test the deposition of particles onto a grid."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    species = diags.get_species("electrons")
+    it = species.timesteps[1]
+    data = species.get_data(it, ["q", "w"])
+    # The charge of each macroparticle already includes its weight.
+    total_charge = np.sum(data["q"][0])
+    grid = {"x": 16, "y": 16, "z": 32}
+    for shape in ["ngp", "cic"]:
+        fld, md = species.deposit(it, grid, shape=shape)
+        cell_volume = np.prod([md["axis"][ax]["spacing"] for ax in "xyz"])
+        assert md["field"]["units"] == "C/m^3"
+        np.testing.assert_allclose(fld.sum() * cell_volume, total_charge)
+    n, _ = species.deposit(it, grid, weight="w", density=False)
+    np.testing.assert_allclose(n.sum(), np.sum(data["w"][0]))
+    field = species.get_deposited_field(grid)
+    assert field.get_geometry() == "3dcartesian"
+    data_cache.clear()
+    species.deposit = None  # The metadata must not need a deposition.
+    md_only = field.get_only_metadata(it, field_units="pC/um^3")
+    del species.deposit
+    assert md_only["field"]["units"] == "pC/um^3"
+    for ax in "xyz":
+        np.testing.assert_array_equal(md_only["axis"][ax]["array"],
+                                      md["axis"][ax]["array"])
+    fld_slice, md_slice = field.get_data(it, slice_dir_i="y")
+    assert fld_slice.shape == (16, 32)
+    assert md_slice["field"]["axis_labels"] == ["x", "z"]
+    # 2D deposits have areal densities, which can also be converted.
+    field_2d = species.get_deposited_field({"x": 16, "z": 32}, weight=None)
+    n_2d, md_2d = field_2d.get_data(it)
+    assert md_2d["field"]["units"] == "1/m^2"
+    n_2d_cgs, md_2d_cgs = field_2d.get_data(it, field_units="1/cm^2")
+    assert md_2d_cgs["field"]["units"] == "1/cm^2"
+    np.testing.assert_allclose(n_2d_cgs, n_2d * 1e-4)
+    rho_2d, md_2d = species.deposit(it, {"x": 16, "z": 32})
+    assert md_2d["field"]["units"] == "C/m^2"
+    rho_2d_pc, _ = species.get_deposited_field({"x": 16, "z": 32}).get_data(
+        it, field_units="pC/um^2")
+    np.testing.assert_allclose(rho_2d_pc, rho_2d)
+    # Converting to the units of a volume density is not possible.
+    try:
+        field_2d.get_data(it, field_units="1/cm^3")
+        assert False
+    except ValueError:
+        pass
+
+
+def test_sample_field():
+    """Test the interpolation of fields at the particle positions."""
+    data_path = "./test_data/example-thetaMode/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    species = diags.get_species("electrons")
+    it = species.timesteps[1]
+    theta = 0.7
+    # Linear interpolation at the grid nodes of a plane must give the data
+    # in that plane.
+    for field_name in ["Ez", "Ex", "I"]:
+        field = diags.get_field(field_name)
+        fld, md = field.get_data(it, theta=theta)
+        r, z = np.meshgrid(md["axis"]["r"]["array"],
+                           md["axis"]["z"]["array"], indexing="ij")
+        points = {"x": r.ravel() * np.cos(theta),
+                  "y": r.ravel() * np.sin(theta), "z": z.ravel()}
+        fld_points, _ = field.get_data_at_points(it, points, order=1)
+        np.testing.assert_allclose(fld_points.reshape(fld.shape), fld,
+                                   atol=1e-12 * np.abs(fld).max())
+    # Sampled fields can be used as particle components.
+    field = diags.get_field("Ez")
+    species.add_sampled_field(field)
+    data = species.get_data(it, ["Ez"], data_units="GV/m")
+    fld_sp, md_sp = species.sample_field(field, it)
+    assert data["Ez"][1]["units"] == "GV/m"
+    np.testing.assert_allclose(data["Ez"][0], fld_sp * 1e-9)
+
+
+def test_spatial_index():
+    """Test the spatial queries of particle data against brute force."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    species = diags.get_species("electrons")
+    it = species.timesteps[1]
+    index = species.get_spatial_index(it)
+    assert species.get_spatial_index(it) is index
+    data = species.get_data(it, ["x", "y", "z"])
+    pos = np.column_stack([data[axis][0] for axis in ["x", "y", "z"]])
+    center = np.median(pos, axis=0)
+    radius = np.std(pos[:, 0])
+    dist = np.linalg.norm(pos - center, axis=1)
+    np.testing.assert_array_equal(index.query_radius(center, radius),
+                                  np.where(dist <= radius)[0])
+    region = {"x": [center[0] - radius, center[0] + radius],
+              "z": [center[2] - 2 * radius, center[2]]}
+    in_box = ((pos[:, 0] >= region["x"][0]) & (pos[:, 0] <= region["x"][1]) &
+              (pos[:, 2] >= region["z"][0]) & (pos[:, 2] <= region["z"][1]))
+    np.testing.assert_array_equal(index.query_box(region),
+                                  np.where(in_box)[0])
+    _, nearest = index.query_nearest(center, k=3)
+    np.testing.assert_array_equal(nearest, np.argsort(dist)[:3])
+
+
+def test_track(tmp_path):
+    """Test the tracking of particles by their tag."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path, disk_cache_dir=str(tmp_path))
+    diags.load_data()
+    species = diags.get_species("electrons")
+    tags = species.get_data(species.timesteps[1], ["tag"])["tag"][0][::7]
+    tracked = species.track(tags, ["x", "gamma"], data_units=["um", None])
+    for i, it in enumerate(species.timesteps):
+        data = species.get_data(it, ["tag", "x", "gamma"],
+                                data_units=[None, "um", None])
+        found = np.isin(tags, data["tag"][0])
+        rows = [np.where(data["tag"][0] == tag)[0][0] for tag in tags[found]]
+        for comp in ["x", "gamma"]:
+            np.testing.assert_allclose(tracked[comp][0][found, i],
+                                       data[comp][0][rows])
+            assert np.all(np.isnan(tracked[comp][0][~found, i]))
+        assert tracked["x"][1][i]["units"] == "um"
+    # The tag index is also stored on disk.
+    assert len(list(tmp_path.iterdir())) == 2 * len(species.timesteps)
+    # Only the rows of the tracked particles are read from the files.
+    opmd_reader = species.data_reader._opmd_reader
+    opmd_reader.read_species_data = None  # Components must not be read fully.
+    tracked_2 = species.track(tags, ["x", "gamma"], data_units=["um", None])
+    del opmd_reader.read_species_data
+    for comp in ["x", "gamma"]:
+        np.testing.assert_array_equal(tracked_2[comp][0], tracked[comp][0])
+
+
+def test_slice_analysis():
+    """Test the beam analysis against the one of APtools."""
+    from aptools.data_analysis.beam_diagnostics import general_analysis
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    species = diags.get_species("electrons")
+    comps = ["x", "y", "z", "px", "py", "pz", "q"]
+    data = species.get_data(species.timesteps[1], comps, data_units="SI")
+    beam = [data[comp][0] for comp in comps]
+    params = analyze_beam(*beam, n_slices=5)
+    ref_params = general_analysis(*beam, n_slices=5)
+    assert list(params) == list(ref_params)
+    for param in params:
+        # APtools computes the emittance in single precision.
+        np.testing.assert_allclose(params[param], ref_params[param],
+                                   rtol=1e-5)
+
+
+def test_iter_chunks():
+    """Test the chunked particle reading and beam analysis."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    species = diags.get_species("electrons")
+    it = species.timesteps[1]
+    comps = ["x", "pz", "q", "ekin"]
+    data = species.get_data(it, comps, data_units="SI")
+    chunks = list(species.iter_chunks(it, comps, chunk_size=300,
+                                      data_units="SI"))
+    assert len(chunks) == int(np.ceil(species.get_number_of_particles(it) /
+                                      300))
+    for comp in comps:
+        np.testing.assert_array_equal(
+            np.concatenate([chunk[comp][0] for chunk in chunks]),
+            data[comp][0])
+    # The streaming analysis gives the same results as the in-memory one.
+    filters = {"filter_min": [None, None, -1e-3, None, None, None, None],
+               "filter_sigma": [3, 3, None, None, None, 2, None]}
+    params = analyze_beam_evolution(data_path, "openpmd", "electrons",
+                                    n_slices=5, **filters)
+    params_chunks = analyze_beam_evolution(
+        data_path, "openpmd", "electrons", n_slices=5, chunk_size=128,
+        **filters)
+    for param in params:
+        np.testing.assert_allclose(params_chunks[param], params[param],
+                                   rtol=1e-8)
+
+
+def test_parallel_beam_evolution():
+    """Test that the parallel beam analysis matches the serial one."""
+    data_path = "./test_data/example-3d/hdf5"
+    params = analyze_beam_evolution(data_path, "openpmd", "electrons",
+                                    n_slices=5)
+    params_parallel = analyze_beam_evolution(
+        data_path, "openpmd", "electrons", n_slices=5, parallel=True,
+        n_proc=2)
+    assert list(params_parallel) == list(params)
+    for param in params:
+        np.testing.assert_array_equal(params_parallel[param], params[param])
+
+
+def test_field_evolution(tmp_path):
+    """Test the field evolution analysis against the full field data."""
+    data_path = "./test_data/example-3d/hdf5"
+    params = analyze_field_evolution(
+        data_path, "openpmd", "Ez", diagnostics=["max", "axis_min"],
+        save_to=str(tmp_path))
+    diags = DataContainer("openpmd", data_path)
+    diags.load_data()
+    field = diags.get_field("Ez")
+    lineouts, _ = field.get_lineout("z")
+    for i, it in enumerate(field.timesteps):
+        fld, _ = field.get_data(it)
+        np.testing.assert_allclose(params["max"][i], fld.max())
+        np.testing.assert_allclose(params["axis_min"][i], lineouts[i].min())
+    # A second run reads the results from the output file.
+    params_2 = analyze_field_evolution(
+        data_path, "openpmd", "Ez", diagnostics=["max", "axis_min"],
+        save_to=str(tmp_path))
+    np.testing.assert_array_equal(params_2["max"], params["max"])
+    # Parallel workers load only the analyzed time steps.
+    params_3 = analyze_field_evolution(
+        data_path, "openpmd", "Ez", diagnostics=["max", "axis_min"],
+        t_step_range=[100, 200], parallel=True, n_proc=2)
+    for diag in ["max", "axis_min"]:
+        np.testing.assert_array_equal(params_3[diag], params[diag][1:3])
+
+
+def test_adaptive_sampling():
+    """Test the adaptive time step sampling of the evolution analyses."""
+    data_path = "./test_data/example-3d/hdf5"
+    params = analyze_field_evolution(data_path, "openpmd", "Ez",
+                                     diagnostics=["max", "axis_min"])
+    # Without refinement, only the initial time steps are analyzed.
+    params_coarse = analyze_field_evolution(
+        data_path, "openpmd", "Ez", diagnostics=["max", "axis_min"],
+        adaptive=True, adaptive_tol=10, adaptive_n_initial=2)
+    analyzed = np.isfinite(params_coarse["refinement_level"])
+    np.testing.assert_array_equal(analyzed, [True, False, False, True])
+    np.testing.assert_array_equal(np.isnan(params_coarse["max"]), ~analyzed)
+    np.testing.assert_array_equal(params_coarse["max"][analyzed],
+                                  params["max"][analyzed])
+    # With a tolerance of 0, all time steps are eventually analyzed.
+    params_fine = analyze_field_evolution(
+        data_path, "openpmd", "Ez", diagnostics=["max", "axis_min"],
+        adaptive=True, adaptive_tol=0, adaptive_n_initial=2)
+    np.testing.assert_array_equal(params_fine["refinement_level"],
+                                  [0, 1, 2, 0])
+    np.testing.assert_array_equal(params_fine["max"], params["max"])
+
+
+def test_disk_cache(tmp_path):
+    """Test that derived fields are reused from the disk cache."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path, disk_cache_dir=str(tmp_path))
+    diags.load_data()
+    field = diags.get_field("I")
+    it = field.timesteps[0]
+    fld, md = field.get_data(it, field_units="W/cm^2")
+    assert len(list(tmp_path.iterdir())) == 1
+    data_cache.clear()
+    diags = DataContainer("openpmd", data_path, disk_cache_dir=str(tmp_path))
+    diags.load_data()
+    field = diags.get_field("I")
+    field.calculate_from_base_data = None  # Data must come from the cache.
+    fld_disk, md_disk = field.get_data(it, field_units="W/cm^2")
+    np.testing.assert_array_equal(fld_disk, fld)
+    assert md_disk["field"]["units"] == "W/cm^2"
+
+
+def test_analysis_checkpoint(tmp_path):
+    """Test resuming the evolution analyses from the output file."""
+    data_path = str(tmp_path / "data")
+    shutil.copytree("./test_data/example-3d/hdf5", data_path)
+    save_to = str(tmp_path)
+    file_path = os.path.join(save_to, "beam_params.h5")
+    params = analyze_beam_evolution(data_path, "openpmd", "electrons",
+                                    n_slices=5)
+
+    def get_checkpoints():
+        with h5py.File(file_path, "r") as f:
+            return [f["checkpoints"][name]["time_steps"][()]
+                    for name in f["checkpoints"]]
+
+    # Extending the range of time steps resumes the analysis.
+    params_1 = analyze_beam_evolution(data_path, "openpmd", "electrons",
+                                      n_slices=5, t_step_range=[0, 100],
+                                      save_to=save_to)
+    np.testing.assert_array_equal(get_checkpoints()[0], [0, 100])
+    for _ in range(2):
+        params_2 = analyze_beam_evolution(data_path, "openpmd", "electrons",
+                                          n_slices=5, save_to=save_to)
+        checkpoints = get_checkpoints()
+        assert len(checkpoints) == 1
+        np.testing.assert_array_equal(checkpoints[0], [0, 100, 200, 300])
+    for param in params:
+        np.testing.assert_array_equal(params_1[param], params[param][:2])
+        np.testing.assert_array_equal(params_2[param], params[param])
+    # Modifying the data files of a time step discards only its results.
+    analyze_field_evolution(data_path, "openpmd", "Ez", save_to=save_to)
+
+    def get_signatures(file_name):
+        with h5py.File(os.path.join(save_to, file_name), "r") as f:
+            assert len(f["checkpoints"]) == 1
+            group = next(iter(f["checkpoints"].values()))
+            return group["time_steps"][()], group["signatures"][()]
+
+    _, beam_sigs = get_signatures("beam_params.h5")
+    _, field_sigs = get_signatures("field_params.h5")
+    data_file = os.path.join(data_path, "data00000200.h5")
+    stat = os.stat(data_file)
+    os.utime(data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    params_3 = analyze_beam_evolution(data_path, "openpmd", "electrons",
+                                      n_slices=5, save_to=save_to)
+    analyze_field_evolution(data_path, "openpmd", "Ez", save_to=save_to)
+    for file_name, old_sigs in [("beam_params.h5", beam_sigs),
+                                ("field_params.h5", field_sigs)]:
+        time_steps, sigs = get_signatures(file_name)
+        np.testing.assert_array_equal(time_steps, [0, 100, 200, 300])
+        np.testing.assert_array_equal(sigs != old_sigs,
+                                      [False, False, True, False])
+    for param in params:
+        np.testing.assert_array_equal(params_3[param], params[param])
+    # Saving the results of another analysis removes the previous results
+    # and checkpoints.
+    analyze_beam_evolution(data_path, "openpmd", "electrons", n_slices=5,
+                           save_to=save_to, adaptive=True,
+                           adaptive_n_initial=2)
+    with h5py.File(file_path, "r") as f:
+        assert "refinement_level" in f
+    params_4 = analyze_beam_evolution(data_path, "openpmd", "electrons",
+                                      n_slices=3, save_to=save_to)
+    with h5py.File(file_path, "r") as f:
+        assert sorted(name for name in f if name != "checkpoints") == \
+            sorted(params_4)
+        assert len(f["checkpoints"]) == 1
+    # Time steps without results are stored as such.
+    checkpoint = AnalysisCheckpoint(str(tmp_path / "checkpoint.h5"), ("id",))
+    checkpoint.append(0, {"a": 1.})
+    checkpoint.append(100, None)
+    checkpoint.append(200, {"a": 2., "b": 3.})
+    checkpoint.close()
+    checkpoint = AnalysisCheckpoint(str(tmp_path / "checkpoint.h5"), ("id",))
+    completed = checkpoint.get_completed()
+    checkpoint.close()
+    assert list(completed) == [0, 100, 200]
+    assert completed[0]["a"] == 1. and np.isnan(completed[0]["b"])
+    assert completed[100] is None
+    assert completed[200] == {"a": 2., "b": 3.}
+
+
 if __name__ == "__main__":
     test_data_container()
+    test_get_fields()
+    test_out_of_core(pathlib.Path(tempfile.mkdtemp()))
+    test_derived_particle_data()
+    test_iter_timesteps()
+    test_lineout_and_probe()
+    test_theta_mode_3d()
+    test_laser_envelope()
+    test_reduce()
+    test_aggregate_over_time()
+    test_async_access()
+    test_lazy_data()
+    test_deposition()
+    test_sample_field()
+    test_spatial_index()
+    test_track(pathlib.Path(tempfile.mkdtemp()))
+    test_slice_analysis()
+    test_iter_chunks()
+    test_parallel_beam_evolution()
+    test_field_evolution(pathlib.Path(tempfile.mkdtemp()))
+    test_adaptive_sampling()
+    test_disk_cache(pathlib.Path(tempfile.mkdtemp()))
+    test_analysis_checkpoint(pathlib.Path(tempfile.mkdtemp()))
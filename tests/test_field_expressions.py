@@ -0,0 +1,38 @@
+import numpy as np
+import scipy.constants as ct
+
+from visualpic import DataContainer
+from visualpic.data_handling.field_expressions import FieldExpression
+
+
+def test_field_expression():
+    """Test the blocked evaluation of field expressions."""
+    x = np.linspace(-1, 1, 1000).reshape(100, 10)
+    y = np.linspace(0, 3, 1000).reshape(100, 10)
+    expr = FieldExpression("-(x - y) * maximum(x, 2 * y) / (1 + x**2) + e")
+    result = expr.evaluate({"x": x, "y": y}, {"e": 2.0}, block_size=64)
+    expected = -(x - y) * np.maximum(x, 2 * y) / (1 + x**2) + 2.0
+    np.testing.assert_allclose(result, expected)
+    assert expr.get_names() == {"x", "y", "e"}
+
+
+def test_derived_field_expressions():
+    """Test that derived field expressions match the explicit formulas."""
+    data_path = "./test_data/example-3d/hdf5"
+    diags = DataContainer("openpmd", data_path, laser_wavelength=0.8e-6)
+    diags.load_data()
+    it = diags.get_field("Ez").timesteps[0]
+    E2 = sum(
+        diags.get_field(name).get_data(it)[0].astype(float) ** 2
+        for name in ["Ez", "Ex", "Ey"]
+    )
+    intensity, _ = diags.get_field("I").get_data(it)
+    np.testing.assert_allclose(intensity, ct.c * ct.epsilon_0 / 2 * E2)
+    a, _ = diags.get_field("a").get_data(it)
+    k_0 = 2 * np.pi / 0.8e-6
+    np.testing.assert_allclose(a, np.sqrt(E2) / k_0 / (ct.m_e * ct.c**2 / ct.e))
+
+
+if __name__ == "__main__":
+    test_field_expression()
+    test_derived_field_expressions()
@@ -0,0 +1,37 @@
+import numpy as np
+import scipy.constants as ct
+
+from visualpic.data_handling.unit_converters import OsirisUnitConverter
+
+
+def test_conversion_plans():
+    """Test single-pass unit conversion with cached plans."""
+    uc = OsirisUnitConverter(plasma_density=1e23)
+    factor, units = uc.get_conversion_plan("m_ec", "MeV/c")
+    assert units == "MeV/c"
+    np.testing.assert_allclose(factor, 1e-6 * ct.m_e * ct.c**2 / ct.e)
+    assert uc.get_conversion_plan("m_ec", "MeV/c") is (
+        uc.get_conversion_plan("m_ec", "MeV/c"))
+
+    # In-place conversion of particle data.
+    pz = np.ones(10)
+    md = {"units": "m_ec", "time": {"value": 1.0, "units": "1/\\omega_p"}}
+    data = uc.convert_particle_data_units(
+        {"pz": (pz, md)}, target_data_units={"pz": "MeV/c"},
+        target_time_units="fs", in_place=True)
+    assert data["pz"][0] is pz
+    np.testing.assert_allclose(pz, factor)
+    assert md["units"] == "MeV/c"
+    assert md["time"]["units"] == "fs"
+
+    # Read-only data is not modified.
+    pz_ro = np.ones(10)
+    pz_ro.flags.writeable = False
+    data = uc.convert_particle_data_units(
+        {"pz": (pz_ro, {"units": "m_ec"})}, target_data_units={"pz": "SI"},
+        in_place=True)
+    np.testing.assert_array_equal(pz_ro, 1.0)
+
+
+if __name__ == "__main__":
+    test_conversion_plans()
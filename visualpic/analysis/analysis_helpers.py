@@ -0,0 +1,426 @@
+"""
+This file is part of VisualPIC.
+
+The module contains the methods shared by the analyses of the evolution of
+the simulation data (running the analysis of each time step in parallel or
+on an adaptive subset of time steps, checkpointing and saving the results).
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+
+import numpy as np
+from tqdm import tqdm
+import h5py
+
+
+# Analysis function and data of each worker process of a parallel analysis
+# (set by `_init_worker`).
+_worker_function = None
+_worker_data = None
+
+# Datasets of a checkpoint group which are not analysis variables.
+CHECKPOINT_DATASETS = ['time_steps', 'valid', 'signatures']
+
+
+def run_timestep_analysis(analyze_timestep, time_steps, data, load_data,
+                          load_args, parallel=False, n_proc=None,
+                          checkpoint=None, desc='Analyzing... '):
+    """
+    Run the analysis of each time step, serially or in parallel.
+
+    Parameters
+    ----------
+
+    analyze_timestep : callable
+        Function with signature `analyze_timestep(time_step, data)` which
+        returns a dictionary with the scalar results of a time step (or
+        None). For parallel runs it must be picklable (e.g., a module-level
+        function or a `functools.partial` of it).
+
+    time_steps : list
+        Time steps to analyze.
+
+    data : object
+        Data needed by `analyze_timestep` (e.g., a ParticleSpecies), used
+        in serial runs.
+
+    load_data, load_args : callable, tuple
+        Function (and its arguments) which loads `data`. In parallel runs,
+        it is called only once by each worker process, so that only the time
+        steps are sent to the workers.
+
+    parallel : bool
+        Whether to run the analysis in parallel.
+
+    n_proc : int
+        (Optional) Number of processes. By default, the number of CPUs.
+
+    checkpoint : AnalysisCheckpoint
+        (Optional) Checkpoint from which the time steps already analyzed
+        are read, and where each new result is stored as soon as it is
+        available.
+
+    desc : str
+        Description shown in the progress bar.
+
+    Returns
+    -------
+    A list with the result of each time step.
+    """
+    try:
+        return _analyze_timesteps(analyze_timestep, time_steps, data,
+                                  load_data, load_args, parallel, n_proc,
+                                  checkpoint, desc)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+def run_adaptive_timestep_analysis(
+        analyze_timestep, time_steps, data, load_data, load_args,
+        tolerance=0.05, monitored_vars=None, n_initial=9, parallel=False,
+        n_proc=None, checkpoint=None, desc='Analyzing... '):
+    """
+    Run the analysis of a coarse subset of the time steps and refine it only
+    where the results change quickly.
+
+    First, `n_initial` evenly-spaced time steps are analyzed. Then, each
+    interval between consecutive analyzed time steps is split in two (by
+    analyzing its central time step) if any of the monitored variables
+    changes between its ends by more than `tolerance` times the range of
+    the variable among all analyzed time steps, or if only one of its ends
+    has a result. This is repeated until no interval needs to be refined.
+
+    Parameters
+    ----------
+
+    analyze_timestep, time_steps, data, load_data, load_args :
+        Same as in `run_timestep_analysis`.
+
+    tolerance : float
+        Maximum change of the monitored variables between consecutive
+        analyzed time steps, relative to their range.
+
+    monitored_vars : list
+        (Optional) Names of the variables which determine the refinement.
+        By default, all variables.
+
+    n_initial : int
+        Number of time steps analyzed in the first round.
+
+    parallel, n_proc, checkpoint, desc : optional
+        Same as in `run_timestep_analysis`. In parallel runs, the time steps
+        of each refinement round are analyzed in parallel.
+
+    Returns
+    -------
+    A tuple with a list with the result of each time step (None for the
+    time steps which were skipped) and an array with the refinement round
+    in which each time step was analyzed (NaN for skipped time steps).
+    """
+    if n_initial < 2:
+        raise ValueError('At least 2 time steps must be analyzed initially.')
+    time_steps = list(time_steps)
+    n_steps = len(time_steps)
+    results = [None] * n_steps
+    refinement_level = np.full(n_steps, np.nan)
+    indices = np.unique(np.round(
+        np.linspace(0, n_steps - 1, min(n_initial, n_steps))).astype(int))
+    i_round = 0
+    try:
+        while len(indices) > 0:
+            round_results = _analyze_timesteps(
+                analyze_timestep, [time_steps[i] for i in indices], data,
+                load_data, load_args, parallel, n_proc, checkpoint,
+                desc + '(round {}) '.format(i_round))
+            for i, result in zip(indices, round_results):
+                results[i] = result
+            refinement_level[indices] = i_round
+            analyzed = np.nonzero(np.isfinite(refinement_level))[0]
+            indices = _get_refinement_indices(
+                [results[i] for i in analyzed], analyzed, tolerance,
+                monitored_vars)
+            i_round += 1
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    return results, refinement_level
+
+
+def _analyze_timesteps(analyze_timestep, time_steps, data, load_data,
+                       load_args, parallel, n_proc, checkpoint, desc):
+    """
+    Analyze the time steps which are not in the checkpoint (see
+    `run_timestep_analysis`), without closing the checkpoint.
+    """
+    completed = {}
+    if checkpoint is not None:
+        completed = checkpoint.get_completed()
+    pending_steps = [ts for ts in time_steps if ts not in completed]
+    tqdm_params = {'ascii': True, 'desc': desc}
+    if parallel and len(pending_steps) > 0:
+        if n_proc is None:
+            n_proc = cpu_count()
+        n_proc = max(1, min(n_proc, len(pending_steps)))
+        # Only the time steps are sent to the workers and only arrays of
+        # values are sent back. A few chunks per worker balance the load.
+        chunk_size = max(1, int(np.ceil(len(pending_steps) /
+                                        (4 * n_proc))))
+        init_args = (analyze_timestep, load_data, load_args)
+        with ProcessPoolExecutor(n_proc, initializer=_init_worker,
+                                 initargs=init_args) as executor:
+            results = executor.map(_analyze_timestep_in_worker,
+                                   pending_steps, chunksize=chunk_size)
+            for time_step, result in zip(
+                    pending_steps,
+                    tqdm(results, total=len(pending_steps), **tqdm_params)):
+                if result is not None:
+                    result = dict(zip(*result))
+                completed[time_step] = result
+                if checkpoint is not None:
+                    checkpoint.append(time_step, result)
+    else:
+        for time_step in tqdm(pending_steps, **tqdm_params):
+            result = analyze_timestep(time_step, data)
+            completed[time_step] = result
+            if checkpoint is not None:
+                checkpoint.append(time_step, result)
+    return [completed[ts] for ts in time_steps]
+
+
+def _get_refinement_indices(results, indices, tolerance, monitored_vars):
+    """
+    Get the indices of the time steps which split the intervals between
+    the analyzed time steps (with the given indices and results) which need
+    to be refined.
+    """
+    valid_results = [res for res in results if res is not None]
+    if len(valid_results) == 0:
+        return np.array([], dtype=int)
+    if monitored_vars is None:
+        monitored_vars = list(valid_results[0])
+    for var in monitored_vars:
+        if var not in valid_results[0]:
+            raise ValueError(
+                "Unknown monitored variable '{}'. ".format(var) +
+                "Available variables are {}.".format(list(valid_results[0])))
+    values = np.array([[res[var] if res is not None else np.nan
+                        for var in monitored_vars] for res in results],
+                      dtype=np.float64)
+    finite = np.isfinite(values)
+    with np.errstate(invalid='ignore'):
+        scale = (np.nanmax(np.where(finite, values, -np.inf), axis=0) -
+                 np.nanmin(np.where(finite, values, np.inf), axis=0))
+        change = np.abs(np.diff(values, axis=0))
+        refine = np.any(change > tolerance * scale, axis=1)
+    # Intervals where the variables become (or stop being) available.
+    refine |= np.any(finite[1:] != finite[:-1], axis=1)
+    refine &= np.diff(indices) > 1
+    return (indices[:-1][refine] + indices[1:][refine]) // 2
+
+
+def group_timestep_results(ts_params):
+    """
+    Group the results of each time step into one array per variable. Time
+    steps without results are filled with NaN.
+    """
+    var_arrays_dict = {}
+    for var in _first_true(ts_params).keys():
+        var_array = np.zeros(len(ts_params))
+        for i, ts in enumerate(ts_params):
+            if ts is not None:
+                var_array[i] = ts[var]
+            else:
+                var_array[i] = np.nan
+        var_arrays_dict[var] = var_array
+    return var_arrays_dict
+
+
+def save_results(file_path, var_arrays_dict, units, analysis_id=None):
+    """
+    Save the results of an analysis to an HDF5 file, with one dataset per
+    variable. `units` is a callable which returns the units of a variable.
+    The results of previous analyses saved to the same file are removed,
+    as well as their checkpoints unless they belong to the analysis with
+    the given `analysis_id` (see `AnalysisCheckpoint`).
+    """
+    with h5py.File(file_path, 'a') as f:
+        for name in list(f):
+            if isinstance(f[name], h5py.Dataset):
+                del f[name]
+        if 'checkpoints' in f:
+            for name in list(f['checkpoints']):
+                if (analysis_id is None or
+                        name != get_checkpoint_name(analysis_id)):
+                    del f['checkpoints'][name]
+        for var, arr in var_arrays_dict.items():
+            dset = f.create_dataset(var, data=arr)
+            dset.attrs['units'] = units(var)
+
+
+def get_output_path(save_to, saved_file_name):
+    """Get the path of the output file of an analysis."""
+    if not saved_file_name.endswith('.h5'):
+        saved_file_name += '.h5'
+    return os.path.join(save_to, saved_file_name)
+
+
+def get_timestep_signature(data, time_step):
+    """
+    Get a hash of the signature (path, modification time and size) of the
+    files of a field or species at a given time step.
+    """
+    source = repr(data._get_source_signature(time_step))
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+def get_checkpoint_name(analysis_id):
+    """Get the name of the checkpoint group of an analysis."""
+    return hashlib.sha256(repr(analysis_id).encode()).hexdigest()[:16]
+
+
+class AnalysisCheckpoint():
+
+    """
+    Storage of the results of each time step in the output file of an
+    analysis, so that an interrupted or extended analysis can be resumed.
+
+    The results are stored in the group 'checkpoints/<hash>', where the hash
+    identifies the analysis parameters. The group contains the analyzed time
+    steps, the signature of the data files of each of them (see
+    `get_timestep_signature`), whether a result was obtained for each of
+    them and the value of each variable. The results of a time step whose
+    data files have changed are discarded, without affecting the rest.
+    """
+
+    def __init__(self, file_path, analysis_id, data=None):
+        """
+        Open (or create) the checkpoint.
+
+        Parameters
+        ----------
+
+        file_path : str
+            Path to the output HDF5 file.
+
+        analysis_id : tuple
+            Parameters identifying the analysis.
+
+        data : object
+            (Optional) Field or species being analyzed, used to check that
+            the data files of each stored time step have not changed.
+        """
+        group_name = 'checkpoints/' + get_checkpoint_name(analysis_id)
+        self.data = data
+        self.file = h5py.File(file_path, 'a')
+        if group_name in self.file:
+            self.group = self.file[group_name]
+        else:
+            self.group = self.file.create_group(group_name, track_order=True)
+            self.group.attrs['analysis_id'] = repr(analysis_id)
+            for name, dtype in [('time_steps', np.int64), ('valid', bool),
+                                ('signatures', 'S16')]:
+                self.group.create_dataset(name, shape=(0,), maxshape=(None,),
+                                          dtype=dtype)
+        self.var_names = [name for name in self.group
+                          if name not in CHECKPOINT_DATASETS]
+        self._rows = {ts: i for i, ts in
+                      enumerate(self.group['time_steps'][()])}
+        self._signatures = {}
+
+    def get_completed(self):
+        """
+        Get the results stored in the checkpoint, as a dictionary relating
+        each time step to its results (or None). Time steps whose data files
+        have changed are not included.
+        """
+        time_steps = self.group['time_steps'][()]
+        valid = self.group['valid'][()]
+        signatures = self.group['signatures'][()]
+        values = {var: self.group[var][()] for var in self.var_names}
+        completed = {}
+        for i, time_step in enumerate(time_steps):
+            if signatures[i] != self._get_signature(time_step):
+                continue
+            completed[time_step] = None
+            if valid[i]:
+                completed[time_step] = {
+                    var: values[var][i] for var in self.var_names}
+        return completed
+
+    def append(self, time_step, ts_params):
+        """
+        Store the results of a time step (or None), replacing those of
+        previous data files of the same time step.
+        """
+        n = len(self.group['time_steps'])
+        if ts_params is not None:
+            for var in ts_params:
+                if var not in self.var_names:
+                    self.group.create_dataset(
+                        var, data=np.full(n, np.nan), maxshape=(None,))
+                    self.var_names.append(var)
+        row = self._rows.get(time_step, n)
+        if row == n:
+            for name in CHECKPOINT_DATASETS + self.var_names:
+                self.group[name].resize((n + 1,))
+            self._rows[time_step] = row
+        self.group['time_steps'][row] = time_step
+        self.group['valid'][row] = ts_params is not None
+        self.group['signatures'][row] = self._get_signature(time_step)
+        for var in self.var_names:
+            value = np.nan
+            if ts_params is not None and var in ts_params:
+                value = ts_params[var]
+            self.group[var][row] = value
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def _get_signature(self, time_step):
+        """Get the signature of the data files of a time step."""
+        if self.data is None or time_step not in self.data.timesteps:
+            return b''
+        if time_step not in self._signatures:
+            self._signatures[time_step] = get_timestep_signature(
+                self.data, time_step).encode()
+        return self._signatures[time_step]
+
+
+def _init_worker(analyze_timestep, load_data, load_args):
+    """Load the data in a worker process of a parallel analysis."""
+    global _worker_function, _worker_data
+    _worker_function = analyze_timestep
+    _worker_data = load_data(*load_args)
+
+
+def _analyze_timestep_in_worker(time_step):
+    """
+    Analyze a time step in a worker process. The result is returned as a
+    tuple with the variable names and an array with their values.
+    """
+    ts_params = _worker_function(time_step, _worker_data)
+    if ts_params is None:
+        return None
+    return tuple(ts_params), np.array(list(ts_params.values()))
+
+
+def _first_true(iterable, default=False, pred=None):
+    """Returns the first true value in the iterable.
+
+    If no true value is found, returns *default*
+
+    If *pred* is not None, returns the first item
+    for which pred(item) is true.
+
+    From https://docs.python.org/3/library/itertools.html#itertools-recipes.
+
+    """
+    return next(filter(pred, iterable), default)
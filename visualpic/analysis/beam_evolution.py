@@ -10,16 +10,21 @@ License: GNU GPL-3.0.
 
 import os
 from functools import partial
-from multiprocessing import cpu_count
 
 import numpy as np
-from tqdm import tqdm
-from tqdm.contrib.concurrent import process_map
-import h5py
-import aptools.data_analysis.beam_diagnostics as bd
-import aptools.data_processing.beam_filtering as bf
 
 from visualpic.data_handling.data_container import DataContainer
+from visualpic.data_handling.reductions import StreamingMoments
+from visualpic.analysis.slice_analysis import (
+    analyze_beam, StreamingBeamAnalysis)
+from visualpic.analysis.analysis_helpers import (
+    run_timestep_analysis, run_adaptive_timestep_analysis,
+    group_timestep_results, save_results, get_output_path,
+    AnalysisCheckpoint)
+
+
+# Components of the beam, in the same order as the filters.
+BEAM_COMPONENTS = ['x', 'y', 'z', 'px', 'py', 'pz', 'q']
 
 
 def analyze_beam_evolution(
@@ -28,7 +33,9 @@ def analyze_beam_evolution(
         filter_min=[None, None, None, None, None, None, None],
         filter_max=[None, None, None, None, None, None, None],
         filter_sigma=[None, None, None, None, None, None, None], save_to=None,
-        saved_file_name='beam_params.h5', parallel=False, n_proc=None):
+        saved_file_name='beam_params.h5', parallel=False, n_proc=None,
+        chunk_size=None, adaptive=False, adaptive_tol=0.05,
+        adaptive_params=None, adaptive_n_initial=9):
     # Load data.
     print('Scanning simulation folder... ', end='', flush=True)
     dc = DataContainer(sim_code, sim_path, plasma_density)
@@ -40,83 +47,195 @@ def analyze_beam_evolution(
         time_steps = time_steps[np.where((time_steps >= t_step_range[0]) &
                                          (time_steps <= t_step_range[1]))]
 
-    # Analyze beam.
-    tqdm_params = {'ascii': True, 'desc': 'Analyzing beam evolution... '}
-    if parallel:
-        if n_proc is None:
-            n_proc = cpu_count()
-        part = partial(
-            _analyze_beam_timestep, beam=beam, n_slices=n_slices,
-            slice_len=slice_len, filter_min=filter_min, filter_max=filter_max,
-            filter_sigma=filter_sigma)
-        ts_params = process_map(part, time_steps, max_workers=n_proc,
-                                **tqdm_params)
+    # Time steps already analyzed (with the same parameters and data files)
+    # in previous runs are read from the output file instead of being
+    # computed again.
+    checkpoint = None
+    if save_to is not None:
+        file_path = get_output_path(save_to, saved_file_name)
+        analysis_id = (sim_code.lower(), os.path.abspath(sim_path),
+                       species_name, plasma_density, n_slices, slice_len,
+                       list(filter_min), list(filter_max), list(filter_sigma))
+        checkpoint = AnalysisCheckpoint(file_path, analysis_id, beam)
+
+    # Analyze beam. Each result is stored in the output file as soon as it
+    # is available. In parallel runs, each worker loads its own data
+    # container. If a `chunk_size` is given, the beam is read in chunks of
+    # at most `chunk_size` particles, so that the memory usage is bounded.
+    analyze_timestep = partial(
+        _analyze_beam_timestep, n_slices=n_slices, slice_len=slice_len,
+        filter_min=filter_min, filter_max=filter_max,
+        filter_sigma=filter_sigma, chunk_size=chunk_size)
+    load_args = (sim_code, sim_path, plasma_density, species_name,
+                 list(time_steps))
+    run_args = (analyze_timestep, time_steps, beam, _load_beam, load_args)
+    run_kwargs = {'parallel': parallel, 'n_proc': n_proc,
+                  'checkpoint': checkpoint,
+                  'desc': 'Analyzing beam evolution... '}
+    # In adaptive mode, only the time steps needed to resolve the evolution
+    # of the `adaptive_params` (all by default) within `adaptive_tol` (see
+    # `run_adaptive_timestep_analysis`) are analyzed. The other time steps
+    # are NaN, and the round in which each time step was analyzed is stored
+    # in 'refinement_level'.
+    if adaptive:
+        ts_params, refinement_level = run_adaptive_timestep_analysis(
+            *run_args, tolerance=adaptive_tol,
+            monitored_vars=adaptive_params, n_initial=adaptive_n_initial,
+            **run_kwargs)
     else:
-        ts_params = []
-        for i, time_step in enumerate(tqdm(time_steps, **tqdm_params)):
-            ts_params.append(
-                _analyze_beam_timestep(time_step, beam, n_slices, slice_len,
-                                       filter_min, filter_max, filter_sigma))
+        ts_params = run_timestep_analysis(*run_args, **run_kwargs)
 
     # Group time steps parameters into arrays.
-    var_arrays_dict = {}
-    for var in _first_true(ts_params).keys():
-        var_array = np.zeros(len(ts_params))
-        for i, ts in enumerate(ts_params):
-            if ts is not None:
-                var_array[i] = ts[var]
-            else:
-                var_array[i] = np.nan
-        var_arrays_dict[var] = var_array
+    var_arrays_dict = group_timestep_results(ts_params)
+    if adaptive:
+        var_arrays_dict['refinement_level'] = refinement_level
 
     print('Done.')
 
     # Save to file.
     if save_to is not None:
         print('Saving to file... ', end='')
-        if not saved_file_name.endswith('.h5'):
-            saved_file_name += '.h5'
-        file_path = os.path.join(save_to, saved_file_name)
-        with h5py.File(file_path, 'w') as f:
-            for var, arr in var_arrays_dict.items():
-                dset = f.create_dataset(var, data=arr)
-                dset.attrs['units'] = _get_data_units(var)
+        save_results(file_path, var_arrays_dict, _get_data_units,
+                     analysis_id)
         print('Done.')
 
     return var_arrays_dict
 
 
+def _load_beam(sim_code, sim_path, plasma_density, species_name, time_steps):
+    """Load the species data (in the worker processes)."""
+    dc = DataContainer(sim_code, sim_path, plasma_density)
+    dc.load_data(iterations=time_steps)
+    return dc.get_species(species_name)
+
+
 def _analyze_beam_timestep(time_step, beam, n_slices, slice_len, filter_min,
-                           filter_max, filter_sigma):
-    data = beam.get_data(time_step, ['x', 'y', 'z', 'px', 'py', 'pz', 'q'],
-                         data_units='SI')
-    x, *_ = data['x']
-    y, *_ = data['y']
-    z, *_ = data['z']
-    px, *_ = data['px']
-    py, *_ = data['py']
-    pz, *_ = data['pz']
-    q, *_ = data['q']
-
-    if len(x) <= 1:
-        return None
+                           filter_max, filter_sigma, chunk_size=None):
+    if chunk_size is not None:
+        return _analyze_beam_timestep_in_chunks(
+            time_step, beam, n_slices, slice_len, filter_min, filter_max,
+            filter_sigma, chunk_size)
+    data = beam.get_data(time_step, BEAM_COMPONENTS, data_units='SI')
+    data = {comp: comp_data for comp, (comp_data, _) in data.items()}
 
     # Apply filters
-    if any(el is not None for el in filter_min + filter_max):
-        x, y, z, px, py, pz, q = bf.filter_beam(
-            np.array([x, y, z, px, py, pz, q]), filter_min, filter_max)
-        if len(x) <= 1:
+    mask = _get_range_mask(data, filter_min, filter_max)
+    if np.count_nonzero(mask) <= 1:
+        return None
+    if any(el is not None for el in filter_sigma):
+        moments = _get_filter_moments(filter_sigma)
+        moments.update([data[comp][mask] for comp in _sigma_comps(
+            filter_sigma)], np.abs(data['q'][mask]))
+        mask &= _get_range_mask(data, *_get_sigma_limits(moments,
+                                                         filter_sigma))
+        if np.count_nonzero(mask) <= 1:
             return None
+    if not np.all(mask):
+        data = {comp: comp_data[mask] for comp, comp_data in data.items()}
 
+    # Analyze beam
+    return analyze_beam(*[data[comp] for comp in BEAM_COMPONENTS],
+                        n_slices=n_slices, len_slice=slice_len)
+
+
+def _analyze_beam_timestep_in_chunks(time_step, beam, n_slices, slice_len,
+                                     filter_min, filter_max, filter_sigma,
+                                     chunk_size):
+    """
+    Analyze the beam reading only `chunk_size` particles at a time. The
+    data is read several times: to compute the sigma filters (if any), to
+    find the longitudinal range of the beam and to compute the beam
+    moments.
+    """
+    def iter_filtered_chunks(components, sigma_limits=None):
+        # Read only the requested components and those needed by the
+        # filters.
+        comps_to_read = list(components)
+        for comp, f_min, f_max, f_sigma in zip(
+                BEAM_COMPONENTS, filter_min, filter_max, filter_sigma):
+            needed = (f_min is not None or f_max is not None or
+                      (sigma_limits is not None and f_sigma is not None))
+            if needed and comp not in comps_to_read:
+                comps_to_read.append(comp)
+        for data in beam.iter_chunks(time_step, comps_to_read, chunk_size,
+                                     data_units='SI'):
+            data = {comp: comp_data for comp, (comp_data, _) in data.items()}
+            mask = _get_range_mask(data, filter_min, filter_max)
+            if sigma_limits is not None:
+                mask &= _get_range_mask(data, *sigma_limits)
+            yield [data[comp][mask] for comp in components]
+
+    sigma_limits = None
     if any(el is not None for el in filter_sigma):
-        x, y, z, px, py, pz, q = bf.filter_beam_sigma(
-            np.array([x, y, z, px, py, pz, q]), filter_sigma, w=q)
-        if len(x) <= 1:
+        moments = _get_filter_moments(filter_sigma)
+        sigma_comps = _sigma_comps(filter_sigma)
+        for chunk in iter_filtered_chunks(sigma_comps + ['q']):
+            moments.update(chunk[:-1], np.abs(chunk[-1]))
+        if moments.count[0] <= 1:
             return None
+        sigma_limits = _get_sigma_limits(moments, filter_sigma)
+
+    # The longitudinal range is needed to define the slices.
+    n_particles = 0
+    z_min = np.inf
+    z_max = -np.inf
+    for z, in iter_filtered_chunks(['z'], sigma_limits):
+        if len(z) > 0:
+            z_min = min(z_min, np.min(z))
+            z_max = max(z_max, np.max(z))
+            n_particles += len(z)
+    if n_particles <= 1:
+        return None
 
     # Analyze beam
-    return bd.general_analysis(x, y, z, px, py, pz, q, n_slices=n_slices,
-                               len_slice=slice_len)
+    analysis = StreamingBeamAnalysis(z_min, z_max, n_slices=n_slices,
+                                     len_slice=slice_len)
+    for chunk in iter_filtered_chunks(BEAM_COMPONENTS, sigma_limits):
+        analysis.update(*chunk)
+    return analysis.get_results()
+
+
+def _get_range_mask(data, filter_min, filter_max):
+    """
+    Get a mask of the particles within the given range of each component
+    (as in `aptools.data_processing.beam_filtering.filter_beam`).
+    """
+    mask = np.ones(len(next(iter(data.values()))), dtype=bool)
+    for comp, f_min, f_max in zip(BEAM_COMPONENTS, filter_min, filter_max):
+        if f_min is not None:
+            mask &= ~(data[comp] < f_min)
+        if f_max is not None:
+            mask &= ~(data[comp] > f_max)
+    return mask
+
+
+def _sigma_comps(filter_sigma):
+    """Get the components with a sigma filter."""
+    return [comp for comp, f_sigma in zip(BEAM_COMPONENTS, filter_sigma)
+            if f_sigma is not None]
+
+
+def _get_filter_moments(filter_sigma):
+    """Get the moments needed to compute the sigma filters."""
+    return StreamingMoments(len(_sigma_comps(filter_sigma)))
+
+
+def _get_sigma_limits(moments, filter_sigma):
+    """
+    Get the range of each component allowed by the sigma filters, as in
+    `aptools.data_processing.beam_filtering.filter_beam_sigma`.
+    """
+    mean = moments.mean[0]
+    std = np.sqrt(np.diag(moments.get_covariance()[0]))
+    sigma_min = [None] * len(BEAM_COMPONENTS)
+    sigma_max = [None] * len(BEAM_COMPONENTS)
+    i = 0
+    for j, f_sigma in enumerate(filter_sigma):
+        if f_sigma is not None:
+            sigma_min[j] = mean[i] - f_sigma * std[i]
+            sigma_max[j] = mean[i] + f_sigma * std[i]
+            i += 1
+    return sigma_min, sigma_max
 
 
 def _get_data_units(var):
@@ -152,17 +271,3 @@ def _get_data_units(var):
         return units_dict[var]
     else:
         return ''
-
-
-def _first_true(iterable, default=False, pred=None):
-    """Returns the first true value in the iterable.
-
-    If no true value is found, returns *default*
-
-    If *pred* is not None, returns the first item
-    for which pred(item) is true.
-
-    From https://docs.python.org/3/library/itertools.html#itertools-recipes.
-
-    """
-    return next(filter(pred, iterable), default)
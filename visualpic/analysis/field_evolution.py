@@ -0,0 +1,310 @@
+"""
+This file is part of VisualPIC.
+
+The module contains methods for analyzing the evolution of a field within
+the simulation.
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+import os
+from functools import partial
+
+import numpy as np
+
+from visualpic.data_handling.data_container import DataContainer
+from visualpic.analysis.analysis_helpers import (
+    run_timestep_analysis, run_adaptive_timestep_analysis,
+    group_timestep_results, save_results, get_output_path,
+    AnalysisCheckpoint)
+
+
+# Diagnostics computed by streaming the whole field (see `Field.reduce`).
+REDUCTION_DIAGNOSTICS = ['max', 'min', 'abs_max', 'mean', 'std']
+
+# Diagnostics computed from a lineout of the field along the analysis axis.
+LINEOUT_DIAGNOSTICS = ['axis_max', 'axis_min', 'axis_max_pos',
+                       'axis_min_pos', 'axis_zero_pos']
+
+# Diagnostics computed from the whole field, where '<axis>' is any of the
+# field axes. The field squared is used as weight.
+MOMENT_DIAGNOSTICS = ['centroid_<axis>', 'rms_<axis>']
+
+
+def analyze_field_evolution(
+        sim_path, sim_code, field_name, species_name=None,
+        diagnostics=['max', 'min', 'axis_max', 'axis_min'], axis='z',
+        m='all', theta=0, plasma_density=None, laser_wavelength=0.8e-6,
+        t_step_range=None, save_to=None, saved_file_name='field_params.h5',
+        parallel=False, n_proc=None, adaptive=False, adaptive_tol=0.05,
+        adaptive_diagnostics=None, adaptive_n_initial=9):
+    """
+    Compute a set of scalar diagnostics of a field at each time step.
+
+    Parameters
+    ----------
+
+    sim_path : str
+        Path to the folder containing the simulation data.
+
+    sim_code : str
+        Name of the simulation code ('osiris', 'hipace' or 'openpmd').
+
+    field_name : str
+        Name of the field (e.g., 'Ez' or 'a_env').
+
+    species_name : str
+        (Optional) Name of the species to which the field belongs.
+
+    diagnostics : list
+        List of strings with the diagnostics to compute. The data is in SI
+        units. Possible values are:
+        'max', 'min', 'abs_max', 'mean', 'std': reductions of the whole
+        field, computed without loading the whole array.
+        'axis_max', 'axis_min': maximum and minimum of a lineout of the field
+        along `axis` (through the center of the other axes, i.e., on axis
+        for thetaMode fields). Only the lineout is read.
+        'axis_max_pos', 'axis_min_pos': position of the maximum and minimum
+        of the lineout.
+        'axis_zero_pos': position of the zero crossing of the lineout
+        closest to its end (e.g., the phase of a wake along 'z').
+        'centroid_<axis>', 'rms_<axis>': centroid and RMS size of the field
+        along any of its axes (e.g., 'centroid_z', 'rms_x'), using the field
+        squared as weight. For thetaMode fields, 'r' is the radius in the
+        plane given by `theta` and the weight is multiplied by |r|.
+
+    axis : str
+        Axis of the lineout diagnostics.
+
+    m, theta : optional
+        Azimuthal mode and angle of the observation plane of thetaMode
+        fields, as in `Field.get_data`.
+
+    plasma_density, laser_wavelength : float
+        (Optional) Parameters of the DataContainer.
+
+    t_step_range : list
+        (Optional) Minimum and maximum time step to analyze.
+
+    save_to : str
+        (Optional) Folder in which to save the results. The results of each
+        time step are saved as soon as they are computed, and time steps
+        already analyzed with the same parameters (and unmodified data files)
+        are not computed again.
+
+    saved_file_name : str
+        Name of the HDF5 file with the results.
+
+    parallel : bool
+        Whether to analyze the time steps in parallel processes.
+
+    n_proc : int
+        (Optional) Number of processes. By default, the number of CPUs.
+
+    adaptive : bool
+        Whether to analyze only the time steps needed to resolve the
+        evolution of the diagnostics. First, `adaptive_n_initial`
+        evenly-spaced time steps are analyzed. Then, the intervals between
+        them are refined while any of the `adaptive_diagnostics` changes by
+        more than `adaptive_tol` times its range (see
+        `run_adaptive_timestep_analysis`).
+
+    adaptive_tol : float
+        Maximum change of the diagnostics between analyzed time steps,
+        relative to their range.
+
+    adaptive_diagnostics : list
+        (Optional) Diagnostics which determine the refinement. By default,
+        all diagnostics.
+
+    adaptive_n_initial : int
+        Number of time steps analyzed in the first round.
+
+    Returns
+    -------
+    A dictionary with an array containing the value of each diagnostic at
+    each time step. In adaptive mode, the time steps which were not analyzed
+    are NaN, and the array 'refinement_level' contains the refinement round
+    in which each time step was analyzed.
+    """
+    if isinstance(diagnostics, str):
+        diagnostics = [diagnostics]
+    diagnostics = list(diagnostics)
+    # Load data.
+    print('Scanning simulation folder... ', end='', flush=True)
+    load_args = (sim_code, sim_path, plasma_density, laser_wavelength,
+                 field_name, species_name)
+    field = _load_field(*load_args)
+    print('Done.')
+    time_steps = field.timesteps
+    if t_step_range is not None:
+        time_steps = time_steps[np.where((time_steps >= t_step_range[0]) &
+                                         (time_steps <= t_step_range[1]))]
+    fld_md = field.get_only_metadata(time_steps[0], axes_units='SI',
+                                     theta=theta)
+    axis_labels = fld_md['field']['axis_labels']
+    for diag in diagnostics:
+        diag_axis = _get_moment_axis(diag)
+        if diag_axis is not None:
+            if diag_axis not in axis_labels:
+                raise ValueError(
+                    "Axis '{}' of diagnostic '{}' not found. ".format(
+                        diag_axis, diag) +
+                    "Available axes are {}.".format(axis_labels))
+        elif diag not in REDUCTION_DIAGNOSTICS + LINEOUT_DIAGNOSTICS:
+            raise ValueError(
+                "Unknown diagnostic '{}'. Possible values are {}.".format(
+                    diag, REDUCTION_DIAGNOSTICS + LINEOUT_DIAGNOSTICS +
+                    MOMENT_DIAGNOSTICS))
+    # Dimensionless fields cannot be converted.
+    field_units = 'SI'
+    if fld_md['field']['units'] == '':
+        field_units = None
+
+    # Time steps already analyzed (with the same parameters and data files)
+    # in previous runs are read from the output file instead of being
+    # computed again.
+    checkpoint = None
+    if save_to is not None:
+        file_path = get_output_path(save_to, saved_file_name)
+        analysis_id = (sim_code.lower(), os.path.abspath(sim_path),
+                       field_name, species_name, diagnostics, axis, m, theta,
+                       plasma_density, laser_wavelength)
+        checkpoint = AnalysisCheckpoint(file_path, analysis_id, field)
+
+    # Analyze field. In parallel runs, each worker loads its own data
+    # container, with only the analyzed time steps.
+    analyze_timestep = partial(
+        _analyze_field_timestep, diagnostics=diagnostics, axis=axis,
+        field_units=field_units, m=m, theta=theta)
+    worker_load_args = load_args + (list(time_steps),)
+    run_args = (analyze_timestep, time_steps, field, _load_field,
+                worker_load_args)
+    run_kwargs = {'parallel': parallel, 'n_proc': n_proc,
+                  'checkpoint': checkpoint,
+                  'desc': 'Analyzing field evolution... '}
+    if adaptive:
+        ts_params, refinement_level = run_adaptive_timestep_analysis(
+            *run_args, tolerance=adaptive_tol,
+            monitored_vars=adaptive_diagnostics,
+            n_initial=adaptive_n_initial, **run_kwargs)
+    else:
+        ts_params = run_timestep_analysis(*run_args, **run_kwargs)
+    var_arrays_dict = group_timestep_results(ts_params)
+    if adaptive:
+        var_arrays_dict['refinement_level'] = refinement_level
+
+    print('Done.')
+
+    # Save to file.
+    if save_to is not None:
+        print('Saving to file... ', end='')
+        fld_md = field.get_only_metadata(
+            time_steps[0], field_units=field_units, axes_units='SI',
+            theta=theta)
+        save_results(file_path, var_arrays_dict,
+                     partial(_get_data_units, fld_md=fld_md, axis=axis),
+                     analysis_id)
+        print('Done.')
+
+    return var_arrays_dict
+
+
+def _load_field(sim_code, sim_path, plasma_density, laser_wavelength,
+                field_name, species_name, time_steps=None):
+    """
+    Load the field (also in the worker processes, where only the analyzed
+    time steps are loaded).
+    """
+    dc = DataContainer(sim_code, sim_path, plasma_density, laser_wavelength)
+    dc.load_data(iterations=time_steps)
+    return dc.get_field(field_name, species_name)
+
+
+def _analyze_field_timestep(time_step, field, diagnostics, axis, field_units,
+                            m, theta):
+    """Compute the diagnostics of the field at a given time step."""
+    params = {}
+    # Reductions, streamed from the reader.
+    ops = [diag for diag in diagnostics if diag in REDUCTION_DIAGNOSTICS]
+    if len(ops) > 0:
+        params.update(field.reduce(time_step, ops, field_units=field_units,
+                                   m=m, theta=theta))
+    # Diagnostics of the lineout, for which only the lineout is read.
+    if any(diag in LINEOUT_DIAGNOSTICS for diag in diagnostics):
+        lineout, lineout_md = field.get_lineout(
+            axis, timesteps=[time_step], field_units=field_units,
+            axes_units='SI', m=m, theta=theta, n_workers=0)
+        lineout = lineout[0]
+        axis_array = lineout_md['axis'][axis]['array'][0]
+        params['axis_max'] = np.max(lineout)
+        params['axis_min'] = np.min(lineout)
+        params['axis_max_pos'] = axis_array[np.argmax(lineout)]
+        params['axis_min_pos'] = axis_array[np.argmin(lineout)]
+        params['axis_zero_pos'] = _get_last_zero_crossing(lineout,
+                                                          axis_array)
+    # Moments of the whole field.
+    if any(_get_moment_axis(diag) is not None for diag in diagnostics):
+        fld, fld_md = field.get_data(time_step, field_units=field_units,
+                                     axes_units='SI', m=m, theta=theta)
+        params.update(_get_field_moments(fld, fld_md))
+    return {diag: params[diag] for diag in diagnostics}
+
+
+def _get_field_moments(fld, fld_md):
+    """Get the centroid and RMS size along each axis of the field."""
+    axis_labels = sorted(fld_md['field']['axis_labels'])
+    weight = np.square(fld)
+    if 'r' in axis_labels:
+        r = fld_md['axis']['r']['array']
+        r_shape = [1] * fld.ndim
+        r_shape[axis_labels.index('r')] = len(r)
+        weight = weight * np.abs(r).reshape(r_shape)
+    w_sum = np.sum(weight)
+    moments = {}
+    for i, ax in enumerate(axis_labels):
+        other_axes = tuple(j for j in range(fld.ndim) if j != i)
+        # Weight projected onto the axis.
+        ax_weight = np.sum(weight, axis=other_axes)
+        ax_array = fld_md['axis'][ax]['array']
+        centroid = np.sum(ax_weight * ax_array) / w_sum
+        moments['centroid_' + ax] = centroid
+        moments['rms_' + ax] = np.sqrt(
+            np.sum(ax_weight * (ax_array - centroid)**2) / w_sum)
+    return moments
+
+
+def _get_last_zero_crossing(lineout, axis_array):
+    """
+    Get the position (linearly interpolated) of the zero crossing of a
+    lineout which is closest to its end. NaN if there is none.
+    """
+    sign = np.sign(lineout)
+    crossings = np.where(sign[:-1] * sign[1:] < 0)[0]
+    if len(crossings) == 0:
+        return np.nan
+    i = crossings[-1]
+    f_0, f_1 = lineout[i], lineout[i + 1]
+    return axis_array[i] + (axis_array[i + 1] - axis_array[i]) * f_0 / (
+        f_0 - f_1)
+
+
+def _get_moment_axis(diagnostic):
+    """Get the axis of a moment diagnostic, or None for other diagnostics."""
+    for prefix in ['centroid_', 'rms_']:
+        if diagnostic.startswith(prefix):
+            return diagnostic[len(prefix):]
+    return None
+
+
+def _get_data_units(var, fld_md, axis):
+    """Get the units of a diagnostic."""
+    if var == 'refinement_level':
+        return ''
+    if var.endswith('_pos'):
+        return fld_md['axis'][axis]['units']
+    moment_axis = _get_moment_axis(var)
+    if moment_axis is not None:
+        return fld_md['axis'][moment_axis]['units']
+    return fld_md['field']['units']
@@ -0,0 +1,411 @@
+"""
+This file is part of VisualPIC.
+
+The module contains vectorized methods for computing the global and slice
+parameters of a particle beam, either at once or chunk by chunk.
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+
+import numpy as np
+import scipy.constants as ct
+
+from visualpic.data_handling.reductions import StreamingMoments
+
+
+def analyze_beam(x, y, z, px, py, pz, q, n_slices=10, len_slice=None,
+                 core_fraction=None):
+    """
+    Compute the most relevant beam parameters at once.
+
+    The definitions and conventions are the same as in
+    `aptools.data_analysis.beam_diagnostics.general_analysis`, but the
+    particles are binned along z only once and all slice moments are
+    computed with `np.bincount`, instead of masking the full beam for each
+    slice.
+
+    Parameters
+    ----------
+
+    x, y, z : array
+        Position of the particles in metres.
+
+    px, py, pz : array
+        Momentum of the particles in non-dimensional units (beta*gamma).
+
+    q : array
+        Charge of the particles in Coulomb.
+
+    n_slices : int
+        Number of longitudinal slices. Not used if `len_slice` is given.
+
+    len_slice : float
+        (Optional) Length of the longitudinal slices in metres.
+
+    core_fraction : float
+        (Optional) If given, only the particles in the central fraction of
+        the beam along z (e.g., 0.9 for 90 % of the particles) are analyzed.
+
+    Returns
+    -------
+    A dictionary with the beam parameters. The keys are the same as in
+    `general_analysis`.
+    """
+    if core_fraction is not None:
+        core = select_core(z, core_fraction)
+        x, y, z, px, py, pz, q = [
+            np.asarray(arr)[core] for arr in [x, y, z, px, py, pz, q]]
+    w = np.abs(q)
+    gamma = np.sqrt(1 + px**2 + py**2 + pz**2)
+    ene = np.average(gamma, weights=q)
+    a_x, b_x, g_x = _get_twiss_parameters(x, px / pz, q)
+    a_y, b_y, g_y = _get_twiss_parameters(y, py / pz, q)
+    slice_params = get_slice_parameters(
+        x, y, z, px, py, pz, q, n_slices=n_slices, len_slice=len_slice)
+    slice_weight = slice_params['q']
+    current = np.abs(slice_params['current'])
+    return {
+        'x_avg': np.average(x, weights=q),
+        'y_avg': np.average(y, weights=q),
+        'z_avg': np.average(z, weights=q),
+        'theta_x': np.average(px, weights=q) / ene,
+        'theta_y': np.average(py, weights=q) / ene,
+        'sigma_x': _weighted_std(x, w),
+        'sigma_y': _weighted_std(y, w),
+        'sigma_z': _weighted_std(z, w),
+        'z_fwhm': _get_fwhm(current, slice_params['z_edges']),
+        'sigma_px': np.std(px / pz),
+        'sigma_py': np.std(py / pz),
+        'alpha_x': a_x,
+        'alpha_y': a_y,
+        'beta_x': b_x,
+        'beta_y': b_y,
+        'gamma_x': g_x,
+        'gamma_y': g_y,
+        'emitt_nx': _get_emittance(x, px, w),
+        'emitt_ny': _get_emittance(y, py, w),
+        'emitt_nx_sl': _get_slice_average(slice_params['emitt_nx'],
+                                          slice_weight),
+        'emitt_ny_sl': _get_slice_average(slice_params['emitt_ny'],
+                                          slice_weight),
+        'ene_avg': ene,
+        'rel_ene_sp': _weighted_std(gamma, w) / ene,
+        'rel_ene_sp_sl': _get_slice_average(slice_params['rel_ene_sp'],
+                                            slice_weight),
+        'i_peak': current.max(),
+        'q': np.sum(q)
+    }
+
+
+def get_slice_parameters(x, y, z, px, py, pz, q, n_slices=10,
+                         len_slice=None):
+    """
+    Compute the current profile and the slice parameters of a beam.
+
+    As in APtools, a particle belongs to slice i if
+    z_edges[i] < z <= z_edges[i+1], while the current profile is a
+    histogram of the charge (where the first bin also includes its lower
+    edge).
+
+    Parameters
+    ----------
+
+    x, y, z, px, py, pz, q : array
+        Particle data, as in `analyze_beam`.
+
+    n_slices : int
+        Number of longitudinal slices. Not used if `len_slice` is given.
+
+    len_slice : float
+        (Optional) Length of the longitudinal slices in metres.
+
+    Returns
+    -------
+    A dictionary with the slice edges ('z_edges'), the current of each slice
+    in Ampere ('current'), and the charge ('q'), normalized emittance
+    ('emitt_nx', 'emitt_ny') and relative energy spread ('rel_ene_sp') of
+    each slice.
+    """
+    z_edges = _get_slice_edges(np.min(z), np.max(z), n_slices, len_slice)
+    n_slices = len(z_edges) - 1
+    # Bin the particles only once.
+    i_hist, i_slice = _get_slice_indices(z, z_edges)
+    in_slice = i_slice >= 0
+    i_slice = i_slice[in_slice]
+    q_sl = np.asarray(q)[in_slice]
+    w_sl = np.abs(q_sl)
+    gamma_sl = np.sqrt(1 + px[in_slice]**2 + py[in_slice]**2 +
+                       pz[in_slice]**2)
+    charge = np.bincount(i_hist, weights=q, minlength=n_slices)
+    slice_q = np.bincount(i_slice, weights=q_sl, minlength=n_slices)
+    slice_w = np.bincount(i_slice, weights=w_sl, minlength=n_slices)
+    slice_w2 = np.bincount(i_slice, weights=w_sl**2, minlength=n_slices)
+    slice_n = np.bincount(i_slice, minlength=n_slices)
+    # Weighted energy mean (with the signed charge, as in APtools) and
+    # spread.
+    ene = _slice_mean(i_slice, gamma_sl, q_sl, slice_q)
+    ene_var = _slice_mean(i_slice, (gamma_sl - ene[i_slice])**2, w_sl,
+                          slice_w)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ene_sp = np.where(slice_n > 0, np.sqrt(ene_var) / ene, 0.)
+    # Covariance normalization of `np.cov` with `aweights`.
+    cov_norm = slice_w - slice_w2 / np.where(slice_w > 0, slice_w, 1)
+    slice_params = {
+        'z_edges': z_edges,
+        'current': charge / ((z_edges[1] - z_edges[0]) / ct.c),
+        'q': slice_q,
+        'rel_ene_sp': ene_sp
+    }
+    for name, u, pu in [('emitt_nx', x, px), ('emitt_ny', y, py)]:
+        u = u[in_slice]
+        pu = pu[in_slice]
+        du = u - _slice_mean(i_slice, u, w_sl, slice_w)[i_slice]
+        dpu = pu - _slice_mean(i_slice, pu, w_sl, slice_w)[i_slice]
+        uu = np.bincount(i_slice, weights=w_sl * du**2, minlength=n_slices)
+        pp = np.bincount(i_slice, weights=w_sl * dpu**2, minlength=n_slices)
+        up = np.bincount(i_slice, weights=w_sl * du * dpu,
+                         minlength=n_slices)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slice_params[name] = np.where(
+                slice_n > 1, np.sqrt(uu * pp - up**2) / cov_norm, 0.)
+    return slice_params
+
+
+class StreamingBeamAnalysis():
+
+    """
+    Analysis of a particle beam which is processed chunk by chunk, so that
+    beams which do not fit in memory can be analyzed.
+
+    Only the weighted moments of the whole beam and of each slice are kept
+    in memory (see `StreamingMoments`). The results are the same as those
+    of `analyze_beam` for beams in which all particles have a charge of the
+    same sign. The longitudinal range of the beam must be known in advance
+    to define the slices.
+    """
+
+    def __init__(self, z_min, z_max, n_slices=10, len_slice=None):
+        """
+        Initialize the analysis.
+
+        Parameters
+        ----------
+
+        z_min, z_max : float
+            Minimum and maximum longitudinal position of the particles.
+
+        n_slices : int
+            Number of longitudinal slices. Not used if `len_slice` is given.
+
+        len_slice : float
+            (Optional) Length of the longitudinal slices in metres.
+        """
+        self.z_edges = _get_slice_edges(z_min, z_max, n_slices, len_slice)
+        self.n_slices = len(self.z_edges) - 1
+        # Moments of x, y, z, px, py, gamma, x' and y' weighted by |q|.
+        self._beam_moments = StreamingMoments(8)
+        # Unweighted moments of x' and y'.
+        self._divergence_moments = StreamingMoments(2)
+        # Moments of x, px, y, py and gamma of each slice.
+        self._slice_moments = StreamingMoments(5, n_bins=self.n_slices)
+        self._charge = np.zeros(self.n_slices)
+        self._slice_q = np.zeros(self.n_slices)
+        self._q = 0.
+
+    def update(self, x, y, z, px, py, pz, q):
+        """
+        Add a chunk of particles to the analysis. The particle data is the
+        same as in `analyze_beam`.
+        """
+        w = np.abs(q)
+        gamma = np.sqrt(1 + px**2 + py**2 + pz**2)
+        xp = px / pz
+        yp = py / pz
+        self._beam_moments.update([x, y, z, px, py, gamma, xp, yp], w)
+        self._divergence_moments.update([xp, yp])
+        i_hist, i_slice = _get_slice_indices(z, self.z_edges)
+        self._charge += np.bincount(i_hist, weights=q,
+                                    minlength=self.n_slices)
+        in_slice = i_slice >= 0
+        i_slice = i_slice[in_slice]
+        self._slice_q += np.bincount(i_slice, weights=q[in_slice],
+                                     minlength=self.n_slices)
+        self._slice_moments.update(
+            [arr[in_slice] for arr in [x, px, y, py, gamma]], w[in_slice],
+            i_slice)
+        self._q += np.sum(q)
+
+    def get_results(self):
+        """
+        Get the beam parameters, as a dictionary with the same keys as in
+        `analyze_beam`.
+        """
+        mean = self._beam_moments.mean[0]
+        cov = self._beam_moments.get_covariance()[0]
+        cov_unbiased = self._beam_moments.get_covariance(unbiased=True)[0]
+        sigma = np.sqrt(np.diag(cov))
+        ene = mean[5]
+        single_particle = self._beam_moments.count[0] <= 1
+
+        def get_emittance(i, j):
+            if single_particle:
+                return 0.
+            return np.sqrt(np.linalg.det(cov_unbiased[np.ix_([i, j], [i, j])]))
+
+        def get_twiss(i, j):
+            em = get_emittance(i, j)
+            b = cov[i, i] / em
+            a = -cov[i, j] / em
+            return a, b, (1 + a**2) / b
+
+        a_x, b_x, g_x = get_twiss(0, 6)
+        a_y, b_y, g_y = get_twiss(1, 7)
+        sigma_div = np.sqrt(np.diag(
+            self._divergence_moments.get_covariance()[0]))
+        current = np.abs(self._charge / (
+            (self.z_edges[1] - self.z_edges[0]) / ct.c))
+        slice_n = self._slice_moments.count
+        slice_cov = self._slice_moments.get_covariance(unbiased=True)
+        slice_ene = self._slice_moments.mean[:, 4]
+        slice_ene_var = self._slice_moments.get_covariance()[:, 4, 4]
+        slice_params = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slice_params['rel_ene_sp'] = np.where(
+                slice_n > 0, np.sqrt(slice_ene_var) / slice_ene, 0.)
+            for name, i in [('emitt_nx', 0), ('emitt_ny', 2)]:
+                slice_params[name] = np.where(
+                    slice_n > 1,
+                    np.sqrt(np.linalg.det(slice_cov[:, i:i + 2, i:i + 2])), 0.)
+        return {
+            'x_avg': mean[0],
+            'y_avg': mean[1],
+            'z_avg': mean[2],
+            'theta_x': mean[3] / ene,
+            'theta_y': mean[4] / ene,
+            'sigma_x': sigma[0],
+            'sigma_y': sigma[1],
+            'sigma_z': sigma[2],
+            'z_fwhm': _get_fwhm(current, self.z_edges),
+            'sigma_px': sigma_div[0],
+            'sigma_py': sigma_div[1],
+            'alpha_x': a_x,
+            'alpha_y': a_y,
+            'beta_x': b_x,
+            'beta_y': b_y,
+            'gamma_x': g_x,
+            'gamma_y': g_y,
+            'emitt_nx': get_emittance(0, 3),
+            'emitt_ny': get_emittance(1, 4),
+            'emitt_nx_sl': _get_slice_average(slice_params['emitt_nx'],
+                                              self._slice_q),
+            'emitt_ny_sl': _get_slice_average(slice_params['emitt_ny'],
+                                              self._slice_q),
+            'ene_avg': ene,
+            'rel_ene_sp': sigma[5] / ene,
+            'rel_ene_sp_sl': _get_slice_average(slice_params['rel_ene_sp'],
+                                                self._slice_q),
+            'i_peak': current.max(),
+            'q': self._q
+        }
+
+
+def select_core(values, fraction):
+    """
+    Select the particles in the central fraction of a distribution.
+
+    The limits of the core are found with `np.partition`, which is linear
+    in the number of particles (instead of sorting the full array).
+
+    Parameters
+    ----------
+
+    values : array
+        Value of the particles along the relevant coordinate (e.g., z).
+
+    fraction : float
+        Fraction (between 0 and 1) of the particles to keep.
+
+    Returns
+    -------
+    A boolean array which is True for the particles in the core.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError('The core fraction must be between 0 and 1.')
+    values = np.asarray(values)
+    n = len(values)
+    n_out = int(round(n * (1 - fraction))) // 2
+    if n_out == 0:
+        return np.ones(n, dtype=bool)
+    i_low = n_out
+    i_high = n - 1 - n_out
+    limits = np.partition(values, [i_low, i_high])
+    return (values >= limits[i_low]) & (values <= limits[i_high])
+
+
+def _get_slice_edges(z_min, z_max, n_slices, len_slice=None):
+    """Get the edges of the longitudinal slices."""
+    if len_slice is not None:
+        n_slices = int(np.round((z_max - z_min) / len_slice))
+    return np.linspace(z_min, z_max, n_slices + 1)
+
+
+def _get_slice_indices(z, z_edges):
+    """
+    Get the index of the current histogram bin and of the slice of each
+    particle (-1 for particles which are in no slice).
+    """
+    n_slices = len(z_edges) - 1
+    i_bin = np.searchsorted(z_edges, z, side='right') - 1
+    i_hist = np.minimum(i_bin, n_slices - 1)
+    i_slice = i_bin - (z == z_edges[i_bin])
+    return i_hist, i_slice
+
+
+def _get_fwhm(current, z_edges):
+    """Get the FWHM of the current profile."""
+    slice_pos = z_edges[1:] - abs(z_edges[1] - z_edges[0]) / 2
+    slices_in_fwhm = slice_pos[current >= current.max() / 2]
+    return slices_in_fwhm.max() - slices_in_fwhm.min()
+
+
+def _slice_mean(i_slice, values, weights, slice_weights):
+    """Get the weighted mean of each slice (0 for empty slices)."""
+    sums = np.bincount(i_slice, weights=weights * values,
+                       minlength=len(slice_weights))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(slice_weights != 0, sums / slice_weights, 0.)
+
+
+def _get_slice_average(slice_values, slice_weights):
+    """Get the weighted average of the finite slice values."""
+    finite = np.isfinite(slice_values)
+    return np.average(slice_values[finite], weights=slice_weights[finite])
+
+
+def _weighted_std(values, weights):
+    """Get the weighted standard deviation."""
+    mean = np.average(values, weights=weights)
+    return np.sqrt(np.average((values - mean)**2, weights=weights))
+
+
+def _get_emittance(u, pu, w):
+    """
+    Get the emittance from the determinant of the covariance matrix (with
+    the normalization of `np.cov` with `aweights`).
+    """
+    if len(u) <= 1:
+        return 0.
+    cov = np.cov(u, pu, aweights=w)
+    return np.sqrt(np.linalg.det(cov))
+
+
+def _get_twiss_parameters(u, up, q):
+    """Get the alpha, beta and gamma functions from the trace space."""
+    em = _get_emittance(u, up, np.abs(q))
+    du = u - np.average(u, weights=q)
+    dup = up - np.average(up, weights=q)
+    b = np.average(du**2, weights=q) / em
+    a = -np.average(du * dup, weights=q) / em
+    return a, b, (1 + a**2) / b
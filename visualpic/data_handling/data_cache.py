@@ -0,0 +1,277 @@
+"""
+This file is part of VisualPIC.
+
+The module contains the DataCache class, a byte-budgeted LRU cache shared by
+all fields and particle species.
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+
+import copy
+import weakref
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class DataCache():
+
+    """
+    Least-recently-used cache of field and particle data with a global
+    byte budget.
+
+    Each entry stores a data array together with its metadata dictionary and
+    is identified by a key built from the owner of the data (a Field or
+    ParticleSpecies), the time step, the data type and all the arguments
+    that determine the returned data (slicing, units, etc.). The owners are
+    only weakly referenced, and their entries are removed when they are
+    deleted.
+
+    The cache holds its own read-only copy of each array, while the code
+    storing or requesting the data always gets a writeable array. Modifying
+    it in place therefore does not affect the cached data.
+    """
+
+    def __init__(self, max_bytes=2**30):
+        """
+        Initialize the cache.
+
+        Parameters
+        ----------
+
+        max_bytes : int
+            Maximum amount of memory (in bytes) that the cached arrays can
+            occupy. When exceeded, the least recently used entries are
+            evicted. A value of 0 disables caching.
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._owner_refs = {}
+        self._n_bytes = 0
+        self._lock = threading.RLock()
+        self.reset_stats()
+
+    def make_key(self, owner, time_step, dtype=None, **kwargs):
+        """
+        Build the key identifying a data request.
+
+        Parameters
+        ----------
+
+        owner : Field or ParticleSpecies
+            Object to which the data belongs.
+
+        time_step : int
+            Time step of the data.
+
+        dtype : data-type
+            (Optional) Data type of the requested data. If given, the data
+            is stored in the cache with this type. By default, the data is
+            stored with its original type.
+
+        **kwargs
+            Any other arguments determining the returned data (slicing,
+            units, etc.).
+
+        Returns
+        -------
+        A hashable tuple.
+        """
+        args = tuple(
+            (name, _to_hashable(value)) for name, value in sorted(
+                kwargs.items()))
+        if dtype is not None:
+            dtype = np.dtype(dtype).str
+        return (self._get_owner_ref(owner), _to_hashable(time_step), dtype,
+                args)
+
+    def get(self, key):
+        """
+        Get an entry from the cache.
+
+        Parameters
+        ----------
+
+        key : tuple
+            Key of the entry, as returned by `make_key`.
+
+        Returns
+        -------
+        A tuple with a copy of the data array and of its metadata
+        dictionary, or None if the entry is not in the cache.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            data, metadata, _ = entry
+        return data.copy(), copy.deepcopy(metadata)
+
+    def put(self, key, data, metadata):
+        """
+        Store an entry in the cache.
+
+        Only numpy arrays are stored. Arrays larger than the byte budget
+        (i.e., all arrays if the cache is disabled) are not cached. The
+        cache stores a read-only copy of the array, so that `data` can still
+        be modified by the caller.
+
+        Parameters
+        ----------
+
+        key : tuple
+            Key of the entry, as returned by `make_key`.
+
+        data : ndarray
+            The data array.
+
+        metadata : dict
+            The metadata dictionary of the data.
+
+        Returns
+        -------
+        A tuple with the data array (converted to the data type of the key,
+        if any) and the metadata dictionary, which can be safely returned to
+        the caller.
+        """
+        if not isinstance(data, np.ndarray):
+            return data, metadata
+        dtype = key[2]
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        n_bytes = data.nbytes
+        if n_bytes > self.max_bytes:
+            return data, metadata
+        cached_data = data.copy()
+        cached_data.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (cached_data, copy.deepcopy(metadata),
+                                  n_bytes)
+            self._n_bytes += n_bytes
+            self._evict()
+        return data, metadata
+
+    def invalidate(self, owner=None, time_step=None):
+        """
+        Remove entries from the cache.
+
+        Parameters
+        ----------
+
+        owner : Field or ParticleSpecies
+            (Optional) Only remove the entries of this object.
+
+        time_step : int
+            (Optional) Only remove the entries of this time step.
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                key_owner, key_time_step, *_ = key
+                if owner is not None and _get_owner(key_owner) is not owner:
+                    continue
+                if time_step is not None and key_time_step != time_step:
+                    continue
+                self._remove(key)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+
+    def set_max_bytes(self, max_bytes):
+        """Set the byte budget of the cache, evicting entries if needed."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of hits, misses and evictions,
+        as well as the number of entries and bytes currently in the cache.
+        """
+        with self._lock:
+            return {'hits': self._hits,
+                    'misses': self._misses,
+                    'evictions': self._evictions,
+                    'entries': len(self._entries),
+                    'bytes': self._n_bytes,
+                    'max_bytes': self.max_bytes}
+
+    def reset_stats(self):
+        """Reset the hit, miss and eviction counters."""
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _get_owner_ref(self, owner):
+        """
+        Get a weak reference to the owner of some data, which is shared by
+        all its keys. Owners which do not support weak references (such as
+        strings) are used as they are.
+        """
+        with self._lock:
+            ref = self._owner_refs.get(id(owner))
+            if ref is not None and ref() is owner:
+                return ref
+            try:
+                ref = weakref.ref(owner, self._remove_owner)
+            except TypeError:
+                return owner
+            self._owner_refs[id(owner)] = ref
+            return ref
+
+    def _remove_owner(self, ref):
+        """Remove the entries of an owner which has been deleted."""
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if key[0] is ref:
+                    self._remove(key)
+            for owner_id, owner_ref in list(self._owner_refs.items()):
+                if owner_ref is ref:
+                    del self._owner_refs[owner_id]
+
+    def _remove(self, key):
+        """Remove a single entry."""
+        *_, n_bytes = self._entries.pop(key)
+        self._n_bytes -= n_bytes
+
+    def _evict(self):
+        """Evict least recently used entries until within the budget."""
+        while self._n_bytes > self.max_bytes and len(self._entries) > 0:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self._evictions += 1
+
+
+def _get_owner(owner_ref):
+    """Get the owner from the (possibly weak) reference stored in a key."""
+    if isinstance(owner_ref, weakref.ref):
+        return owner_ref()
+    return owner_ref
+
+
+def _to_hashable(value):
+    """Convert lists, arrays and dicts into (nested) tuples."""
+    if isinstance(value, dict):
+        return tuple(
+            (k, _to_hashable(v)) for k, v in sorted(value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_to_hashable(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return tuple(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# Cache shared by all fields and particle species.
+data_cache = DataCache()
@@ -8,10 +8,17 @@ License: GNU GPL-3.0.
 """
 
 
+import copy
+import asyncio
+
 from visualpic.data_handling.derived_field_definitions import (
     derived_field_definitions)
-from visualpic.data_handling.fields import DerivedField
+from visualpic.data_handling.fields import (
+    FolderField, DerivedField, get_folder_fields_data)
 from visualpic.data_handling.particle_species import ParticleSpecies
+from visualpic.data_handling.data_cache import data_cache
+from visualpic.data_handling.disk_cache import DiskCache
+from visualpic.helper_functions import run_in_executor
 from visualpic.data_reading.folder_scanners import (
     OsirisFolderScanner, OpenPMDFolderScanner, HiPACEFolderScanner)
 
@@ -21,7 +28,8 @@ class DataContainer():
     """Class containing a providing access to all the simulation data"""
 
     def __init__(self, simulation_code, data_folder_path, plasma_density=None,
-                 laser_wavelength=0.8e-6, opmd_backend='openpmd-api'):
+                 laser_wavelength=0.8e-6, opmd_backend='openpmd-api',
+                 disk_cache_dir=None, disk_cache_max_bytes=10*2**30):
         """
         Initialize the data container.
 
@@ -50,12 +58,24 @@ class DataContainer():
             be used by the DataReader of the openPMD-viewer. Possible values
             are 'h5py' or 'openpmd-api'.
 
+        disk_cache_dir : str
+            (Optional) Folder in which to store the computed derived fields,
+            so that they can be reused when the data is reopened. If not
+            given, derived fields are only cached in memory.
+
+        disk_cache_max_bytes : int
+            Maximum size (in bytes) of the disk cache. When exceeded, the
+            least recently used data is removed.
+
         """
         self.simulation_code = simulation_code.lower()
         self.data_folder_path = data_folder_path
         self.sim_params = {'n_p': plasma_density,
                            'lambda_0': laser_wavelength}
         self.opmd_backend = opmd_backend
+        self.disk_cache = None
+        if disk_cache_dir is not None:
+            self.disk_cache = DiskCache(disk_cache_dir, disk_cache_max_bytes)
         self._set_folder_scanner()
         self.folder_fields = []
         self.particle_species = []
@@ -63,12 +83,19 @@ class DataContainer():
 
     def load_data(self, force_reload=False, iterations=None):
         """Load the data into the data container."""
+        if force_reload:
+            # Remove cached data of the objects that will be replaced.
+            for element in (self.folder_fields + self.particle_species +
+                            self.derived_fields):
+                data_cache.invalidate(element)
         if not self.folder_fields or force_reload:
             self.folder_fields = self.folder_scanner.get_list_of_fields(
                 self.data_folder_path, iterations)
         if not self.particle_species or force_reload:
             self.particle_species = self.folder_scanner.get_list_of_species(
                 self.data_folder_path, iterations)
+            for species in self.particle_species:
+                species.disk_cache = self.disk_cache
             self._add_associated_species_fields()
         if not self.derived_fields or force_reload:
             self._generate_derived_fields()
@@ -135,6 +162,225 @@ class DataContainer():
         raise ValueError("Field '{}' not found. ".format(field_name) +
                          "Available fields are {}.".format(available_fields))
 
+    def get_fields(self, field_names, time_step, field_units=None,
+                   axes_units=None, axes_to_convert=None, time_units=None,
+                   slice_i=0.5, slice_j=0.5, slice_dir_i=None,
+                   slice_dir_j=None, m='all', theta=0, max_resolution_3d=None):
+        """
+        Get the data of several fields at once.
+
+        The base fields required by all requested fields (including those
+        needed by derived fields) are determined beforehand, so that each of
+        them is read only once, and those stored in the same data file are
+        read together (see `get_folder_fields_data`). All derived fields are
+        then calculated from this shared data.
+
+        Parameters
+        ----------
+
+        field_names : list
+            List of strings with the names of the fields (in VisualPIC
+            convention).
+
+        time_step : int
+            Time step at which to read the data.
+
+        field_units : str or list
+            (Optional) Units in which to return the field data. If a list is
+            given, it should have the same length as `field_names`. If a
+            string is given, it will be applied to all fields.
+
+        axes_units, axes_to_convert, time_units, slice_i, slice_j,
+        slice_dir_i, slice_dir_j, m, theta, max_resolution_3d : optional
+            Same as in `Field.get_data`. They are applied to all fields.
+
+        Returns
+        -------
+        A dictionary containing the data of each field. The keys correspond
+        to the names of the requested fields. Each key stores a tuple where
+        the first element is the data array and the second is the metadata
+        dictionary.
+        """
+        fields, field_units, slicing, conversion = self._get_fields_request(
+            field_names, field_units, axes_units, axes_to_convert, time_units,
+            slice_i, slice_j, slice_dir_i, slice_dir_j, m, theta,
+            max_resolution_3d)
+        cached_data = self._get_cached_fields(
+            field_names, fields, field_units, time_step, slicing, conversion)
+        # Read each required base field only once, and all base fields
+        # stored in the same file together.
+        base_fields = self._get_required_base_fields(
+            field_names, fields, cached_data)
+        folder_fields = [field for field in base_fields
+                         if isinstance(field, FolderField)]
+        base_data = dict(zip(folder_fields, get_folder_fields_data(
+            folder_fields, time_step, **slicing)))
+        for base_field in base_fields:
+            if base_field not in base_data:
+                base_data[base_field] = base_field.get_data(time_step,
+                                                            **slicing)
+        return self._assemble_fields(
+            field_names, fields, field_units, time_step, slicing, conversion,
+            cached_data, base_data)
+
+    async def get_fields_async(
+            self, field_names, time_step, field_units=None, axes_units=None,
+            axes_to_convert=None, time_units=None, slice_i=0.5, slice_j=0.5,
+            slice_dir_i=None, slice_dir_j=None, m='all', theta=0,
+            max_resolution_3d=None, executor=None, max_concurrency=None):
+        """
+        Asynchronous version of `get_fields`.
+
+        The cached derived fields are looked up and the base fields are read
+        concurrently in an executor (so that the event loop is not blocked),
+        and the derived fields are then calculated, also in the executor. If
+        the returned coroutine is cancelled, the reads which have not started
+        yet are cancelled too.
+
+        Parameters
+        ----------
+
+        field_names, time_step, field_units, axes_units, axes_to_convert,
+        time_units, slice_i, slice_j, slice_dir_i, slice_dir_j, m, theta,
+        max_resolution_3d :
+            Same as in `get_fields`.
+
+        executor : concurrent.futures.Executor
+            (Optional) Executor in which to read the data. By default, the
+            default executor of the event loop.
+
+        max_concurrency : int
+            (Optional) Maximum number of fields read at the same time.
+
+        Returns
+        -------
+        The same dictionary as `get_fields`.
+
+        Examples
+        --------
+        Several fields and species can be gathered concurrently with
+
+        >>> fields_data, sp_data = await asyncio.gather(
+        ...     dc.get_fields_async(['Ez', 'I'], time_step),
+        ...     dc.get_species('electrons').get_data_async(time_step))
+        """
+        fields, field_units, slicing, conversion = self._get_fields_request(
+            field_names, field_units, axes_units, axes_to_convert, time_units,
+            slice_i, slice_j, slice_dir_i, slice_dir_j, m, theta,
+            max_resolution_3d)
+        # The cached fields might be read from the disk cache, so they are
+        # also looked up in the executor.
+        cached_data = await run_in_executor(
+            self._get_cached_fields, field_names, fields, field_units,
+            time_step, slicing, conversion, executor=executor)
+        base_fields = self._get_required_base_fields(
+            field_names, fields, cached_data)
+        semaphore = None
+        if max_concurrency is not None:
+            semaphore = asyncio.Semaphore(max_concurrency)
+        base_data_list = await asyncio.gather(*[
+            base_field.get_data_async(
+                time_step, executor=executor, semaphore=semaphore,
+                **slicing)
+            for base_field in base_fields])
+        base_data = dict(zip(base_fields, base_data_list))
+        return await run_in_executor(
+            self._assemble_fields, field_names, fields, field_units,
+            time_step, slicing, conversion, cached_data, base_data,
+            executor=executor)
+
+    def _get_fields_request(
+            self, field_names, field_units, axes_units, axes_to_convert,
+            time_units, slice_i, slice_j, slice_dir_i, slice_dir_j, m, theta,
+            max_resolution_3d):
+        """
+        Get the fields, units, slicing and conversion arguments of a
+        `get_fields` request.
+        """
+        if field_units is None or isinstance(field_units, str):
+            field_units = [field_units] * len(field_names)
+        if len(field_units) != len(field_names):
+            raise ValueError(
+                'Length of field names ({})'.format(len(field_names)) +
+                ' and field units ({}) do not match.'.format(
+                    len(field_units)))
+        fields = [self.get_field(field_name) for field_name in field_names]
+        slicing = {'slice_i': slice_i, 'slice_j': slice_j,
+                   'slice_dir_i': slice_dir_i, 'slice_dir_j': slice_dir_j,
+                   'm': m, 'theta': theta,
+                   'max_resolution_3d': max_resolution_3d}
+        conversion = {'axes_units': axes_units,
+                      'axes_to_convert': axes_to_convert,
+                      'time_units': time_units}
+        return fields, field_units, slicing, conversion
+
+    def _get_cached_fields(self, field_names, fields, field_units, time_step,
+                           slicing, conversion):
+        """Get the data of the requested derived fields which is cached."""
+        cached_data = {}
+        for field_name, field, units in zip(field_names, fields, field_units):
+            if isinstance(field, DerivedField):
+                data = field.get_cached_data(
+                    time_step, field_units=units, **conversion, **slicing)
+                if data is not None:
+                    cached_data[field_name] = data
+        return cached_data
+
+    def _get_required_base_fields(self, field_names, fields, cached_data):
+        """
+        Determine the union of all base fields needed by the requested
+        fields which are not cached.
+        """
+        base_fields = []
+        for field_name, field in zip(field_names, fields):
+            if field_name in cached_data:
+                continue
+            if isinstance(field, DerivedField):
+                required_fields = field.base_fields
+            else:
+                required_fields = [field]
+            for base_field in required_fields:
+                if base_field not in base_fields:
+                    base_fields.append(base_field)
+        return base_fields
+
+    def _assemble_fields(self, field_names, fields, field_units, time_step,
+                         slicing, conversion, cached_data, base_data):
+        """Get all requested fields from the shared base field data."""
+        axes_units = conversion['axes_units']
+        axes_to_convert = conversion['axes_to_convert']
+        time_units = conversion['time_units']
+        base_data_si = {}
+        fields_data = {}
+        for field_name, field, units in zip(field_names, fields, field_units):
+            if field_name in cached_data:
+                fields_data[field_name] = cached_data[field_name]
+            elif isinstance(field, DerivedField):
+                field_data = []
+                for base_field in field.base_fields:
+                    if base_field not in base_data_si:
+                        base_data_si[base_field] = self._convert_to_si(
+                            base_field, *base_data[base_field])
+                    fld, fld_md = base_data_si[base_field]
+                    field_data.append(fld)
+                fld, fld_md = field.calculate_from_base_data(
+                    field_data, copy.deepcopy(fld_md), field_units=units,
+                    **conversion)
+                fields_data[field_name] = field.cache_data(
+                    time_step, fld, fld_md, field_units=units,
+                    **conversion, **slicing)
+            else:
+                fld, fld_md = base_data[field]
+                if any(unit is not None for unit in
+                       [units, axes_units, time_units]):
+                    fld, fld_md = field.unit_converter.convert_field_units(
+                        fld, copy.deepcopy(fld_md), target_field_units=units,
+                        target_axes_units=axes_units,
+                        axes_to_convert=axes_to_convert,
+                        target_time_units=time_units)
+                fields_data[field_name] = (fld, fld_md)
+        return fields_data
+
     def get_species(self, species_name):
         """
         Get a specified particle species from the available ones.
@@ -170,10 +416,16 @@ class DataContainer():
             'requirements': a dict containing the list of required fields
                 with the geometry type of the data as keys.
             'recipe': a callable function to calculate the derived field
-                from the required fields.
+                from the required fields, or a dict containing, for each
+                geometry, an expression of the required fields (see
+                `field_expressions.FieldExpression`).
+            Optionally, it can also contain the key 'pointwise', which
+            should be set to False for recipes where the value at each point
+            depends on the data along the longitudinal axis (e.g., an
+            envelope calculated with FFTs).
         """
         sim_geometry = self._get_simulation_geometry()
-        if sim_geometry is not None:
+        if sim_geometry in derived_field['requirements']:
             folder_field_names = self.get_list_of_fields(include_derived=False)
             required_fields = derived_field['requirements'][sim_geometry]
             if set(required_fields).issubset(folder_field_names):
@@ -183,7 +435,7 @@ class DataContainer():
 
                 self.derived_fields.append(DerivedField(
                     derived_field, sim_geometry, self.sim_params,
-                    base_fields))
+                    base_fields, self.disk_cache))
 
     def _set_folder_scanner(self):
         """Return the folder scanner corresponding to the simulation code."""
@@ -206,6 +458,11 @@ class DataContainer():
         for derived_field in derived_field_definitions:
             self.add_derived_field(derived_field)
 
+    def _convert_to_si(self, field, field_data, field_md):
+        """Convert the data of a field to SI units."""
+        return field.unit_converter.convert_field_units(
+            field_data, copy.deepcopy(field_md), target_field_units='SI')
+
     def _get_simulation_geometry(self):
         """Returns a string with the geometry used in the simulation."""
         if len(self.folder_fields) > 0:
@@ -230,6 +487,7 @@ class DataContainer():
                     species = self.get_species(field.species_name)
                 except:
                     species = ParticleSpecies(
-                        field.species_name, [], [], [], None, None)
+                        field.species_name, [], [], [], None, None,
+                        self.disk_cache)
                     self.particle_species.append(species)
                 species.add_associated_field(field)
@@ -0,0 +1,215 @@
+"""
+This file is part of VisualPIC.
+
+The module contains methods for depositing particle data onto a regular
+grid and for interpolating gridded data at the particle positions.
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+
+import itertools
+
+import numpy as np
+
+
+# Order of the supported particle shapes.
+DEPOSITION_SHAPES = {'ngp': 0, 'cic': 1, 'tsc': 2}
+
+# Maximum size (in bytes) of the temporary arrays of each chunk of
+# particles.
+DEFAULT_CHUNK_BYTES = 2**26
+
+
+def deposit_particles(positions, weights, grid_min, grid_max, n_cells,
+                      shape='cic', max_chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Deposit particles onto a regular 1D, 2D or 3D grid.
+
+    The particles are processed in chunks and the contribution of each chunk
+    is accumulated with `np.bincount`, so that the memory usage does not
+    grow with the number of particles. Contributions falling outside of the
+    grid are discarded.
+
+    Parameters
+    ----------
+
+    positions : list
+        List of arrays with the particle coordinates along each grid axis.
+
+    weights : array
+        Weight of each particle (e.g., its charge). If None, all particles
+        have unit weight.
+
+    grid_min, grid_max : list
+        Positions of the centers of the first and last cells along each
+        axis.
+
+    n_cells : list
+        Number of cells along each axis.
+
+    shape : str
+        Particle shape. Possible values are 'ngp' (nearest grid point),
+        'cic' (cloud in cell) and 'tsc' (triangular shaped cloud).
+
+    max_chunk_bytes : int
+        Maximum size of the temporary arrays of each chunk of particles.
+
+    Returns
+    -------
+    An array of shape `n_cells` with the sum of the deposited weights in
+    each cell.
+    """
+    if shape not in DEPOSITION_SHAPES:
+        raise ValueError(
+            "Unknown particle shape '{}'. Possible values are {}.".format(
+                shape, list(DEPOSITION_SHAPES)))
+    n_cells = [int(n) for n in n_cells]
+    order = DEPOSITION_SHAPES[shape]
+    n_stencil = (order + 1) ** len(n_cells)
+    n_part = len(positions[0])
+    deposited = np.zeros(int(np.prod(n_cells)), dtype=np.float64)
+    chunk_size = max(1, max_chunk_bytes // (17 * n_stencil))
+    for start in range(0, n_part, chunk_size):
+        end = min(start + chunk_size, n_part)
+        flat_idx, flat_w, valid = _get_stencil(
+            [pos[start:end] for pos in positions], grid_min, grid_max,
+            n_cells, order)
+        if weights is not None:
+            flat_w *= np.asarray(weights[start:end])[:, np.newaxis]
+        deposited += np.bincount(flat_idx[valid], weights=flat_w[valid],
+                                 minlength=deposited.size)
+    return deposited.reshape(n_cells)
+
+
+def gather_field(fld, positions, grid_min, grid_max, shape='cic',
+                 max_chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Interpolate (gather) gridded data at the particle positions, using the
+    same particle shapes as `deposit_particles`.
+
+    Near the edges of the grid, only the cells inside the grid contribute
+    (with renormalized shape factors). Particles outside of the grid get a
+    value of NaN.
+
+    Parameters
+    ----------
+
+    fld : ndarray
+        The gridded data. Its last axes are the grid axes. Any leading axes
+        (e.g., azimuthal modes) are gathered independently.
+
+    positions : list
+        List of arrays with the particle coordinates along each grid axis.
+
+    grid_min, grid_max : list
+        Positions of the centers of the first and last cells along each
+        axis.
+
+    shape : str
+        Particle shape ('ngp', 'cic' or 'tsc'), i.e., an interpolation of
+        order 0, 1 or 2.
+
+    max_chunk_bytes : int
+        Maximum size of the temporary arrays of each chunk of particles.
+
+    Returns
+    -------
+    An array of shape (*leading_axes, n_particles) with the interpolated
+    values.
+    """
+    if shape not in DEPOSITION_SHAPES:
+        raise ValueError(
+            "Unknown particle shape '{}'. Possible values are {}.".format(
+                shape, list(DEPOSITION_SHAPES)))
+    order = DEPOSITION_SHAPES[shape]
+    n_dims = len(positions)
+    n_cells = list(fld.shape[fld.ndim - n_dims:])
+    lead_shape = fld.shape[:fld.ndim - n_dims]
+    fld = np.reshape(fld, (-1, int(np.prod(n_cells))))
+    n_stencil = (order + 1) ** n_dims
+    n_part = len(positions[0])
+    gathered = np.full((fld.shape[0], n_part), np.nan)
+    chunk_size = max(
+        1, max_chunk_bytes // (8 * n_stencil * (fld.shape[0] + 3)))
+    for start in range(0, n_part, chunk_size):
+        end = min(start + chunk_size, n_part)
+        flat_idx, flat_w, valid = _get_stencil(
+            [pos[start:end] for pos in positions], grid_min, grid_max,
+            n_cells, order)
+        flat_idx[~valid] = 0
+        flat_w[~valid] = 0.
+        w_sum = flat_w.sum(axis=1)
+        inside = w_sum > 0
+        values = np.einsum('lps,ps->lp', fld[:, flat_idx], flat_w)
+        gathered[:, start:end][:, inside] = (values[:, inside] /
+                                             w_sum[inside])
+    return gathered.reshape(lead_shape + (n_part,))
+
+
+def _get_stencil(positions, grid_min, grid_max, n_cells, order):
+    """
+    Get the flat indices of the cells to which each particle contributes,
+    the corresponding shape factors and whether each cell is inside of the
+    grid. Each array has shape (n_particles, n_stencil).
+    """
+    n_cells = [int(n) for n in n_cells]
+    if any(n < 2 for n in n_cells):
+        raise ValueError('The grid must have at least 2 cells per axis.')
+    n_dims = len(n_cells)
+    n_stencil = (order + 1) ** n_dims
+    n_part = len(positions[0])
+    strides = np.cumprod([1] + n_cells[:0:-1])[::-1]
+    # Cell indices and shape factors of each axis.
+    axis_stencils = []
+    for pos, g_min, g_max, n in zip(positions, grid_min, grid_max, n_cells):
+        x = (np.asarray(pos, dtype=np.float64) - g_min) * (n - 1) / (
+            g_max - g_min)
+        axis_stencils.append(_get_shape_factors(x, order))
+    flat_idx = np.zeros((n_part, n_stencil), dtype=np.int64)
+    flat_w = np.ones((n_part, n_stencil), dtype=np.float64)
+    valid = np.ones((n_part, n_stencil), dtype=bool)
+    for j, nodes in enumerate(
+            itertools.product(range(order + 1), repeat=n_dims)):
+        for axis, node in enumerate(nodes):
+            idx, w = axis_stencils[axis]
+            flat_idx[:, j] += idx[node] * strides[axis]
+            flat_w[:, j] *= w[node]
+            valid[:, j] &= (idx[node] >= 0) & (idx[node] < n_cells[axis])
+    return flat_idx, flat_w, valid
+
+
+def _get_shape_factors(x, order):
+    """
+    Get the indices of the cells to which particles contribute and the
+    corresponding shape factors.
+
+    Parameters
+    ----------
+
+    x : array
+        Position of the particles in units of the cell size, relative to the
+        center of the first cell.
+
+    order : int
+        Order of the particle shape.
+
+    Returns
+    -------
+    Two lists (one element per cell in the stencil) with the cell indices
+    and the shape factors.
+    """
+    # Particles with non-finite coordinates are moved outside of the grid.
+    x = np.where(np.isfinite(x), x, -2.)
+    if order == 0:
+        i = np.floor(x + 0.5).astype(np.int64)
+        return [i], [np.ones_like(x)]
+    if order == 1:
+        i = np.floor(x).astype(np.int64)
+        frac = x - i
+        return [i, i + 1], [1 - frac, frac]
+    i = np.floor(x + 0.5).astype(np.int64)
+    d = x - i
+    return ([i - 1, i, i + 1],
+            [0.5 * (0.5 - d)**2, 0.75 - d**2, 0.5 * (0.5 + d)**2])
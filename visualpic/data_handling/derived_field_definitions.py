@@ -8,8 +8,11 @@ License: GNU GPL-3.0.
 """
 
 
-import scipy.constants as ct
 import numpy as np
+import scipy.constants as ct
+
+from visualpic.data_handling.laser_envelope import (
+    calculate_envelope, calculate_envelope_phase)
 
 
 derived_field_definitions = []
@@ -22,45 +25,23 @@ substitute 'Field name' and 'field_name' with the appropriate name.
 -------------------------------------------------------------------------------
 
 # Field name
-def calculate_field_name(data_list, sim_geometry, sim_params):
-    """
-    Defines how the field is calculated for each possible simulation geometry.
-
-    Parameters
-    ----------
-
-    data_list : list
-        List containing all the FolderFields specified in
-        field_name['requirements'][sim_geometry] and in the same order.
-
-    sim_geometry : str
-        Geometry of the simulation.
-
-    sim_params : dict
-        Provided if needed to calculate some fields. Dictionary containing the
-        keys 'n_p' for the plasma density and 'lambda_0' for the laser
-        wavelength in the simulation.
-
-    Returns
-    -------
-    An numpy array containing the field data with the same dimensions as the
-    fields in the data_list.
-    """
-    if sim_geometry == '1d':
-        raise NotImplementedError
-    elif sim_geometry == '2dcartesian':
-        raise NotImplementedError
-    elif sim_geometry == '3dcartesian':
-        raise NotImplementedError
-    elif sim_geometry == 'cylindrical':
-        raise NotImplementedError
-    elif sim_geometry == 'thetaMode':
-        raise NotImplementedError
-
 
 # Dictionary containing the necessary field information. The requirements for
 # each geometry is simply a list of strings with the names of the fields (in
 # VisualPIC convention) needed to compute the derived field.
+# The recipe is a dictionary with an expression for each supported geometry.
+# Expressions can contain the names of the required fields, the simulation
+# parameters ('n_p', 'lambda_0'), basic arithmetic operators and the
+# constants and functions defined in `field_expressions.CONSTANTS` and
+# `field_expressions.FUNCTIONS`. They are evaluated in place into a single
+# output array, without creating full-size temporary arrays.
+# Alternatively, the recipe can be a function with signature
+# (data_list, sim_geometry, sim_params) returning the field array, where
+# data_list contains the data of the required fields (in the same order) and
+# sim_params is a dictionary with the keys 'n_p' and 'lambda_0'.
+# Recipes which are not pointwise (i.e., where the value at a point depends
+# on the data along the longitudinal axis, which is always the last array
+# axis) should include the key 'pointwise' set to False.
 field_name = {'name': 'F',
               'units': '',
               'requirements': {'1d': [],
@@ -68,7 +49,11 @@ field_name = {'name': 'F',
                                '3dcartesian': [],
                                'cylindrical': [],
                                'thetaMode': []},
-              'recipe': calculate_field_name}
+              'recipe': {'1d': '',
+                         '2dcartesian': '',
+                         '3dcartesian': '',
+                         'cylindrical': '',
+                         'thetaMode': ''}}
 
 
 # Finally, add the dictionary to the list.
@@ -77,24 +62,6 @@ derived_field_definitions.append(field_name)
 
 
 # Intensity
-def calculate_intensity(data_list, sim_geometry, sim_params):
-    if sim_geometry == '1d':
-        Ez = data_list[0]
-        E2 = Ez**2
-    elif sim_geometry == '2dcartesian':
-        Ez, Ex = data_list
-        E2 = Ez**2 + Ex**2
-    elif sim_geometry == '3dcartesian':
-        Ez, Ex, Ey = data_list
-        E2 = Ez**2 + Ex**2 + Ey**2
-    elif sim_geometry == 'cylindrical':
-        raise NotImplementedError
-    elif sim_geometry == 'thetaMode':
-        Ez, Er, Et = data_list
-        E2 = Ez**2 + Er**2 + Et**2
-    return ct.c * ct.epsilon_0 / 2 * E2
-
-
 intensity = {'name': 'I',
              'units': 'W/m^2',
              'requirements': {'1d': ['Ez'],
@@ -102,33 +69,18 @@ intensity = {'name': 'I',
                               '3dcartesian': ['Ez', 'Ex', 'Ey'],
                               'cylindrical': ['Ez', 'Er'],
                               'thetaMode': ['Ez', 'Er', 'Et']},
-             'recipe': calculate_intensity}
+             'recipe': {'1d': 'c * epsilon_0 / 2 * Ez**2',
+                        '2dcartesian': 'c * epsilon_0 / 2 * (Ez**2 + Ex**2)',
+                        '3dcartesian':
+                            'c * epsilon_0 / 2 * (Ez**2 + Ex**2 + Ey**2)',
+                        'thetaMode':
+                            'c * epsilon_0 / 2 * (Ez**2 + Er**2 + Et**2)'}}
 
 
 derived_field_definitions.append(intensity)
 
 
 # Vector potential
-def calculate_vector_pot(data_list, sim_geometry, sim_params):
-    l_0 = sim_params['lambda_0']
-    if sim_geometry == '1d':
-        Ez = data_list[0]
-        E2 = Ez**2
-    elif sim_geometry == '2dcartesian':
-        Ez, Ex = data_list
-        E2 = Ez**2 + Ex**2
-    elif sim_geometry == '3dcartesian':
-        Ez, Ex, Ey = data_list
-        E2 = Ez**2 + Ex**2 + Ey**2
-    elif sim_geometry == 'cylindrical':
-        raise NotImplementedError
-    elif sim_geometry == 'thetaMode':
-        Ez, Er, Et = data_list
-        E2 = Ez**2 + Er**2 + Et**2
-    k_0 = 2. * np.pi / l_0
-    return np.sqrt(E2) / k_0
-
-
 vector_pot = {'name': 'A',
               'units': 'V',
               'requirements': {'1d': ['Ez'],
@@ -136,26 +88,77 @@ vector_pot = {'name': 'A',
                                '3dcartesian': ['Ez', 'Ex', 'Ey'],
                                'cylindrical': ['Ez', 'Er'],
                                'thetaMode': ['Ez', 'Er', 'Et']},
-              'recipe': calculate_vector_pot}
+              'recipe': {'1d': 'abs(Ez) * (lambda_0 / (2 * pi))',
+                         '2dcartesian':
+                             'sqrt(Ez**2 + Ex**2) * (lambda_0 / (2 * pi))',
+                         '3dcartesian':
+                             'sqrt(Ez**2 + Ex**2 + Ey**2) '
+                             '* (lambda_0 / (2 * pi))',
+                         'thetaMode':
+                             'sqrt(Ez**2 + Er**2 + Et**2) '
+                             '* (lambda_0 / (2 * pi))'}}
 
 
 derived_field_definitions.append(vector_pot)
 
 
 # Normalized vector potential
-def calculate_norm_vector_pot(data_list, sim_geometry, sim_params):
-    A = calculate_vector_pot(data_list, sim_geometry, sim_params)
-    return A / ((ct.m_e * ct.c**2) / ct.e)
+norm_vector_pot = {
+    'name': 'a',
+    'units': '',
+    'requirements': {'1d': ['Ez'],
+                     '2dcartesian': ['Ez', 'Ex'],
+                     '3dcartesian': ['Ez', 'Ex', 'Ey'],
+                     'cylindrical': ['Ez', 'Er'],
+                     'thetaMode': ['Ez', 'Er', 'Et']},
+    'recipe': {
+        '1d': 'abs(Ez) * (lambda_0 * e / (2 * pi * m_e * c**2))',
+        '2dcartesian':
+            'sqrt(Ez**2 + Ex**2) * (lambda_0 * e / (2 * pi * m_e * c**2))',
+        '3dcartesian':
+            'sqrt(Ez**2 + Ex**2 + Ey**2) '
+            '* (lambda_0 * e / (2 * pi * m_e * c**2))',
+        'thetaMode':
+            'sqrt(Ez**2 + Er**2 + Et**2) '
+            '* (lambda_0 * e / (2 * pi * m_e * c**2))'}}
 
 
-norm_vector_pot = {'name': 'a',
-                   'units': '',
-                   'requirements': {'1d': ['Ez'],
-                                    '2dcartesian': ['Ez', 'Ex'],
-                                    '3dcartesian': ['Ez', 'Ex', 'Ey'],
-                                    'cylindrical': ['Ez', 'Er'],
-                                    'thetaMode': ['Ez', 'Er', 'Et']},
-                   'recipe': calculate_norm_vector_pot}
+derived_field_definitions.append(norm_vector_pot)
 
 
-derived_field_definitions.append(norm_vector_pot)
+# Envelope of the normalized vector potential
+def calculate_a_envelope(data_list, sim_geometry, sim_params):
+    """Normalized vector potential from the envelope of the laser field."""
+    envelope = calculate_envelope(data_list)
+    envelope *= sim_params['lambda_0'] * ct.e / (2 * np.pi * ct.m_e * ct.c**2)
+    return envelope
+
+
+a_envelope = {'name': 'a_env',
+              'units': '',
+              'requirements': {'2dcartesian': ['Ex'],
+                               '3dcartesian': ['Ex', 'Ey'],
+                               'thetaMode': ['Er', 'Et']},
+              'recipe': calculate_a_envelope,
+              'pointwise': False}
+
+
+derived_field_definitions.append(a_envelope)
+
+
+# Phase of the laser field
+def calculate_a_phase(data_list, sim_geometry, sim_params):
+    """Phase of the analytic signal of the laser field."""
+    return calculate_envelope_phase(data_list[0])
+
+
+a_phase = {'name': 'a_phase',
+           'units': 'rad',
+           'requirements': {'2dcartesian': ['Ex'],
+                            '3dcartesian': ['Ex'],
+                            'thetaMode': ['Ex']},
+           'recipe': calculate_a_phase,
+           'pointwise': False}
+
+
+derived_field_definitions.append(a_phase)
@@ -8,6 +8,10 @@ License: GNU GPL-3.0.
 """
 
 
+import numpy as np
+import scipy.constants as ct
+
+
 derived_particle_data_definitions = []
 
 
@@ -36,8 +40,9 @@ def calculate_component_name(data_dict):
     ----------
 
     data_dict : dict
-        Dictionary containing the data of all components specified in
-        component_name['requirements'].
+        Dictionary containing the data (in SI units) of all components
+        specified in component_name['requirements']. Each element is a tuple
+        with the data array and its metadata.
 
     Returns
     -------
@@ -48,7 +53,8 @@ def calculate_component_name(data_dict):
 
 # Dictionary containing the necessary component information. The requirements
 # are specified as a list of the names (in VisualPIC convention) of the
-# components needed to compute the derived component.
+# components needed to compute the derived component. These can also be other
+# derived components, which are then calculated only once.
 component_name = {'name': 'c',
                   'units': '',
                   'requirements': [],
@@ -74,3 +80,67 @@ x_prime = {'name': 'x_prime',
 
 
 derived_particle_data_definitions.append(x_prime)
+
+
+# y_prime
+def calculate_y_prime(data_dict):
+    py = data_dict['py'][0]
+    pz = data_dict['pz'][0]
+    return py / pz
+
+
+y_prime = {'name': 'y_prime',
+           'units': 'rad',
+           'requirements': ['py', 'pz'],
+           'recipe': calculate_y_prime}
+
+
+derived_particle_data_definitions.append(y_prime)
+
+
+# Lorentz factor (momentum in m_e*c units)
+def calculate_gamma(data_dict):
+    px = data_dict['px'][0]
+    py = data_dict['py'][0]
+    pz = data_dict['pz'][0]
+    return np.sqrt(1 + px**2 + py**2 + pz**2)
+
+
+gamma = {'name': 'gamma',
+         'units': '',
+         'requirements': ['px', 'py', 'pz'],
+         'recipe': calculate_gamma}
+
+
+derived_particle_data_definitions.append(gamma)
+
+
+# Kinetic energy (assuming electron mass)
+def calculate_ekin(data_dict):
+    gamma = data_dict['gamma'][0]
+    return (gamma - 1) * (ct.m_e * ct.c**2)
+
+
+ekin = {'name': 'ekin',
+        'units': 'J',
+        'requirements': ['gamma'],
+        'recipe': calculate_ekin}
+
+
+derived_particle_data_definitions.append(ekin)
+
+
+# Longitudinal velocity normalized to c
+def calculate_beta_z(data_dict):
+    pz = data_dict['pz'][0]
+    gamma = data_dict['gamma'][0]
+    return pz / gamma
+
+
+beta_z = {'name': 'beta_z',
+          'units': '',
+          'requirements': ['pz', 'gamma'],
+          'recipe': calculate_beta_z}
+
+
+derived_particle_data_definitions.append(beta_z)
@@ -0,0 +1,271 @@
+"""
+This file is part of VisualPIC.
+
+The module contains the DiskCache class, a size-limited persistent cache of
+derived field data stored as compressed HDF5 files.
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+
+import os
+import json
+import hashlib
+import inspect
+import tempfile
+
+import numpy as np
+from h5py import File as H5F
+
+from visualpic.data_handling.data_cache import _to_hashable
+
+
+class DiskCache():
+
+    """
+    Persistent cache of field data.
+
+    Each entry is stored in its own compressed HDF5 file, named after the
+    hash of its key, inside the cache folder. When the total size of the
+    cached files exceeds the size limit, the least recently used entries are
+    removed. Since keys are built from the identity of the source data
+    (including the modification times of the data files), entries of
+    modified data are never reused.
+
+    The metadata is stored as a JSON description (with its numeric arrays
+    as HDF5 datasets) and never unpickled, so that reading a cache file
+    cannot execute arbitrary code.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=10*2**30,
+                 compression='gzip'):
+        """
+        Initialize the cache.
+
+        Parameters
+        ----------
+
+        cache_dir : str
+            (Optional) Folder in which to store the cached data. By default,
+            '~/.cache/visualpic'.
+
+        max_bytes : int
+            Maximum size (in bytes) of all cached files.
+
+        compression : str
+            Compression filter of the HDF5 datasets (e.g., 'gzip', 'lzf' or
+            None).
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(
+                os.path.expanduser('~'), '.cache', 'visualpic')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.compression = compression
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, *identity):
+        """
+        Build the key of an entry from any number of (nested) lists, tuples,
+        dicts, arrays or basic Python objects identifying the data.
+        """
+        key_str = repr(_to_hashable(identity))
+        return hashlib.sha256(key_str.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Get an entry from the cache.
+
+        Parameters
+        ----------
+
+        key : str
+            Key of the entry, as returned by `make_key`.
+
+        Returns
+        -------
+        A tuple with the data array and its metadata dictionary, or None if
+        the entry is not in the cache.
+        """
+        file_path = self._get_file_path(key)
+        try:
+            with H5F(file_path, 'r') as file:
+                data = file['data'][()]
+                metadata = _decode_metadata(
+                    json.loads(file.attrs['metadata_json']),
+                    file['metadata_arrays'])
+        except (OSError, KeyError, ValueError, TypeError):
+            return None
+        # Update access time, used for evicting entries.
+        os.utime(file_path)
+        return data, metadata
+
+    def put(self, key, data, metadata):
+        """
+        Store an entry in the cache.
+
+        Parameters
+        ----------
+
+        key : str
+            Key of the entry, as returned by `make_key`.
+
+        data : ndarray
+            The data array.
+
+        metadata : dict
+            The metadata dictionary of the data. Entries whose metadata
+            contains objects other than dicts, lists, tuples, arrays, numpy
+            scalars or basic Python types are not stored.
+        """
+        arrays = []
+        try:
+            metadata_json = json.dumps(_encode_metadata(metadata, arrays))
+        except TypeError:
+            return
+        data = np.asarray(data)
+        compression = self.compression
+        if data.ndim == 0:
+            compression = None
+        # Write to a temporary file first so that incomplete entries are
+        # never read.
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            with H5F(tmp_path, 'w') as file:
+                file.create_dataset('data', data=data,
+                                    compression=compression)
+                file.attrs['metadata_json'] = metadata_json
+                arrays_group = file.create_group('metadata_arrays')
+                for i, array in enumerate(arrays):
+                    arrays_group.create_dataset(str(i), data=array)
+            os.replace(tmp_path, self._get_file_path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict()
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        for file_path, _, _ in self._get_entries():
+            os.remove(file_path)
+
+    def get_size(self):
+        """Returns the total size (in bytes) of the cached files."""
+        return sum(size for _, size, _ in self._get_entries())
+
+    def _get_file_path(self, key):
+        """Get the path of the file storing an entry."""
+        return os.path.join(self.cache_dir, key + '.h5')
+
+    def _get_entries(self):
+        """Get the path, size and last access time of all entries."""
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith('.h5'):
+                file_path = os.path.join(self.cache_dir, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                entries.append(
+                    (file_path, stat.st_size, max(stat.st_atime,
+                                                  stat.st_mtime)))
+        return entries
+
+    def _evict(self):
+        """Remove least recently used entries until within the size limit."""
+        entries = self._get_entries()
+        total_size = sum(size for _, size, _ in entries)
+        for file_path, size, _ in sorted(entries, key=lambda e: e[2]):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            total_size -= size
+
+
+def _encode_metadata(obj, arrays):
+    """
+    Encode a metadata object as a JSON-serializable object. Numeric arrays
+    are appended to `arrays` and replaced by their index. Dicts, tuples,
+    numpy scalars and other arrays are tagged so that their type is
+    preserved.
+    """
+    if isinstance(obj, np.generic):
+        if obj.dtype.kind not in 'biuf':
+            raise TypeError('Unsupported metadata type {}.'.format(type(obj)))
+        return {'__npscalar__': [obj.dtype.str, obj.item()]}
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind in 'biufc':
+            arrays.append(obj)
+            return {'__ndarray__': len(arrays) - 1}
+        return {'__ndarray_list__': [
+            obj.dtype.str, _encode_metadata(obj.tolist(), arrays)]}
+    if isinstance(obj, list):
+        return [_encode_metadata(item, arrays) for item in obj]
+    if isinstance(obj, tuple):
+        return {'__tuple__': [_encode_metadata(item, arrays) for item in obj]}
+    if isinstance(obj, dict):
+        return {'__dict__': [[_encode_metadata(key, arrays),
+                              _encode_metadata(value, arrays)]
+                             for key, value in obj.items()]}
+    raise TypeError('Unsupported metadata type {}.'.format(type(obj)))
+
+
+def _decode_metadata(obj, arrays_group):
+    """Decode a metadata object encoded with `_encode_metadata`."""
+    if isinstance(obj, list):
+        return [_decode_metadata(item, arrays_group) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    (tag, value), = obj.items()
+    if tag == '__npscalar__':
+        return np.dtype(value[0]).type(value[1])
+    if tag == '__ndarray__':
+        return arrays_group[str(value)][()]
+    if tag == '__ndarray_list__':
+        return np.array(_decode_metadata(value[1], arrays_group),
+                        dtype=np.dtype(value[0]))
+    if tag == '__tuple__':
+        return tuple(_decode_metadata(item, arrays_group) for item in value)
+    if tag == '__dict__':
+        return {_decode_metadata(key, arrays_group):
+                _decode_metadata(item, arrays_group) for key, item in value}
+    raise ValueError("Unknown metadata tag '{}'.".format(tag))
+
+
+def get_source_signature(file_paths):
+    """
+    Get a signature of a list of data files, consisting of their path,
+    modification time and size.
+    """
+    signature = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            signature.append(
+                (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((file_path, None, None))
+    return tuple(signature)
+
+
+def get_recipe_signature(recipe):
+    """
+    Get a signature of the recipe of a derived field. For functions, this is
+    a hash of their source code, so that modifying the recipe invalidates
+    the cached data.
+    """
+    if callable(recipe):
+        try:
+            source = inspect.getsource(recipe)
+        except (OSError, TypeError):
+            source = getattr(recipe, '__qualname__', repr(recipe))
+        return hashlib.sha256(source.encode()).hexdigest()
+    return repr(_to_hashable(recipe))
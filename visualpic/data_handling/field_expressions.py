@@ -0,0 +1,335 @@
+"""
+This file is part of VisualPIC.
+
+The module contains the FieldExpression class, which evaluates arithmetic
+expressions of field arrays block by block into a single output buffer.
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+
+import ast
+from functools import lru_cache
+
+import numpy as np
+import scipy.constants as ct
+
+
+# Physical constants which can be used in the expressions.
+CONSTANTS = {'pi': np.pi,
+             'c': ct.c,
+             'e': ct.e,
+             'm_e': ct.m_e,
+             'epsilon_0': ct.epsilon_0,
+             'mu_0': ct.mu_0}
+
+# Functions which can be used in the expressions.
+FUNCTIONS = {'sqrt': np.sqrt,
+             'abs': np.abs,
+             'square': np.square,
+             'exp': np.exp,
+             'log': np.log,
+             'sin': np.sin,
+             'cos': np.cos,
+             'tan': np.tan,
+             'arctan': np.arctan,
+             'arctan2': np.arctan2,
+             'hypot': np.hypot,
+             'minimum': np.minimum,
+             'maximum': np.maximum}
+
+_BINARY_OPERATORS = {ast.Add: np.add,
+                     ast.Sub: np.subtract,
+                     ast.Mult: np.multiply,
+                     ast.Div: np.true_divide,
+                     ast.Pow: np.power}
+
+# Default number of elements evaluated at once. The temporary buffers of a
+# block (8 bytes per element for float64 data) should fit in the L2 cache.
+DEFAULT_BLOCK_SIZE = 2**15
+
+
+class FieldExpression():
+
+    """
+    Arithmetic expression of one or several fields.
+
+    The expression is parsed once into a tree of numpy ufuncs. When evaluated,
+    the output array is filled block by block (along its first axis) and all
+    intermediate results are computed in place in a few small scratch
+    buffers. Therefore, no full-size temporary arrays are created and the
+    peak memory usage is that of the output array. Scalar subexpressions
+    (constants and simulation parameters) are folded before evaluation.
+
+    Expressions can contain the names of fields, the simulation parameters
+    (e.g. 'lambda_0', 'n_p'), the constants in `CONSTANTS`, the functions in
+    `FUNCTIONS` and the operators +, -, *, / and **. For example, the laser
+    intensity in 3D is given by 'c * epsilon_0 / 2 * (Ez**2 + Ex**2 + Ey**2)'.
+    """
+
+    def __init__(self, expression):
+        """
+        Initialize the expression.
+
+        Parameters
+        ----------
+
+        expression : str
+            The expression to evaluate.
+        """
+        self.expression = expression
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError:
+            raise ValueError(
+                "Invalid expression '{}'.".format(expression))
+        self._tree = self._build_node(tree.body)
+
+    def get_names(self):
+        """Returns the set of variable names used in the expression."""
+        return self._get_node_names(self._tree)
+
+    def evaluate(self, arrays, scalars=None, out=None,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Evaluate the expression.
+
+        Parameters
+        ----------
+
+        arrays : dict
+            Dictionary mapping variable names to the input arrays. All arrays
+            must have the same shape. Any object supporting numpy slicing
+            along the first axis (e.g. an h5py dataset) can also be used,
+            in which case it is read one block at a time.
+
+        scalars : dict
+            (Optional) Dictionary mapping variable names to scalar values,
+            such as the simulation parameters. They take precedence over
+            `CONSTANTS`.
+
+        out : ndarray
+            (Optional) Array in which to store the result. If not given, a
+            new array is created.
+
+        block_size : int
+            Approximate number of elements to evaluate at once.
+
+        Returns
+        -------
+        An array with the result of the expression.
+        """
+        if scalars is None:
+            scalars = {}
+        tree = self._bind(self._tree, arrays, scalars)
+        if len(arrays) == 0:
+            raise ValueError(
+                "No input arrays given to expression '{}'.".format(
+                    self.expression))
+        shapes = set(np.shape(array) for array in arrays.values())
+        if len(shapes) > 1:
+            raise ValueError(
+                "Input arrays of expression '{}' have different ".format(
+                    self.expression) + "shapes {}.".format(shapes))
+        shape = shapes.pop()
+        if out is None:
+            dtypes = [array.dtype for array in arrays.values()]
+            out = np.empty(shape, dtype=np.result_type(np.float16, *dtypes))
+        elif out.shape != shape:
+            raise ValueError(
+                "Output array has shape {} but {} was expected.".format(
+                    out.shape, shape))
+        if tree[0] == 'const':
+            out[...] = tree[1]
+            return out
+        if tree[0] == 'name':
+            tree = ('op', np.positive, [tree])
+        if len(shape) == 0:
+            self._evaluate_node(tree, arrays, (), out[...], [], 0)
+            return out
+        row_size = int(np.prod(shape[1:]))
+        n_rows = max(1, block_size // max(1, row_size))
+        buffers = []
+        for i in range(0, shape[0], n_rows):
+            block = slice(i, min(i + n_rows, shape[0]))
+            self._evaluate_node(tree, arrays, block, out[block], buffers, 0)
+        return out
+
+    def _build_node(self, node):
+        """Convert a node of the syntax tree into a tuple."""
+        # Numbers are 'Num' nodes in Python < 3.8 and 'Constant' afterwards.
+        value = getattr(node, 'value', getattr(node, 'n', None))
+        if (type(node).__name__ in ['Constant', 'Num']
+                and isinstance(value, (int, float))):
+            return ('const', value)
+        if isinstance(node, ast.Name):
+            return ('name', node.id)
+        if isinstance(node, ast.UnaryOp):
+            operand = self._build_node(node.operand)
+            if isinstance(node.op, ast.USub):
+                return ('op', np.negative, [operand])
+            if isinstance(node.op, ast.UAdd):
+                return operand
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            return ('op', _BINARY_OPERATORS[type(node.op)],
+                    [self._build_node(node.left),
+                     self._build_node(node.right)])
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id in FUNCTIONS and not node.keywords):
+            function = FUNCTIONS[node.func.id]
+            if len(node.args) == function.nin:
+                return ('op', function,
+                        [self._build_node(arg) for arg in node.args])
+        raise ValueError(
+            "Unsupported element '{}' in expression '{}'.".format(
+                type(node).__name__, self.expression))
+
+    def _get_node_names(self, node):
+        """Get the variable names in a node and its children."""
+        if node[0] == 'name':
+            return {node[1]}
+        if node[0] == 'op':
+            return set().union(
+                *[self._get_node_names(arg) for arg in node[2]])
+        return set()
+
+    def _bind(self, node, arrays, scalars):
+        """
+        Replace scalar variables by their value, fold constant
+        subexpressions and simplify powers.
+        """
+        if node[0] == 'name':
+            name = node[1]
+            if name in arrays:
+                return node
+            if name in scalars:
+                return ('const', scalars[name])
+            if name in CONSTANTS:
+                return ('const', CONSTANTS[name])
+            raise ValueError(
+                "Unknown variable '{}' in expression '{}'.".format(
+                    name, self.expression))
+        if node[0] == 'op':
+            ufunc = node[1]
+            args = [self._bind(arg, arrays, scalars) for arg in node[2]]
+            if all(arg[0] == 'const' for arg in args):
+                return ('const', ufunc(*[arg[1] for arg in args]))
+            if ufunc is np.power and args[1][0] == 'const':
+                if args[1][1] == 2:
+                    return ('op', np.square, args[:1])
+                if args[1][1] == 0.5:
+                    return ('op', np.sqrt, args[:1])
+            return ('op', ufunc, args)
+        return node
+
+    def _evaluate_node(self, node, arrays, block, out, buffers, depth):
+        """
+        Evaluate an operation node for a block of data and store the result
+        in `out`. Child operations are evaluated in the scratch buffers.
+        """
+        ufunc, args = node[1], node[2]
+        operands = []
+        out_used = False
+        for arg in args:
+            if arg[0] == 'const':
+                operands.append(arg[1])
+            elif arg[0] == 'name':
+                operands.append(arrays[arg[1]][block])
+            elif not out_used:
+                # The first child operation can be evaluated directly in the
+                # output buffer, since the ufunc can operate in place.
+                self._evaluate_node(arg, arrays, block, out, buffers, depth)
+                operands.append(out)
+                out_used = True
+            else:
+                buffer = self._get_buffer(buffers, depth, out)
+                self._evaluate_node(
+                    arg, arrays, block, buffer, buffers, depth + 1)
+                operands.append(buffer)
+                depth += 1
+        ufunc(*operands, out=out)
+
+    def _get_buffer(self, buffers, depth, out):
+        """Get a scratch buffer with the same shape and type as `out`."""
+        # Buffers are allocated for the first block, which is never smaller
+        # than the following ones.
+        if len(buffers) <= depth:
+            buffers.append(np.empty_like(out))
+        if out.ndim == 0:
+            return buffers[depth]
+        return buffers[depth][:len(out)]
+
+
+@lru_cache(maxsize=None)
+def get_expression(expression):
+    """Returns the (cached) FieldExpression of an expression string."""
+    return FieldExpression(expression)
+
+
+def get_recipe_expression(recipe, sim_geometry):
+    """
+    Get the FieldExpression of a recipe for a given geometry.
+
+    Parameters
+    ----------
+
+    recipe : str or dict
+        An expression, or a dictionary with the expression for each
+        geometry.
+
+    sim_geometry : str
+        Geometry of the simulation.
+
+    Returns
+    -------
+    A FieldExpression.
+    """
+    if isinstance(recipe, dict):
+        if sim_geometry not in recipe:
+            raise NotImplementedError(
+                "Recipe not available for '{}' geometry.".format(
+                    sim_geometry))
+        recipe = recipe[sim_geometry]
+    return get_expression(recipe)
+
+
+def evaluate_recipe(recipe, field_names, data_list, sim_geometry,
+                    sim_params, out=None):
+    """
+    Evaluate the recipe of a derived field.
+
+    Parameters
+    ----------
+
+    recipe : callable, str or dict
+        Either a function with signature (data_list, sim_geometry,
+        sim_params), an expression, or a dictionary containing the
+        expression for each geometry.
+
+    field_names : list
+        Names of the fields in `data_list`, as used in the expressions.
+
+    data_list : list
+        List with the data of each required field.
+
+    sim_geometry : str
+        Geometry of the simulation.
+
+    sim_params : dict
+        Dictionary containing the simulation parameters.
+
+    out : ndarray
+        (Optional) Array in which to store the result. Only used by
+        expression recipes.
+
+    Returns
+    -------
+    An array with the derived field.
+    """
+    if callable(recipe):
+        return recipe(data_list, sim_geometry, sim_params)
+    expression = get_recipe_expression(recipe, sim_geometry)
+    arrays = dict(zip(field_names, data_list))
+    scalars = {k: v for k, v in sim_params.items() if v is not None}
+    return expression.evaluate(arrays, scalars, out=out)
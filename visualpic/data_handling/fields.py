@@ -8,7 +8,23 @@ License: GNU GPL-3.0.
 """
 
 
-from visualpic.helper_functions import get_common_timesteps
+import copy
+import tempfile
+
+import numpy as np
+from h5py import File as H5F, Dataset as H5Dataset
+
+from visualpic.helper_functions import (
+    get_common_timesteps, read_ahead, stack_timestep_data, run_in_executor)
+from visualpic.data_handling.data_cache import data_cache
+from visualpic.data_handling.disk_cache import (
+    get_source_signature, get_recipe_signature)
+from visualpic.data_handling.field_expressions import evaluate_recipe
+from visualpic.data_handling.reductions import StreamingReduction
+from visualpic.data_handling.lazy_array import LazyFieldArray
+from visualpic.data_handling.deposition import gather_field
+from visualpic.data_reading.openpmd_data_reader import (
+    get_modes_from_polar_grid)
 
 
 class Field():
@@ -28,9 +44,40 @@ class Field():
     def get_data(self, time_step, field_units=None, axes_units=None,
                  axes_to_convert=None, time_units=None, slice_i=0.5,
                  slice_j=0.5, slice_dir_i=None, slice_dir_j=None, m='all',
-                 theta=0, max_resolution_3d=None, only_metadata=False):
+                 theta=0, max_resolution_3d=None, only_metadata=False,
+                 lazy=False):
         raise NotImplementedError
 
+    async def get_data_async(self, time_step, executor=None, semaphore=None,
+                             **kwargs):
+        """
+        Asynchronous version of `get_data`. The data is read in an executor,
+        so that the event loop is not blocked.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step at which to read the data.
+
+        executor : concurrent.futures.Executor
+            (Optional) Executor in which to read the data. By default, the
+            default executor of the event loop.
+
+        semaphore : asyncio.Semaphore
+            (Optional) Semaphore limiting the number of concurrent reads.
+
+        **kwargs
+            Any other argument of `get_data` (units, slicing, etc.).
+
+        Returns
+        -------
+        A tuple with the field data array and its metadata dictionary.
+        """
+        return await run_in_executor(
+            self.get_data, time_step, executor=executor, semaphore=semaphore,
+            **kwargs)
+
     def get_only_metadata(self, time_step, field_units=None, axes_units=None,
                           axes_to_convert=None, time_units=None,
                           slice_dir_i=None, slice_dir_j=None, m='all',
@@ -43,10 +90,724 @@ class Field():
             only_metadata=True)
         return fld_md
 
+    def iter_timesteps(self, timesteps=None, stack=False, n_workers=None,
+                       max_in_flight=2, **kwargs):
+        """
+        Get the field data of several time steps, reading ahead the
+        following time steps in a pool of worker threads.
+
+        The files themselves are not read concurrently: the openPMD reader
+        serializes its accesses with a lock, and h5py holds a global lock
+        during every call. Reading ahead thus overlaps the I/O of the next
+        time steps with the processing of the current one (by the caller
+        and by the unit conversions and recipes of the workers), but it
+        does not speed up the I/O itself.
+
+        Parameters
+        ----------
+
+        timesteps : list
+            (Optional) Time steps to read. By default, all time steps of the
+            field.
+
+        stack : bool
+            If False (default), a generator is returned. If True, the data
+            of all time steps is stacked into a single array.
+
+        n_workers : int
+            (Optional) Number of worker threads. By default, equal to
+            `max_in_flight`.
+
+        max_in_flight : int
+            Maximum number of time steps being read (or waiting to be
+            yielded) at the same time. This bounds the memory usage.
+
+        **kwargs
+            Any other argument of `get_data` (units, slicing, etc.).
+
+        Returns
+        -------
+        If `stack=False`, a generator yielding, in order, a tuple with the
+        time step, the field data and its metadata. If `stack=True`, a tuple
+        with an array of shape (n_timesteps, ...) containing the data of all
+        time steps and a list with the metadata of each time step.
+        """
+        if timesteps is None:
+            timesteps = self.timesteps
+        timesteps = list(timesteps)
+
+        def read_timestep(time_step):
+            return (time_step, *self.get_data(time_step, **kwargs))
+
+        generator = read_ahead(read_timestep, timesteps, n_workers,
+                               max_in_flight)
+        if not stack:
+            return generator
+        _, fld_list, md_list = zip(*generator)
+        return stack_timestep_data(fld_list), list(md_list)
+
+    def aggregate_over_time(self, timesteps=None, stats=['mean', 'rms',
+                                                         'max'],
+                            n_workers=None, max_in_flight=2, **kwargs):
+        """
+        Compute statistics of the field over several time steps, such as
+        its time-averaged value or its RMS.
+
+        The data of each time step is accumulated in place into a single
+        buffer per statistic (using Welford's algorithm for the mean and
+        variance), while the following time steps are read ahead in
+        parallel. Only the data of `max_in_flight` time steps is held in
+        memory at the same time.
+
+        The statistics are computed cell by cell. If the simulation uses a
+        moving window, they are therefore computed in the frame of the
+        window.
+
+        Parameters
+        ----------
+
+        timesteps : list
+            (Optional) Time steps to aggregate. By default, all time steps
+            of the field.
+
+        stats : list
+            List of strings with the statistics to compute. Possible values
+            are 'mean', 'rms', 'std', 'var', 'min', 'max', 'abs_max' and
+            'sum'.
+
+        n_workers, max_in_flight : int
+            Number of worker threads and maximum number of time steps read
+            at the same time (see `iter_timesteps`).
+
+        **kwargs
+            Any other argument of `get_data` (units, slicing, etc.).
+
+        Returns
+        -------
+        A dictionary where each key is one of the requested statistics and
+        contains a tuple with the data array and its metadata dictionary.
+        The metadata has the same layout as that returned by `get_data` (so
+        that it can be used in the same way for plotting), with the axes of
+        the first time step and a 'time' entry containing the array of
+        aggregated times and time steps.
+        """
+        available_stats = ['mean', 'rms', 'std', 'var', 'min', 'max',
+                           'abs_max', 'sum']
+        if isinstance(stats, str):
+            stats = [stats]
+        for stat in stats:
+            if stat not in available_stats:
+                raise ValueError(
+                    "Unknown statistic '{}'. Possible values are {}.".format(
+                        stat, available_stats))
+        if timesteps is None:
+            timesteps = self.timesteps
+        timesteps = list(timesteps)
+        if len(timesteps) == 0:
+            raise ValueError('No time steps to aggregate.')
+        need_mean = any(s in stats for s in ['mean', 'rms', 'std', 'var'])
+        need_m2 = any(s in stats for s in ['rms', 'std', 'var'])
+        buffers = {}
+        times = []
+        md = None
+        for n, (time_step, fld, fld_md) in enumerate(
+                self.iter_timesteps(timesteps, n_workers=n_workers,
+                                    max_in_flight=max_in_flight, **kwargs),
+                start=1):
+            times.append(fld_md['time']['value'])
+            if md is None:
+                md = fld_md
+                shape = np.shape(fld)
+                if need_mean:
+                    buffers['mean'] = np.zeros(shape)
+                    delta = np.empty(shape)
+                # Reused for the temporary results of each update.
+                if need_m2 or 'abs_max' in stats:
+                    work = np.empty(shape)
+                if need_m2:
+                    buffers['m2'] = np.zeros(shape)
+                if 'sum' in stats:
+                    buffers['sum'] = np.zeros(shape)
+                for stat in ['min', 'max', 'abs_max']:
+                    if stat in stats:
+                        buffers[stat] = np.array(fld, dtype=np.float64)
+                if 'abs_max' in stats:
+                    np.abs(buffers['abs_max'], out=buffers['abs_max'])
+            elif np.shape(fld) != shape:
+                raise ValueError(
+                    'Data of time step {} has shape {}, but {} '.format(
+                        time_step, np.shape(fld), shape) +
+                    'was expected.')
+            else:
+                if 'min' in stats:
+                    np.minimum(buffers['min'], fld, out=buffers['min'])
+                if 'max' in stats:
+                    np.maximum(buffers['max'], fld, out=buffers['max'])
+                if 'abs_max' in stats:
+                    np.abs(fld, out=work)
+                    np.maximum(buffers['abs_max'], work,
+                               out=buffers['abs_max'])
+            if 'sum' in stats:
+                buffers['sum'] += fld
+            if need_mean:
+                # Welford's algorithm, without temporary arrays.
+                np.subtract(fld, buffers['mean'], out=delta)
+                if need_m2:
+                    np.divide(delta, n, out=work)
+                    buffers['mean'] += work
+                    np.subtract(fld, buffers['mean'], out=work)
+                    delta *= work
+                    buffers['m2'] += delta
+                else:
+                    np.divide(delta, n, out=delta)
+                    buffers['mean'] += delta
+        n_total = len(times)
+        md['time'] = {'array': np.array(times),
+                      'units': md['time']['units'],
+                      'timesteps': np.array(timesteps)}
+        units = md['field']['units']
+        results = {}
+        for stat in stats:
+            stat_md = copy.deepcopy(md)
+            if stat in ['min', 'max', 'abs_max', 'sum', 'mean']:
+                data = buffers[stat]
+            elif stat == 'var':
+                data = buffers['m2'] / n_total
+                stat_md['field']['units'] = '({})^2'.format(units)
+            elif stat == 'std':
+                data = np.sqrt(buffers['m2'] / n_total)
+            elif stat == 'rms':
+                data = np.sqrt(buffers['m2'] / n_total +
+                               np.square(buffers['mean']))
+            results[stat] = (data, stat_md)
+        return results
+
+    def get_lineout(self, axis, position=None, timesteps=None,
+                    field_units=None, axes_units=None, time_units=None,
+                    m='all', theta=0, n_workers=None, max_in_flight=4):
+        """
+        Get the evolution of a 1D lineout of the field along the given axis.
+
+        Only the data along the lineout is read from disk at each time step.
+        For thetaMode fields, the lineout is taken in the plane given by
+        `theta` and computed from the azimuthal modes at the corresponding
+        radius. The time steps are read in parallel.
+
+        Parameters
+        ----------
+
+        axis : str
+            Axis along which to take the lineout (e.g., 'z').
+
+        position : dict
+            (Optional) Position of the lineout along each of the other axes,
+            e.g., {'x': 0., 'y': 0.}, in the original units of the axes (as
+            in the metadata returned by `get_data` without axis
+            conversion). The closest grid point is used. By default, the
+            lineout is taken at the center of the other axes (i.e. on axis
+            for thetaMode fields).
+
+        timesteps : list
+            (Optional) Time steps to read. By default, all time steps.
+
+        field_units, axes_units, time_units : str
+            (Optional) Desired units of the field, axis and time data.
+
+        m, theta : optional
+            Azimuthal mode and angle of the lineout plane (only for
+            thetaMode fields).
+
+        n_workers : int
+            (Optional) Number of worker threads. If 0, the time steps are
+            read in the calling thread.
+
+        max_in_flight : int
+            Maximum number of time steps being read at the same time.
+
+        Returns
+        -------
+        A tuple with a 2D (t, s) array containing the lineout at each time
+        step and a metadata dictionary. The metadata contains the field
+        information in 'field', the (t, s) array of positions along the axis
+        of each lineout in 'axis', and the time of each lineout in 'time'.
+        """
+        return self._get_time_series(
+            [axis], position, timesteps, field_units, axes_units, time_units,
+            m, theta, n_workers, max_in_flight)
+
+    def get_probe(self, point=None, timesteps=None, field_units=None,
+                  time_units=None, m='all', theta=0, n_workers=None,
+                  max_in_flight=4):
+        """
+        Get the evolution of the field value at a given point.
+
+        Only the data at the given point is read from disk at each time step
+        (for thetaMode fields, only the azimuthal modes at that point). The
+        time steps are read in parallel.
+
+        Parameters
+        ----------
+
+        point : dict
+            (Optional) Position of the probe along each axis, e.g.,
+            {'x': 0., 'y': 0., 'z': 1e-5}, in the original units of the axes.
+            The closest grid point is used. The center of the axes not
+            specified is used by default.
+
+        timesteps : list
+            (Optional) Time steps to read. By default, all time steps.
+
+        field_units, time_units : str
+            (Optional) Desired units of the field and time data.
+
+        m, theta : optional
+            Azimuthal mode and angle of the probe (only for thetaMode
+            fields).
+
+        n_workers : int
+            (Optional) Number of worker threads. If 0, the time steps are
+            read in the calling thread.
+
+        max_in_flight : int
+            Maximum number of time steps being read at the same time.
+
+        Returns
+        -------
+        A tuple with a 1D array containing the field value at each time step
+        and a metadata dictionary. The metadata contains the field
+        information in 'field', the time of each value in 'time' and the
+        actual probe position at each time step in 'position'.
+        """
+        return self._get_time_series(
+            [], point, timesteps, field_units, None, time_units, m, theta,
+            n_workers, max_in_flight)
+
+    def _get_time_series(self, axes, position, timesteps, field_units,
+                         axes_units, time_units, m, theta, n_workers,
+                         max_in_flight):
+        """
+        Read, in parallel, the evolution of the field in a region containing
+        the full extent of the given axes and a single point along the
+        others.
+        """
+        if timesteps is None:
+            timesteps = self.timesteps
+        timesteps = list(timesteps)
+        if position is None:
+            position = {}
+        if self.get_geometry() == 'thetaMode' and theta is None:
+            raise ValueError('A value of theta must be given for thetaMode '
+                             'fields.')
+
+        def read_timestep(time_step):
+            fld_md = self.get_only_metadata(time_step, theta=theta)
+            axis_labels = sorted(fld_md['field']['axis_labels'])
+            for axis in list(axes) + list(position.keys()):
+                if axis not in axis_labels:
+                    raise ValueError(
+                        "Axis '{}' not found. ".format(axis) +
+                        "Available axes are {}.".format(axis_labels))
+            chunk = []
+            point = {}
+            for axis in axis_labels:
+                if axis in axes:
+                    chunk.append(slice(None))
+                    continue
+                axis_array = fld_md['axis'][axis]['array']
+                if axis in position:
+                    idx = np.argmin(np.abs(axis_array - position[axis]))
+                else:
+                    idx = len(axis_array) // 2
+                point[axis] = axis_array[idx]
+                chunk.append(slice(idx, idx + 1))
+            fld, fld_md = self.get_data_chunk(
+                time_step, tuple(chunk), field_units=field_units,
+                axes_units=axes_units, axes_to_convert=axes or None,
+                time_units=time_units, m=m, theta=theta)
+            return fld.reshape(-1), fld_md, point
+
+        results = list(read_ahead(read_timestep, timesteps, n_workers,
+                                  max_in_flight))
+        fld_list, md_list, point_list = zip(*results)
+        fld_md = md_list[0]
+        series_md = {}
+        series_md['field'] = fld_md['field']
+        series_md['field']['axis_labels'] = list(axes)
+        series_md['axis'] = {}
+        for axis in axes:
+            axis_md = fld_md['axis'][axis]
+            axis_md['array'] = stack_timestep_data(
+                [md['axis'][axis]['array'] for md in md_list])
+            series_md['axis'][axis] = axis_md
+        series_md['time'] = {
+            'array': np.array([md['time']['value'] for md in md_list]),
+            'units': fld_md['time']['units'],
+            'timesteps': np.array(timesteps)}
+        series_md['position'] = list(point_list)
+        fld = stack_timestep_data(fld_list)
+        if len(axes) == 0:
+            fld = fld[:, 0]
+        return fld, series_md
+
     def get_geometry(self):
         field_md = self.get_only_metadata(self.timesteps[0])
         return field_md['field']['geometry']
 
+    def get_data_chunk(self, time_step, chunk, field_units=None,
+                       axes_units=None, axes_to_convert=None,
+                       time_units=None, m='all', theta=0):
+        """
+        Get the data of a region of a cartesian field. Only the data in the
+        region is read from disk.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step of the data.
+
+        chunk : tuple of slices
+            The region to read, with one slice per field axis in
+            alphabetical order (i.e., ['x', 'y', 'z'] or, for thetaMode
+            fields, ['r', 'z']).
+
+        field_units, axes_units, axes_to_convert, time_units : optional
+            Desired units of the returned data, as in `get_data`.
+
+        m, theta : optional
+            Azimuthal mode and angle of the observation plane of thetaMode
+            fields, as in `get_data`. Only the modes within the region are
+            read and combined.
+
+        Returns
+        -------
+        A tuple with the data array of the region and its metadata
+        dictionary.
+        """
+        raise NotImplementedError
+
+    def _can_split_along_z(self):
+        """
+        Whether the field can be computed in chunks along z (i.e., whether
+        the value at each point does not depend on the data at other
+        longitudinal positions).
+        """
+        return True
+
+    def get_data_out_of_core(
+            self, time_step, output_path=None, field_units=None,
+            axes_units=None, axes_to_convert=None, time_units=None,
+            slab_size=None, max_slab_bytes=2**27):
+        """
+        Get the data of a cartesian field without loading it fully into
+        memory.
+
+        The field is read (and, for derived fields, calculated) slab by
+        slab along the z axis and stored in an array backed by a file.
+        Fields which are not pointwise along z (such as the laser envelope)
+        are split along the first transverse axis instead, or read at once
+        for 1D fields.
+        The returned array can then be sliced or downsampled (e.g.,
+        `data[::4, ::4, ::4]`) to load only the needed data.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step of the data.
+
+        output_path : str
+            (Optional) Path of the file in which to store the data. If it
+            ends with '.h5' or '.hdf5', the data is stored in an HDF5 dataset
+            named as the field and an h5py Dataset is returned, with the
+            file opened in read-only mode (it can be closed with
+            `data.file.close()`). Otherwise, a
+            memory-mapped '.npy' file is created. If not given, a temporary
+            memory-mapped file is used, which is deleted when the array is
+            no longer referenced.
+
+        field_units, axes_units, axes_to_convert, time_units : optional
+            Desired units of the returned data, as in `get_data`.
+
+        slab_size : int
+            (Optional) Number of cells along the split axis in each slab.
+
+        max_slab_bytes : int
+            Approximate maximum size in bytes of each slab of data. Only
+            used if `slab_size` is not given.
+
+        Returns
+        -------
+        A tuple with the file-backed data array (a numpy memmap or an
+        h5py Dataset) and its metadata dictionary.
+        """
+        fld_md = self.get_only_metadata(
+            time_step, field_units=field_units, axes_units=axes_units,
+            axes_to_convert=axes_to_convert, time_units=time_units)
+        geom = fld_md['field']['geometry']
+        if geom not in ['1d', '2dcartesian', '3dcartesian']:
+            raise NotImplementedError(
+                'Out-of-core evaluation not supported for '
+                '{} geometry.'.format(geom))
+        axis_labels = sorted(fld_md['field']['axis_labels'])
+        shape = tuple(len(fld_md['axis'][ax]['array']) for ax in axis_labels)
+        split_idx = axis_labels.index('z')
+        if not self._can_split_along_z():
+            # Each slab along z would need the whole field, so the field is
+            # split along the first transverse axis, if any.
+            split_idx = 0
+            if axis_labels == ['z']:
+                slab_size = shape[0]
+        n_split = shape[split_idx]
+        if slab_size is None:
+            # Assume 8 bytes per cell.
+            plane_bytes = 8 * np.prod(shape) // max(n_split, 1)
+            slab_size = int(max(1, max_slab_bytes // max(plane_bytes, 1)))
+        output = None
+        try:
+            for start in range(0, n_split, slab_size):
+                chunk = [slice(None)] * len(shape)
+                chunk[split_idx] = slice(start,
+                                         min(start + slab_size, n_split))
+                chunk = tuple(chunk)
+                fld, _ = self.get_data_chunk(
+                    time_step, chunk, field_units=field_units,
+                    axes_units=axes_units, axes_to_convert=axes_to_convert,
+                    time_units=time_units)
+                if output is None:
+                    output = _create_output_array(
+                        output_path, shape, fld.dtype, self.get_name())
+                output[chunk] = fld
+        finally:
+            # Close the HDF5 file opened for writing, also on errors.
+            if isinstance(output, H5Dataset):
+                output.file.close()
+        if isinstance(output, H5Dataset):
+            output = H5F(output_path, 'r')[self.get_name()]
+        return output, fld_md
+
+    def reduce(self, time_step, ops=['min', 'max'], region=None,
+               field_units=None, axes_units=None, m='all', theta=0,
+               relative_accuracy=0.01, max_chunk_bytes=2**26):
+        """
+        Compute scalar reductions of the field (e.g., its maximum, its
+        integral or a percentile) without loading the whole array.
+
+        The field is streamed in chunks along its first axis. The minimum,
+        maximum, sum, integral and moments are exact, while quantiles are
+        approximate (with a given relative accuracy) and computed with a
+        sketch of bounded memory.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step of the data.
+
+        ops : list
+            List of strings with the reductions to compute. Possible values
+            are 'min', 'max', 'abs_max', 'sum', 'count', 'mean', 'var',
+            'std', 'integral' (the sum multiplied by the cell volume, only
+            for cartesian fields), 'median' or any percentile given as 'p'
+            followed by a number (e.g., 'p99.9').
+
+        region : dict
+            (Optional) Region in which to compute the reductions. Each key is
+            an axis label and each value is a list with the minimum and
+            maximum position along this axis (in `axes_units`).
+
+        field_units, axes_units : str
+            (Optional) Units of the field data and of the axes.
+
+        m, theta : optional
+            Azimuthal mode and angle of the observation plane of thetaMode
+            fields, as in `get_data`.
+
+        relative_accuracy : float
+            Relative accuracy of the quantiles.
+
+        max_chunk_bytes : int
+            Approximate maximum size in bytes of each chunk of data.
+
+        Returns
+        -------
+        A dictionary with the value of each reduction.
+        """
+        if isinstance(ops, str):
+            ops = [ops]
+        reduction = StreamingReduction(ops, relative_accuracy)
+        fld_md = self.get_only_metadata(
+            time_step, field_units=field_units, axes_units=axes_units,
+            m=m, theta=theta)
+        axis_labels = sorted(fld_md['field']['axis_labels'])
+        region_chunk = _get_region_chunk(fld_md, axis_labels, region)
+        shape = tuple(len(fld_md['axis'][ax]['array'][s])
+                      for ax, s in zip(axis_labels, region_chunk))
+        # Assume 8 bytes per cell.
+        row_bytes = 8 * int(np.prod(shape[1:]))
+        n_rows = int(max(1, max_chunk_bytes // max(row_bytes, 1)))
+        if axis_labels[0] == 'z' and not self._can_split_along_z():
+            # Each chunk would need the whole field along z.
+            n_rows = shape[0]
+        start_0 = region_chunk[0].start
+        for i in range(0, shape[0], n_rows):
+            chunk = (slice(start_0 + i, start_0 + min(i + n_rows, shape[0])),)
+            chunk += region_chunk[1:]
+            fld, _ = self.get_data_chunk(
+                time_step, chunk, field_units=field_units, m=m, theta=theta)
+            reduction.update(fld)
+        cell_volume = None
+        if 'integral' in ops:
+            geom = fld_md['field']['geometry']
+            if geom not in ['1d', '2dcartesian', '3dcartesian']:
+                raise NotImplementedError(
+                    'Integral not supported for {} geometry.'.format(geom))
+            cell_volume = 1.
+            for axis in axis_labels:
+                axis_md = fld_md['axis'][axis]
+                if 'spacing' in axis_md:
+                    cell_volume *= axis_md['spacing']
+                else:
+                    cell_volume *= axis_md['array'][1] - axis_md['array'][0]
+        return reduction.get_results(cell_volume)
+
+    def get_data_at_points(self, time_step, points, order=1,
+                           field_units=None, m='all',
+                           max_chunk_bytes=2**26):
+        """
+        Interpolate the field at arbitrary points (e.g., at the position of
+        the particles of a species).
+
+        The points are processed in chunks of bounded memory. For thetaMode
+        fields, the azimuthal modes are interpolated in (r, z) and evaluated
+        at the angle of each point, without reconstructing the field in 3D.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step of the data.
+
+        points : dict
+            Dictionary with the coordinates of the points (in SI units)
+            along each axis of the field, e.g., {'x': x, 'z': z}. For
+            thetaMode and cylindrical fields, the 'x', 'y' and 'z'
+            coordinates are needed.
+
+        order : int
+            Interpolation order. Possible values are 0 (nearest grid point),
+            1 (linear) and 2 (quadratic spline, as the TSC shape of PIC
+            codes, which smooths the data).
+
+        field_units : str
+            (Optional) Units in which to return the field data.
+
+        m : int or str
+            Azimuthal mode (only for thetaMode fields).
+
+        max_chunk_bytes : int
+            Maximum size of the temporary arrays of each chunk of points.
+
+        Returns
+        -------
+        A tuple with an array containing the field value at each point (NaN
+        for points outside of the field grid) and the metadata dictionary of
+        the field.
+        """
+        if order not in [0, 1, 2]:
+            raise ValueError(
+                'Interpolation order {} not supported. '.format(order) +
+                'Possible values are 0, 1 and 2.')
+        if self.get_geometry() == 'thetaMode':
+            return self._get_theta_mode_data_at_points(
+                time_step, points, order, field_units, m, max_chunk_bytes)
+        fld, fld_md = self.get_data(time_step, field_units=field_units,
+                                    axes_units='SI', m=m)
+        fld = _interpolate_at_points(fld, fld_md, points, order,
+                                     max_chunk_bytes)
+        return fld, fld_md
+
+    def _get_lazy_data(self, time_step, field_units, axes_units,
+                       axes_to_convert, time_units, slice_dir_i, m, theta):
+        """
+        Get a LazyFieldArray of the field data (i.e., the result of
+        `get_data` with `lazy=True`) and its metadata. No field data is read
+        until the array is indexed.
+        """
+        if slice_dir_i is not None:
+            raise ValueError(
+                'Slicing arguments are not supported with lazy=True. Index '
+                'the returned array instead.')
+        fld_md = self.get_only_metadata(
+            time_step, field_units=field_units, axes_units=axes_units,
+            axes_to_convert=axes_to_convert, time_units=time_units, m=m,
+            theta=theta)
+        geom = fld_md['field']['geometry']
+        if geom in ['cylindrical', 'thetaMode'] and theta is None:
+            raise NotImplementedError(
+                'Lazy data not supported for 3D reconstructions of '
+                '{} fields.'.format(geom))
+        fld = LazyFieldArray(self, time_step, fld_md, field_units, m, theta)
+        return fld, fld_md
+
+    def _get_theta_mode_data_at_points(self, time_step, points, order,
+                                       field_units, m, max_chunk_bytes):
+        """
+        Interpolate a thetaMode field at arbitrary points from its azimuthal
+        modes or, if these are not available, from its 3D reconstruction.
+        """
+        try:
+            modes = self._get_modes(time_step, field_units, m)
+        except NotImplementedError:
+            fld, fld_md = self.get_data(time_step, field_units=field_units,
+                                        axes_units='SI', m=m, theta=None)
+            fld = _interpolate_at_points(fld, fld_md, points, order,
+                                         max_chunk_bytes)
+            return fld, fld_md
+        fld_md = self.get_only_metadata(time_step, field_units=field_units,
+                                        axes_units='SI', m=m)
+        x, y, z = _get_point_coordinates(points, ['x', 'y', 'z'])
+        r_array = fld_md['axis']['r']['array']
+        r_array = r_array[len(r_array) // 2:]
+        z_array = fld_md['axis']['z']['array']
+        modes = gather_field(
+            modes, [np.hypot(x, y), z], [r_array[0], z_array[0]],
+            [r_array[-1], z_array[-1]], _INTERPOLATION_SHAPES[order],
+            max_chunk_bytes)
+        theta = np.arctan2(y, x)
+        fld = modes[0]
+        for mode in range(1, int(modes.shape[0] / 2) + 1):
+            fld += modes[2*mode-1] * np.cos(mode * theta)
+            fld += modes[2*mode] * np.sin(mode * theta)
+        return fld, fld_md
+
+    def _get_modes(self, time_step, field_units=None, m='all'):
+        """
+        Get the azimuthal modes (modes, r, z) of a thetaMode field, with
+        r >= 0.
+        """
+        raise NotImplementedError
+
+    def _get_source_signature(self, time_step):
+        """
+        Get the signature (path, modification time and size) of the files
+        from which the field data is obtained at a given time step.
+        """
+        raise NotImplementedError
+
+    def _get_cache_key(self, time_step, field_units=None, axes_units=None,
+                       axes_to_convert=None, time_units=None, slice_i=0.5,
+                       slice_j=0.5, slice_dir_i=None, slice_dir_j=None,
+                       m='all', theta=0, max_resolution_3d=None,
+                       only_metadata=False):
+        """Get the key identifying the requested data in the data cache."""
+        return data_cache.make_key(
+            self, time_step, field_units=field_units, axes_units=axes_units,
+            axes_to_convert=axes_to_convert, time_units=time_units,
+            slice_i=slice_i, slice_j=slice_j, slice_dir_i=slice_dir_i,
+            slice_dir_j=slice_dir_j, m=m, theta=theta,
+            max_resolution_3d=max_resolution_3d, only_metadata=only_metadata)
+
 
 class FolderField(Field):
     def __init__(
@@ -65,7 +826,19 @@ class FolderField(Field):
     def get_data(self, time_step, field_units=None, axes_units=None,
                  axes_to_convert=None, time_units=None, slice_i=0.5,
                  slice_j=0.5, slice_dir_i=None, slice_dir_j=None, m='all',
-                 theta=0, max_resolution_3d=None, only_metadata=False):
+                 theta=0, max_resolution_3d=None, only_metadata=False,
+                 lazy=False):
+        if lazy:
+            return self._get_lazy_data(
+                time_step, field_units, axes_units, axes_to_convert,
+                time_units, slice_dir_i, m, theta)
+        cache_key = self._get_cache_key(
+            time_step, field_units, axes_units, axes_to_convert, time_units,
+            slice_i, slice_j, slice_dir_i, slice_dir_j, m, theta,
+            max_resolution_3d, only_metadata)
+        cached_data = data_cache.get(cache_key)
+        if cached_data is not None:
+            return cached_data
         file_path = self._get_file_path(time_step)
         fld, fld_md = self.field_reader.read_field(
             file_path, time_step, self.field_path, slice_i, slice_j,
@@ -77,19 +850,95 @@ class FolderField(Field):
             fld, fld_md = self.unit_converter.convert_field_units(
                 fld, fld_md, target_field_units=field_units,
                 target_axes_units=axes_units, axes_to_convert=axes_to_convert,
-                target_time_units=time_units)
+                target_time_units=time_units, in_place=True)
+        return data_cache.put(cache_key, fld, fld_md)
+
+    def get_data_chunk(self, time_step, chunk, field_units=None,
+                       axes_units=None, axes_to_convert=None,
+                       time_units=None, m='all', theta=0):
+        fld_md = _slice_metadata(
+            self.get_only_metadata(time_step, theta=theta), chunk)
+        file_path = self._get_file_path(time_step)
+        fld = self.field_reader.read_field_chunk(
+            file_path, time_step, self.field_path, chunk, m, theta)
+        # perform unit conversion
+        unit_list = [field_units, axes_units, time_units]
+        if any(unit is not None for unit in unit_list):
+            fld, fld_md = self.unit_converter.convert_field_units(
+                fld, fld_md, target_field_units=field_units,
+                target_axes_units=axes_units, axes_to_convert=axes_to_convert,
+                target_time_units=time_units, in_place=True)
         return fld, fld_md
 
+    def get_data_polar(self, time_step, field_units=None, n_theta=None,
+                       m='all', max_resolution_3d=None):
+        """
+        Get the data of a thetaMode field sampled on its native polar grid
+        (theta, r, z), without reconstructing it in 3D.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step at which to read the data.
+
+        field_units : str
+            (Optional) Units in which to return the field data.
+
+        n_theta : int
+            (Optional) Number of equally-spaced angles.
+
+        m : int or str
+            Azimuthal mode.
+
+        max_resolution_3d : list
+            Maximum longitudinal and transverse resolution of the 3D
+            reconstruction, as in `get_data`.
+
+        Returns
+        -------
+        An array (theta, r, z) with the field data.
+        """
+        file_path = self._get_file_path(time_step)
+        fld = self.field_reader.read_field_polar(
+            file_path, time_step, self.field_path, n_theta, m,
+            max_resolution_3d)
+        if field_units is not None:
+            fld_md = self.get_only_metadata(time_step)
+            fld, _ = self.unit_converter.convert_field_units(
+                fld, fld_md, target_field_units=field_units, in_place=True)
+        return fld
+
+    def _get_modes(self, time_step, field_units=None, m='all'):
+        fld_polar = self.get_data_polar(time_step, field_units, m=m)
+        if fld_polar.shape[0] < 3:
+            # With a single mode, the x and y components still need the
+            # first azimuthal harmonic.
+            fld_polar = self.get_data_polar(time_step, field_units,
+                                            n_theta=3, m=m)
+        return get_modes_from_polar_grid(fld_polar)
+
     def _get_file_path(self, time_step):
         return self.timestep_to_files[time_step]
 
+    def _get_source_signature(self, time_step):
+        """
+        Get the signature (path, modification time and size) of the files
+        from which the field is read at a given time step.
+        """
+        file_paths = self.field_reader.get_source_files(
+            self._get_file_path(time_step), time_step)
+        return self.field_path, get_source_signature(file_paths)
+
 
 class DerivedField(Field):
-    def __init__(self, field_dict, sim_geometry, sim_params, base_fields):
+    def __init__(self, field_dict, sim_geometry, sim_params, base_fields,
+                 disk_cache=None):
         self.field_dict = field_dict
         self.sim_geometry = sim_geometry
         self.sim_params = sim_params
         self.base_fields = base_fields
+        self.disk_cache = disk_cache
         field_timesteps = get_common_timesteps(base_fields)
         field_name = field_dict['name']
         unit_converter = base_fields[0].unit_converter
@@ -98,20 +947,249 @@ class DerivedField(Field):
     def get_data(self, time_step, field_units=None, axes_units=None,
                  axes_to_convert=None, time_units=None, slice_i=0.5,
                  slice_j=0.5, slice_dir_i=None, slice_dir_j=None, m='all',
-                 theta=0, max_resolution_3d=None, only_metadata=False):
+                 theta=0, max_resolution_3d=None, only_metadata=False,
+                 lazy=False):
+        if lazy:
+            return self._get_lazy_data(
+                time_step, field_units, axes_units, axes_to_convert,
+                time_units, slice_dir_i, m, theta)
+        options = {
+            'field_units': field_units, 'axes_units': axes_units,
+            'axes_to_convert': axes_to_convert, 'time_units': time_units,
+            'slice_i': slice_i, 'slice_j': slice_j,
+            'slice_dir_i': slice_dir_i, 'slice_dir_j': slice_dir_j, 'm': m,
+            'theta': theta, 'max_resolution_3d': max_resolution_3d,
+            'only_metadata': only_metadata}
+        cached_data = self.get_cached_data(time_step, **options)
+        if cached_data is not None:
+            return cached_data
+        # Recipes which are not pointwise along z (such as the laser
+        # envelope) need the base fields along the whole z axis, so that
+        # slices along z are taken after evaluating the recipe.
+        slicing = {'slice_i': slice_i, 'slice_j': slice_j,
+                   'slice_dir_i': slice_dir_i, 'slice_dir_j': slice_dir_j}
+        z_slice = None
+        if not self._can_split_along_z() and not only_metadata:
+            slicing, z_slice = _split_z_slicing(**slicing)
         field_data = []
         for field in self.base_fields:
             fld, fld_md = field.get_data(
-                time_step, field_units='SI',
-                slice_i=slice_i, slice_j=slice_j, slice_dir_i=slice_dir_i,
-                slice_dir_j=slice_dir_j, m=m, theta=theta,
+                time_step, field_units='SI', m=m, theta=theta,
                 max_resolution_3d=max_resolution_3d,
-                only_metadata=only_metadata)
+                only_metadata=only_metadata, **slicing)
             field_data.append(fld)
-        if not only_metadata:
-            fld = self.field_dict['recipe'](field_data, self.sim_geometry,
-                                            self.sim_params)
-        fld_md['field']['units'] = self.field_dict['units']
+        fld, fld_md = self.calculate_from_base_data(
+            field_data, fld_md, field_units=field_units,
+            axes_units=axes_units, axes_to_convert=axes_to_convert,
+            time_units=time_units, only_metadata=only_metadata)
+        if z_slice is not None:
+            fld, fld_md = _slice_along_axis(fld, fld_md, 'z', z_slice)
+        return self.cache_data(time_step, fld, fld_md, **options)
+
+    def get_cached_data(self, time_step, **kwargs):
+        """
+        Get the data of the field from the memory cache or, if enabled, from
+        the disk cache.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step of the data.
+
+        **kwargs
+            The rest of arguments of `get_data`.
+
+        Returns
+        -------
+        A tuple with the field data array and its metadata dictionary, or
+        None if the data is not cached.
+        """
+        cache_key = self._get_cache_key(time_step, **kwargs)
+        cached_data = data_cache.get(cache_key)
+        if cached_data is None and self._use_disk_cache(**kwargs):
+            cached_data = self.disk_cache.get(
+                self._get_disk_cache_key(time_step, **kwargs))
+            if cached_data is not None:
+                cached_data = data_cache.put(cache_key, *cached_data)
+        return cached_data
+
+    def cache_data(self, time_step, fld, fld_md, **kwargs):
+        """
+        Store the data of the field in the memory cache and, if enabled, in
+        the disk cache. Takes the same arguments as `get_cached_data`, and
+        returns the cached data.
+        """
+        if self._use_disk_cache(**kwargs):
+            self.disk_cache.put(
+                self._get_disk_cache_key(time_step, **kwargs), fld, fld_md)
+        return data_cache.put(
+            self._get_cache_key(time_step, **kwargs), fld, fld_md)
+
+    def _can_split_along_z(self):
+        return self.field_dict.get('pointwise', True)
+
+    def _get_theta_mode_data_at_points(self, time_step, points, order,
+                                       field_units, m, max_chunk_bytes):
+        """
+        For pointwise recipes, interpolate the base fields at the points and
+        evaluate the recipe on the interpolated values.
+        """
+        if not self._can_split_along_z():
+            return super()._get_theta_mode_data_at_points(
+                time_step, points, order, field_units, m, max_chunk_bytes)
+        field_data = []
+        for field in self.base_fields:
+            fld, fld_md = field.get_data_at_points(
+                time_step, points, order, field_units='SI', m=m,
+                max_chunk_bytes=max_chunk_bytes)
+            field_data.append(fld)
+        return self.calculate_from_base_data(field_data, fld_md,
+                                             field_units=field_units)
+
+    def _use_disk_cache(self, only_metadata=False, **kwargs):
+        """Whether the disk cache should be used for the requested data."""
+        return self.disk_cache is not None and not only_metadata
+
+    def _get_disk_cache_key(self, time_step, **kwargs):
+        """
+        Get the key identifying the requested data in the disk cache. It
+        includes the recipe (name, units and source), the geometry and
+        simulation parameters, the signature of the files of the base fields
+        and all arguments of `get_data`.
+        """
+        recipe = (self.field_dict['name'], self.field_dict['units'],
+                  get_recipe_signature(self.field_dict['recipe']),
+                  self.field_dict['requirements'][self.sim_geometry])
+        return self.disk_cache.make_key(
+            recipe, self.sim_geometry, self.sim_params,
+            self._get_source_signature(time_step), time_step, kwargs)
+
+    def _get_source_signature(self, time_step):
+        return [field._get_source_signature(time_step)
+                for field in self.base_fields]
+
+    def get_data_chunk(self, time_step, chunk, field_units=None,
+                       axes_units=None, axes_to_convert=None,
+                       time_units=None, m='all', theta=0):
+        chunk = tuple(chunk)
+        z_slice = None
+        if not self._can_split_along_z():
+            # The longitudinal axis (always the last one) cannot be split.
+            z_slice = chunk[-1]
+            chunk = chunk[:-1] + (slice(None),)
+        field_data = []
+        for field in self.base_fields:
+            fld, fld_md = field.get_data_chunk(
+                time_step, chunk, field_units='SI', m=m, theta=theta)
+            field_data.append(fld)
+        fld, fld_md = self.calculate_from_base_data(
+            field_data, fld_md, field_units=field_units,
+            axes_units=axes_units, axes_to_convert=axes_to_convert,
+            time_units=time_units)
+        if z_slice is not None:
+            fld = fld[..., z_slice]
+            fld_md = _slice_metadata(
+                fld_md, (slice(None),) * (len(chunk) - 1) + (z_slice,))
+        return fld, fld_md
+
+    def calculate_from_base_data(
+            self, field_data, field_md, field_units=None, axes_units=None,
+            axes_to_convert=None, time_units=None, only_metadata=False):
+        """
+        Calculate the derived field from already loaded data of the base
+        fields.
+
+        Parameters
+        ----------
+
+        field_data : list
+            List of arrays with the data of each base field (in SI units),
+            in the same order as `base_fields`.
+
+        field_md : dict
+            Metadata dictionary of any of the base fields. It is modified in
+            place and returned as the metadata of the derived field.
+
+        field_units, axes_units, axes_to_convert, time_units : optional
+            Desired units of the returned data, as in `get_data`.
+
+        only_metadata : bool
+            Whether only the metadata should be returned.
+
+        Returns
+        -------
+        A tuple with the field data array and its metadata dictionary.
+        """
+        if only_metadata:
+            fld = field_data[0]
+        else:
+            fld = evaluate_recipe(
+                self.field_dict['recipe'],
+                self.field_dict['requirements'][self.sim_geometry],
+                field_data, self.sim_geometry, self.sim_params)
+        field_md['field']['units'] = self.field_dict['units']
+        # perform unit conversion
+        unit_list = [field_units, axes_units, time_units]
+        if any(unit is not None for unit in unit_list):
+            # The result of the recipe can be converted in place, as long
+            # as it is not one of the base fields.
+            in_place = all(fld is not data for data in field_data)
+            fld, field_md = self.unit_converter.convert_field_units(
+                fld, field_md, target_field_units=field_units,
+                target_axes_units=axes_units, axes_to_convert=axes_to_convert,
+                target_time_units=time_units, in_place=in_place)
+        return fld, field_md
+
+
+class DepositedField(Field):
+    def __init__(self, species, field_name, grid, shape='cic', weight='q',
+                 density=True, max_chunk_bytes=2**26):
+        """
+        Initialize the field. See `ParticleSpecies.get_deposited_field`
+        for a description of the parameters.
+        """
+        self.species = species
+        self.grid = grid
+        self.shape = shape
+        self.weight = weight
+        self.density = density
+        self.max_chunk_bytes = max_chunk_bytes
+        super().__init__(field_name, species.timesteps,
+                         species.unit_converter, species.species_name)
+
+    def get_data(self, time_step, field_units=None, axes_units=None,
+                 axes_to_convert=None, time_units=None, slice_i=0.5,
+                 slice_j=0.5, slice_dir_i=None, slice_dir_j=None, m='all',
+                 theta=0, max_resolution_3d=None, only_metadata=False,
+                 lazy=False):
+        # The deposited data is cartesian. The arguments of thetaMode
+        # fields (m, theta and max_resolution_3d) are ignored.
+        if lazy:
+            return self._get_lazy_data(
+                time_step, field_units, axes_units, axes_to_convert,
+                time_units, slice_dir_i, m, theta)
+        # Only the full deposited data is cached. Slicing and unit
+        # conversion are cheap compared to the deposition.
+        if only_metadata:
+            fld = np.array([])
+            fld_md = self._get_deposited_metadata(time_step)
+        else:
+            fld, fld_md = self._get_deposited_data(time_step)
+            slice_list = [slice(None)] * fld.ndim
+            for slice_dir, slice_pos in [(slice_dir_i, slice_i),
+                                         (slice_dir_j, slice_j)]:
+                if slice_dir is not None:
+                    axis_idx = fld_md['field']['axis_labels'].index(
+                        slice_dir)
+                    n_elements = fld.shape[axis_idx]
+                    slice_list[axis_idx] = min(
+                        int(round(n_elements * slice_pos)), n_elements - 1)
+            fld = fld[tuple(slice_list)]
+        for slice_dir in [slice_dir_i, slice_dir_j]:
+            if slice_dir is not None:
+                del fld_md['axis'][slice_dir]
+                fld_md['field']['axis_labels'].remove(slice_dir)
         # perform unit conversion
         unit_list = [field_units, axes_units, time_units]
         if any(unit is not None for unit in unit_list):
@@ -120,3 +1198,218 @@ class DerivedField(Field):
                 target_axes_units=axes_units, axes_to_convert=axes_to_convert,
                 target_time_units=time_units)
         return fld, fld_md
+
+    def get_data_chunk(self, time_step, chunk, field_units=None,
+                       axes_units=None, axes_to_convert=None,
+                       time_units=None, m='all', theta=0):
+        # The particles are always deposited onto the full grid.
+        fld, fld_md = self._get_deposited_data(time_step)
+        fld = fld[tuple(chunk)]
+        fld_md = _slice_metadata(fld_md, chunk)
+        unit_list = [field_units, axes_units, time_units]
+        if any(unit is not None for unit in unit_list):
+            fld, fld_md = self.unit_converter.convert_field_units(
+                fld, fld_md, target_field_units=field_units,
+                target_axes_units=axes_units, axes_to_convert=axes_to_convert,
+                target_time_units=time_units)
+        return fld, fld_md
+
+    def get_geometry(self):
+        return {1: '1d', 2: '2dcartesian', 3: '3dcartesian'}[len(self.grid)]
+
+    def _get_source_signature(self, time_step):
+        return self.species._get_source_signature(time_step)
+
+    def _get_deposited_metadata(self, time_step):
+        """
+        Get the metadata of the deposited data (in SI units) without
+        depositing the particles, unless the data is already cached.
+        """
+        cache_key = data_cache.make_key(self, time_step, deposited=True)
+        cached_data = data_cache.get(cache_key)
+        if cached_data is not None:
+            return cached_data[1]
+        return self.species._read_deposition_metadata(
+            time_step, self.grid, self.weight, self.density)
+
+    def _get_deposited_data(self, time_step):
+        """Get the deposited data in SI units from the data cache."""
+        cache_key = data_cache.make_key(self, time_step, deposited=True)
+        cached_data = data_cache.get(cache_key)
+        if cached_data is None:
+            cached_data = data_cache.put(cache_key, *self.species.deposit(
+                time_step, self.grid, self.shape, self.weight, self.density,
+                self.max_chunk_bytes))
+        return cached_data
+
+
+def get_folder_fields_data(fields, time_step, slice_i=0.5, slice_j=0.5,
+                           slice_dir_i=None, slice_dir_j=None, m='all',
+                           theta=0, max_resolution_3d=None):
+    """
+    Get the data of several folder fields at a given time step, in their
+    original units.
+
+    The fields which are not cached are grouped by data file, and the fields
+    of each file are read with a single call to their field reader, so that
+    the file is opened only once.
+
+    Parameters
+    ----------
+
+    fields : list
+        List of FolderField objects.
+
+    time_step : int
+        Time step at which to read the data.
+
+    slice_i, slice_j, slice_dir_i, slice_dir_j, m, theta, max_resolution_3d
+    : optional
+        Same as in `Field.get_data`. They are applied to all fields.
+
+    Returns
+    -------
+    A list with a tuple (data, metadata) for each field.
+    """
+    slicing = {'slice_i': slice_i, 'slice_j': slice_j,
+               'slice_dir_i': slice_dir_i, 'slice_dir_j': slice_dir_j,
+               'm': m, 'theta': theta, 'max_resolution_3d': max_resolution_3d}
+    fields_data = [None] * len(fields)
+    file_groups = {}
+    for i, field in enumerate(fields):
+        cache_key = field._get_cache_key(time_step, **slicing)
+        fields_data[i] = data_cache.get(cache_key)
+        if fields_data[i] is None:
+            group = (field.field_reader, field._get_file_path(time_step))
+            file_groups.setdefault(group, []).append((i, field, cache_key))
+    for (field_reader, file_path), group in file_groups.items():
+        group_data = field_reader.read_fields(
+            file_path, time_step, [field.field_path for _, field, _ in group],
+            **slicing)
+        for (i, field, cache_key), (fld, fld_md) in zip(group, group_data):
+            fields_data[i] = data_cache.put(cache_key, fld, fld_md)
+    return fields_data
+
+
+def _split_z_slicing(slice_i, slice_j, slice_dir_i, slice_dir_j):
+    """
+    Separate the slice along z (if any) from the slicing arguments of
+    `get_data`. Returns the slicing arguments without the slice along z and
+    the relative position of the latter (or None).
+    """
+    z_slice = None
+    if slice_dir_i == 'z':
+        z_slice = slice_i
+        slice_i, slice_dir_i = slice_j, slice_dir_j
+        slice_j, slice_dir_j = 0.5, None
+    elif slice_dir_j == 'z':
+        z_slice = slice_j
+        slice_j, slice_dir_j = 0.5, None
+    slicing = {'slice_i': slice_i, 'slice_j': slice_j,
+               'slice_dir_i': slice_dir_i, 'slice_dir_j': slice_dir_j}
+    return slicing, z_slice
+
+
+def _slice_along_axis(fld, fld_md, axis, slice_pos):
+    """
+    Take a slice of a field at the relative position `slice_pos` along an
+    axis, as done by the field readers, and remove the axis from the
+    metadata.
+    """
+    axis_idx = fld_md['field']['axis_labels'].index(axis)
+    n_elements = fld.shape[axis_idx]
+    slice_list = [slice(None)] * fld.ndim
+    slice_list[axis_idx] = min(int(round(n_elements * slice_pos)),
+                               n_elements - 1)
+    fld = fld[tuple(slice_list)].copy()
+    del fld_md['axis'][axis]
+    fld_md['field']['axis_labels'].remove(axis)
+    return fld, fld_md
+
+
+# Particle shape used for each interpolation order.
+_INTERPOLATION_SHAPES = {0: 'ngp', 1: 'cic', 2: 'tsc'}
+
+
+def _get_point_coordinates(points, axes):
+    """Get the coordinates of the points along the given axes."""
+    for axis in axes:
+        if axis not in points:
+            raise ValueError(
+                "Coordinates along '{}' are needed. ".format(axis) +
+                "Given coordinates are {}.".format(list(points)))
+    return [np.asarray(points[axis]) for axis in axes]
+
+
+def _interpolate_at_points(fld, field_md, points, order, max_chunk_bytes):
+    """
+    Interpolate a field (whose axes are in SI units) at arbitrary points.
+    The radial coordinate of cylindrical fields is obtained from 'x' and
+    'y'.
+    """
+    axis_labels = sorted(field_md['field']['axis_labels'])
+    points = dict(points)
+    if 'r' in axis_labels and 'r' not in points:
+        x, y = _get_point_coordinates(points, ['x', 'y'])
+        points['r'] = np.hypot(x, y)
+    positions = _get_point_coordinates(points, axis_labels)
+    grid_min = [field_md['axis'][axis]['array'][0] for axis in axis_labels]
+    grid_max = [field_md['axis'][axis]['array'][-1] for axis in axis_labels]
+    return gather_field(fld, positions, grid_min, grid_max,
+                        _INTERPOLATION_SHAPES[order], max_chunk_bytes)
+
+
+def _slice_metadata(field_md, chunk):
+    """Restrict the axis metadata to a chunk of the field."""
+    axis_labels = sorted(field_md['field']['axis_labels'])
+    for axis, axis_slice in zip(axis_labels, chunk):
+        axis_md = field_md['axis'][axis]
+        axis_md['array'] = axis_md['array'][axis_slice]
+        if len(axis_md['array']) > 0:
+            if 'min' in axis_md:
+                axis_md['min'] = axis_md['array'][0]
+            if 'max' in axis_md:
+                axis_md['max'] = axis_md['array'][-1]
+    return field_md
+
+
+def _get_region_chunk(field_md, axis_labels, region):
+    """
+    Get the slices (one per axis in `axis_labels`) of the cells within a
+    region given as a dictionary of [min, max] positions along each axis.
+    """
+    if region is None:
+        region = {}
+    for axis in region:
+        if axis not in axis_labels:
+            raise ValueError(
+                "Axis '{}' not found. Available axes are {}.".format(
+                    axis, axis_labels))
+    chunk = []
+    for axis in axis_labels:
+        n_cells = len(field_md['axis'][axis]['array'])
+        axis_slice = slice(0, n_cells)
+        if axis in region:
+            ax_min, ax_max = region[axis]
+            axis_array = field_md['axis'][axis]['array']
+            idx = np.where((axis_array >= ax_min) & (axis_array <= ax_max))[0]
+            if len(idx) == 0:
+                axis_slice = slice(0, 0)
+            else:
+                axis_slice = slice(idx[0], idx[-1] + 1)
+        chunk.append(axis_slice)
+    return tuple(chunk)
+
+
+def _create_output_array(output_path, shape, dtype, name):
+    """Create a file-backed array for storing out-of-core data."""
+    if output_path is None:
+        return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+',
+                         shape=shape)
+    if output_path.endswith(('.h5', '.hdf5')):
+        file = H5F(output_path, 'a')
+        if name in file:
+            del file[name]
+        return file.create_dataset(name, shape=shape, dtype=dtype)
+    return np.lib.format.open_memmap(output_path, mode='w+', dtype=dtype,
+                                     shape=shape)
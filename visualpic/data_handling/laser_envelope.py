@@ -0,0 +1,102 @@
+"""
+This file is part of VisualPIC.
+
+The module contains methods for calculating the envelope of a laser field
+from its analytic signal along the longitudinal axis.
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+
+import numpy as np
+import scipy.fft as sp_fft
+
+
+# Number of threads used by the FFTs (-1 uses all available cores).
+DEFAULT_FFT_WORKERS = -1
+
+# Maximum size (in bytes) of the complex arrays of each slab. Together with
+# the output, this bounds the memory needed for computing the envelope.
+DEFAULT_SLAB_BYTES = 2**26
+
+
+def calculate_envelope(data_list, workers=DEFAULT_FFT_WORKERS,
+                       max_slab_bytes=DEFAULT_SLAB_BYTES):
+    """
+    Calculate the envelope of a (possibly multi-component) laser field.
+
+    The envelope is the modulus of the analytic signal of the field, which
+    is obtained from a Hilbert transform along the longitudinal axis (the
+    last array axis). For several components, the envelopes are added in
+    quadrature.
+
+    Parameters
+    ----------
+
+    data_list : list
+        List of arrays (with the same shape) with the field components.
+
+    workers : int
+        Number of threads used by the FFTs.
+
+    max_slab_bytes : int
+        Maximum size of the temporary complex arrays. The data is processed
+        in slabs along the first (transverse) axis to satisfy this limit.
+
+    Returns
+    -------
+    An array with the envelope.
+    """
+    envelope = np.zeros(np.shape(data_list[0]), dtype=np.float64)
+    for slab in _get_slabs(envelope, max_slab_bytes):
+        for data in data_list:
+            signal = get_analytic_signal(data[slab], workers)
+            envelope[slab] += signal.real**2 + signal.imag**2
+    return np.sqrt(envelope, out=envelope)
+
+
+def calculate_envelope_phase(data, workers=DEFAULT_FFT_WORKERS,
+                             max_slab_bytes=DEFAULT_SLAB_BYTES):
+    """
+    Calculate the phase of the analytic signal of a laser field component.
+    See `calculate_envelope` for a description of the parameters.
+
+    Returns
+    -------
+    An array with the phase (in radians, between -pi and pi).
+    """
+    phase = np.empty(np.shape(data), dtype=np.float64)
+    for slab in _get_slabs(phase, max_slab_bytes):
+        phase[slab] = np.angle(get_analytic_signal(data[slab], workers))
+    return phase
+
+
+def get_analytic_signal(data, workers=DEFAULT_FFT_WORKERS):
+    """
+    Get the analytic signal of real data along its last axis, as in
+    `scipy.signal.hilbert`, but using multithreaded FFTs.
+    """
+    n = np.shape(data)[-1]
+    h = np.zeros(n)
+    h[0] = 1
+    if n % 2 == 0:
+        h[n // 2] = 1
+        h[1:n // 2] = 2
+    else:
+        h[1:(n + 1) // 2] = 2
+    spectrum = sp_fft.fft(data, axis=-1, workers=workers)
+    spectrum *= h
+    return sp_fft.ifft(spectrum, axis=-1, overwrite_x=True, workers=workers)
+
+
+def _get_slabs(array, max_slab_bytes):
+    """
+    Get the slices along the first axis of the slabs in which an array is
+    processed. Arrays with a single (longitudinal) axis are not split.
+    """
+    if array.ndim < 2:
+        return [Ellipsis]
+    row_bytes = 16 * int(np.prod(array.shape[1:]))
+    n_rows = max(1, max_slab_bytes // row_bytes)
+    return [slice(i, i + n_rows) for i in range(0, array.shape[0], n_rows)]
@@ -0,0 +1,209 @@
+"""
+This file is part of VisualPIC.
+
+The module contains the LazyFieldArray class, an array-like proxy of the
+field data which only reads the data when indexed.
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+
+import numbers
+
+import numpy as np
+
+
+class LazyFieldArray():
+
+    """
+    Array-like proxy of the data of a field at a given time step.
+
+    No data is read when the proxy is created. When indexed with NumPy-style
+    keys (integers, slices, Ellipsis, None or integer arrays), the key is
+    translated into a hyperslab request to the field reader (see
+    `Field.get_data_chunk`), so that only the bounding region of the
+    requested data is read. Steps and integer arrays are applied to this
+    region in memory if not supported by the reader.
+
+    The proxy can also be converted into a NumPy array (`np.asarray`) or
+    into a dask array (`to_dask`) for chunked parallel computations.
+    """
+
+    def __init__(self, field, time_step, metadata, field_units=None, m='all',
+                 theta=0):
+        """
+        Initialize the proxy.
+
+        Parameters
+        ----------
+
+        field : Field
+            The field to which the data belongs.
+
+        time_step : int
+            Time step of the data.
+
+        metadata : dict
+            Metadata dictionary of the field data.
+
+        field_units : str
+            (Optional) Units in which the data is returned.
+
+        m, theta : optional
+            Azimuthal mode and angle of the observation plane of thetaMode
+            fields, as in `Field.get_data`.
+        """
+        self.field = field
+        self.time_step = time_step
+        self.metadata = metadata
+        self.field_units = field_units
+        self.m = m
+        self.theta = theta
+        self.axis_labels = sorted(metadata['field']['axis_labels'])
+        self.shape = tuple(
+            len(metadata['axis'][axis]['array']) for axis in self.axis_labels)
+        self._dtype = None
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def dtype(self):
+        """Type of the data. Determined by reading a single element."""
+        if self._dtype is None:
+            if self.size > 0:
+                sample = self._read_chunk(
+                    tuple(slice(0, 1) for _ in self.shape))
+                self._dtype = np.asarray(sample).dtype
+            else:
+                self._dtype = np.dtype(np.float64)
+        return self._dtype
+
+    def __len__(self):
+        if self.ndim == 0:
+            raise TypeError('len() of unsized object')
+        return self.shape[0]
+
+    def __repr__(self):
+        return 'LazyFieldArray(field={}, time_step={}, shape={})'.format(
+            self.field.get_name(), self.time_step, self.shape)
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = self._expand_key(key)
+        chunk = []
+        local_key = []
+        for axis_key in key:
+            if axis_key is None:
+                local_key.append(None)
+                continue
+            n = self.shape[len(chunk)]
+            axis_slice, axis_local_key = _get_axis_request(axis_key, n)
+            chunk.append(axis_slice)
+            local_key.append(axis_local_key)
+        data = np.asarray(self._read_chunk(tuple(chunk)))
+        return data[tuple(local_key)]
+
+    def to_dask(self, chunks='auto'):
+        """
+        Convert the proxy into a dask array. Each dask chunk is read from
+        the field reader when computed.
+
+        Parameters
+        ----------
+
+        chunks : optional
+            Chunk shape of the dask array (see `dask.array.from_array`).
+
+        Returns
+        -------
+        A dask array.
+        """
+        try:
+            import dask.array as da
+        except ImportError:
+            raise ImportError(
+                'dask is needed for converting the data into a dask array. '
+                "Install it by running 'python -m pip install dask'.")
+        return da.from_array(self, chunks=chunks, asarray=True,
+                             meta=np.empty((0,) * self.ndim,
+                                           dtype=self.dtype))
+
+    def _expand_key(self, key):
+        """Replace the Ellipsis and add the missing trailing slices."""
+        n_ellipsis = sum(k is Ellipsis for k in key)
+        if n_ellipsis > 1:
+            raise IndexError("An index can only have a single ellipsis.")
+        n_indexed = sum(k is not None and k is not Ellipsis for k in key)
+        if n_indexed > self.ndim:
+            raise IndexError(
+                'Too many indices for array of dimension {}.'.format(
+                    self.ndim))
+        expanded = []
+        for k in key:
+            if k is Ellipsis:
+                expanded += [slice(None)] * (self.ndim - n_indexed)
+            else:
+                expanded.append(k)
+        if n_ellipsis == 0:
+            expanded += [slice(None)] * (self.ndim - n_indexed)
+        return expanded
+
+    def _read_chunk(self, chunk):
+        """Read a region of the field."""
+        fld, _ = self.field.get_data_chunk(
+            self.time_step, chunk, field_units=self.field_units, m=self.m,
+            theta=self.theta)
+        return fld
+
+
+def _get_axis_request(axis_key, n):
+    """
+    Translate the key of an axis into the slice to read from the reader and
+    the key to apply afterwards to the read data.
+    """
+    if isinstance(axis_key, (numbers.Integral, np.integer)):
+        i = int(axis_key)
+        if i < -n or i >= n:
+            raise IndexError(
+                'Index {} is out of bounds for axis with size {}.'.format(
+                    i, n))
+        i = i % n
+        return slice(i, i + 1), 0
+    if isinstance(axis_key, slice):
+        start, stop, step = axis_key.indices(n)
+        indices = range(start, stop, step)
+        if len(indices) == 0:
+            return slice(0, 0), slice(None)
+        i_min = min(indices[0], indices[-1])
+        i_max = max(indices[0], indices[-1])
+        if step > 0:
+            return slice(i_min, i_max + 1, step), slice(None)
+        return slice(i_min, i_max + 1, -step), slice(None, None, -1)
+    indices = np.asarray(axis_key)
+    if indices.dtype == bool:
+        indices = np.nonzero(indices)[0]
+    if not np.issubdtype(indices.dtype, np.integer):
+        raise IndexError('Only integers, slices, Ellipsis, None and integer '
+                         'or boolean arrays are valid indices.')
+    indices = np.where(indices < 0, indices + n, indices)
+    if np.any((indices < 0) | (indices >= n)):
+        raise IndexError('Index out of bounds for axis with size {}.'.format(
+            n))
+    if indices.size == 0:
+        return slice(0, 0), indices
+    i_min = int(indices.min())
+    return slice(i_min, int(indices.max()) + 1), indices - i_min
@@ -8,16 +8,40 @@ License: GNU GPL-3.0.
 """
 
 
+import copy
+from collections import OrderedDict
+
+import numpy as np
+
 from visualpic.data_handling.derived_particle_data_definitions import (
     derived_particle_data_definitions, get_definition)
+from visualpic.data_handling.data_cache import data_cache
+from visualpic.data_handling.disk_cache import get_source_signature
+from visualpic.data_handling.deposition import (
+    deposit_particles, DEFAULT_CHUNK_BYTES)
+from visualpic.data_handling.fields import DepositedField
+from visualpic.data_handling.spatial_index import ParticleSpatialIndex
+from visualpic.helper_functions import (
+    read_ahead, stack_timestep_data, run_in_executor)
+
+
+# Components which already include the contribution of all physical
+# particles of a macroparticle, so that they are not multiplied by its
+# weight 'w' when deposited.
+WEIGHTED_COMPONENTS = ['q', 'm']
 
 
 class ParticleSpecies():
 
     """Class providing access to the data of a particle species"""
 
+    # Maximum number of spatial indices (one per time step and set of axes)
+    # kept in memory.
+    max_spatial_indices = 4
+
     def __init__(self, species_name, components_in_file, species_timesteps,
-                 timestep_to_files, data_reader, unit_converter):
+                 timestep_to_files, data_reader, unit_converter,
+                 disk_cache=None):
         """
         Initialize the particle species.
 
@@ -48,6 +72,10 @@ class ParticleSpecies():
         unit_converter : UnitConverter
             An instance of a UnitConverter of the corresponding simulation
             code.
+
+        disk_cache : DiskCache
+            (Optional) Persistent cache in which to store the tag index of
+            each time step.
         """
         self.species_name = species_name
         self.components_in_file = components_in_file
@@ -61,7 +89,10 @@ class ParticleSpecies():
         self.timestep_to_files = timestep_to_files
         self.data_reader = data_reader
         self.unit_converter = unit_converter
+        self.disk_cache = disk_cache
         self.associated_fields = []
+        self.sampled_fields = {}
+        self._spatial_indices = OrderedDict()
 
     def get_data(self, time_step, components_list=[], data_units=None,
                  time_units=None):
@@ -99,60 +130,515 @@ class ParticleSpecies():
         where the first element is the data array and the second is the
         metadata dictionary.
         """
-        # By default, if no list is specified, get all components.
-        if len(components_list) == 0:
-            components_list = self.get_list_of_available_components()
-        units_are_specified = data_units is not None
-        # If units are a string, assume all components should have these units
-        if isinstance(data_units, str):
-            data_units = [data_units] * len(components_list)
-        # Check that the length of components_list and data_units match
-        if (units_are_specified and (len(components_list) != len(data_units))):
-            len_comp = len(components_list)
-            len_units = len(data_units)
+        components_list, data_units = self._check_components(
+            components_list, data_units)
+        return self._read_data(time_step, components_list, data_units,
+                               time_units)
+
+    async def get_data_async(self, time_step, components_list=[],
+                             data_units=None, time_units=None, executor=None,
+                             semaphore=None):
+        """
+        Asynchronous version of `get_data`. The data is read in an executor,
+        so that the event loop is not blocked.
+
+        Parameters
+        ----------
+
+        time_step, components_list, data_units, time_units :
+            Same as in `get_data`.
+
+        executor : concurrent.futures.Executor
+            (Optional) Executor in which to read the data. By default, the
+            default executor of the event loop.
+
+        semaphore : asyncio.Semaphore
+            (Optional) Semaphore limiting the number of concurrent reads.
+
+        Returns
+        -------
+        The same dictionary as `get_data`.
+        """
+        return await run_in_executor(
+            self.get_data, time_step, components_list, data_units,
+            time_units, executor=executor, semaphore=semaphore)
+
+    def iter_timesteps(self, timesteps=None, components_list=[],
+                       data_units=None, time_units=None, stack=False,
+                       n_workers=None, max_in_flight=2):
+        """
+        Get the species data of several time steps, reading ahead the
+        following time steps in a pool of worker threads.
+
+        Only one file is read at a time, since the data readers (and h5py,
+        through its global lock) serialize their accesses. The read-ahead
+        only lets the I/O of the following time steps run while the current
+        one is processed, e.g., while derived components are computed.
+
+        Parameters
+        ----------
+
+        timesteps : list
+            (Optional) Time steps to read. By default, all time steps of the
+            species.
+
+        components_list, data_units, time_units : optional
+            Components to read and their units, as in `get_data`.
+
+        stack : bool
+            If False (default), a generator is returned. If True, the data
+            of each component is stacked into a single array for all time
+            steps. This requires the number of particles to be the same in
+            all time steps.
+
+        n_workers : int
+            (Optional) Number of worker threads. By default, equal to
+            `max_in_flight`.
+
+        max_in_flight : int
+            Maximum number of time steps being read (or waiting to be
+            yielded) at the same time. This bounds the memory usage.
+
+        Returns
+        -------
+        If `stack=False`, a generator yielding, in order, a tuple with the
+        time step and the data dictionary returned by `get_data`. If
+        `stack=True`, a dictionary where each component stores a tuple with
+        an array of shape (n_timesteps, n_particles) and a list with the
+        metadata of each time step.
+        """
+        if timesteps is None:
+            timesteps = self.timesteps
+        timesteps = list(timesteps)
+
+        def read_timestep(time_step):
+            return time_step, self.get_data(
+                time_step, components_list=components_list,
+                data_units=data_units, time_units=time_units)
+
+        generator = read_ahead(read_timestep, timesteps, n_workers,
+                               max_in_flight)
+        if not stack:
+            return generator
+        data_list = [data for _, data in generator]
+        stacked_data = {}
+        if len(data_list) > 0:
+            for component in data_list[0]:
+                comp_data, comp_md = zip(
+                    *[data[component] for data in data_list])
+                stacked_data[component] = (stack_timestep_data(comp_data),
+                                           list(comp_md))
+        return stacked_data
+
+    def get_number_of_particles(self, time_step):
+        """
+        Get the number of particles at a given time step, without reading
+        their data.
+        """
+        return self.data_reader.get_number_of_particles(
+            self._get_file_path(time_step), time_step, self.species_name,
+            self.components_in_file[0])
+
+    def iter_chunks(self, time_step, components_list=[], chunk_size=2**20,
+                    data_units=None, time_units=None):
+        """
+        Get the species data at a given time step in chunks of consecutive
+        particles, so that species which do not fit in memory can be
+        analyzed.
+
+        Each chunk is read directly from the data file (a hyperslab of each
+        dataset) and it is not stored in the data cache.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step at which to read the data.
+
+        components_list, data_units, time_units : optional
+            Components to read and their units, as in `get_data`.
+
+        chunk_size : int
+            Maximum number of particles in each chunk.
+
+        Returns
+        -------
+        A generator yielding, for each chunk, the same dictionary as
+        `get_data`.
+        """
+        if chunk_size < 1:
+            raise ValueError('The chunk size must be a positive integer.')
+        components_list, data_units = self._check_components(
+            components_list, data_units)
+        n_particles = self.get_number_of_particles(time_step)
+
+        def read_chunks():
+            for start in range(0, n_particles, chunk_size):
+                rows = slice(start, min(start + chunk_size, n_particles))
+                yield self._read_data(time_step, components_list, data_units,
+                                      time_units, rows=rows)
+
+        return read_chunks()
+
+    def deposit(self, time_step, grid, shape='cic', weight='q',
+                density=True, max_chunk_bytes=DEFAULT_CHUNK_BYTES):
+        """
+        Deposit the particles onto a regular grid.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step of the particle data.
+
+        grid : dict
+            Dictionary with one key per grid axis, which can be any particle
+            component (typically 'x', 'y' and/or 'z'). Each key stores
+            either the number of cells along the axis or a list
+            [n_cells, min, max], where min and max are the positions (in SI
+            units) of the centers of the first and last cells. If not
+            given, min and max are the range of the particle data.
+
+        shape : str
+            Particle shape. Possible values are 'ngp' (nearest grid point),
+            'cic' (cloud in cell) and 'tsc' (triangular shaped cloud).
+
+        weight : str
+            Name of the component deposited by each macroparticle (e.g., 'q'
+            for the charge). Components other than the charge 'q' and mass
+            'm' (which already include all physical particles of each
+            macroparticle) are multiplied by the weight 'w', if available.
+            If 'w', the number of physical particles is deposited and, if
+            None, the number of macroparticles.
+
+        density : bool
+            Whether to divide the deposited data by the cell volume.
+
+        max_chunk_bytes : int
+            Maximum size of the temporary arrays used for depositing each
+            chunk of particles.
+
+        Returns
+        -------
+        A tuple with the deposited data (in SI units) and its metadata
+        dictionary, with the same structure as that of a Field.
+        """
+        axes = sorted(grid)
+        comps_to_read = list(axes)
+        if weight is not None:
+            comps_to_read += [weight] + self._get_weight_components(weight)
+        comps_to_read = list(dict.fromkeys(comps_to_read))
+        data = self.get_data(time_step, comps_to_read, data_units='SI')
+        weights = None
+        if weight is not None:
+            weights = data[weight][0]
+            for comp in self._get_weight_components(weight):
+                weights = weights * data[comp][0]
+        fld_md = self._get_deposition_metadata(grid, weight, density, data)
+        fld = deposit_particles(
+            [data[axis][0] for axis in axes], weights,
+            [fld_md['axis'][axis]['min'] for axis in axes],
+            [fld_md['axis'][axis]['max'] for axis in axes],
+            [len(fld_md['axis'][axis]['array']) for axis in axes], shape,
+            max_chunk_bytes)
+        if density:
+            cell_volume = np.prod(
+                [fld_md['axis'][axis]['spacing'] for axis in axes])
+            fld /= cell_volume
+        return fld, fld_md
+
+    def _read_deposition_metadata(self, time_step, grid, weight, density):
+        """
+        Get the metadata of the data deposited onto a grid (see `deposit`)
+        without depositing the particles. Only the positions along the axes
+        whose range is not given in `grid` are read.
+        """
+        axes = sorted(grid)
+        range_axes = [axis for axis in axes
+                      if len(np.atleast_1d(grid[axis])) == 1]
+        other_comps = axes if weight is None else axes + [weight]
+        other_comps = [comp for comp in dict.fromkeys(other_comps)
+                       if comp not in range_axes]
+        self._check_components(range_axes + other_comps, None)
+        data = {}
+        if len(range_axes) > 0:
+            data.update(self.get_data(time_step, range_axes,
+                                      data_units='SI'))
+        if len(other_comps) > 0:
+            # Only the units and time of these components are needed.
+            data.update(self._read_data(
+                time_step, other_comps, ['SI'] * len(other_comps),
+                rows=slice(0, 0)))
+        return self._get_deposition_metadata(grid, weight, density, data)
+
+    def get_deposited_field(self, grid, shape='cic', weight='q',
+                            density=True, field_name=None,
+                            max_chunk_bytes=DEFAULT_CHUNK_BYTES):
+        """
+        Get a field with the particles deposited onto a regular grid (see
+        `deposit`) at each time step. The field can be used as any other
+        field, for example, to render a large species as a volume in the
+        `VTKVisualizer` or to plot its density with the `MplVisualizer`.
+
+        Parameters
+        ----------
+
+        grid, shape, weight, density, max_chunk_bytes : optional
+            Same as in `deposit`.
+
+        field_name : str
+            (Optional) Name of the field. By default, 'rho' for the charge
+            density, 'n' for the particle density or the name of the
+            deposited component.
+
+        Returns
+        -------
+        A DepositedField.
+        """
+        if field_name is None:
+            if weight == 'q':
+                field_name = 'rho' if density else 'Q'
+            elif weight in ['w', None]:
+                field_name = 'n' if density else 'N'
+            else:
+                field_name = weight
+        return DepositedField(self, field_name, grid, shape, weight, density,
+                              max_chunk_bytes)
+
+    def sample_field(self, field, time_step, order=1, field_units=None,
+                     m='all', max_chunk_bytes=DEFAULT_CHUNK_BYTES):
+        """
+        Interpolate a field at the position of each particle.
+
+        Parameters
+        ----------
+
+        field : Field
+            The field to sample. For thetaMode fields, the azimuthal modes
+            are evaluated directly at the (r, theta, z) position of each
+            particle.
+
+        time_step : int
+            Time step of the particle and field data.
+
+        order : int
+            Interpolation order. Possible values are 0 (nearest grid point),
+            1 (linear) and 2 (quadratic spline, as the TSC shape of PIC
+            codes, which smooths the data).
+
+        field_units : str
+            (Optional) Units in which to return the field data.
+
+        m : int or str
+            Azimuthal mode (only for thetaMode fields).
+
+        max_chunk_bytes : int
+            Maximum size of the temporary arrays used for interpolating each
+            chunk of particles.
+
+        Returns
+        -------
+        A tuple with an array containing the field value at each particle
+        (NaN for particles outside of the field grid) and its metadata
+        dictionary, with the same structure as that of the particle
+        components.
+        """
+        coords = [axis for axis in ['x', 'y', 'z']
+                  if axis in self.components_in_file]
+        data = self.get_data(time_step, coords, data_units='SI')
+        points = {axis: data[axis][0] for axis in coords}
+        fld, fld_md = field.get_data_at_points(
+            time_step, points, order, field_units, m, max_chunk_bytes)
+        comp_md = copy.deepcopy(data[coords[0]][1])
+        comp_md['units'] = fld_md['field']['units']
+        return fld, comp_md
+
+    def add_sampled_field(self, field, component_name=None, order=1,
+                          m='all'):
+        """
+        Make the values of a field at the particle positions (see
+        `sample_field`) available as a particle component. This allows, for
+        example, coloring the particles according to the local field in
+        the `VTKVisualizer`.
+
+        Parameters
+        ----------
+
+        field : Field
+            The field to sample.
+
+        component_name : str
+            (Optional) Name of the new component. By default, the name of
+            the field.
+
+        order, m : optional
+            Interpolation order and azimuthal mode, as in `sample_field`.
+        """
+        if component_name is None:
+            component_name = field.get_name()
+        if (component_name in self.components_in_file + self.derived_components
+                and component_name not in self.sampled_fields):
             raise ValueError(
-                'Length of components list ({})'.format(len_comp) +
-                ' and data units list ({}) do not match.'.format(len_units))
-        # Separate components to read from file from those which are derived
-        comp_to_read = []
-        derived_components = []
-        if units_are_specified:
-            comp_to_read_units = []
-            derived_components_units = []
+                "Component '{}' already exists.".format(component_name))
+        self.sampled_fields[component_name] = (field, order, m)
+
+    def get_spatial_index(self, time_step, axes=None):
+        """
+        Get a spatial index of the particle positions, which allows for
+        fast box, radius and nearest-neighbour queries (see
+        `ParticleSpatialIndex`). The index is built only once and kept in
+        memory for the most recently used time steps.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step of the particle data.
+
+        axes : list
+            (Optional) List of the components used as coordinates. By
+            default, all of 'x', 'y' and 'z' which are available. The
+            coordinates are in the original units of the data (as returned
+            by `get_data` without unit conversion).
+
+        Returns
+        -------
+        A ParticleSpatialIndex.
+        """
+        if axes is None:
+            axes = [axis for axis in ['x', 'y', 'z']
+                    if axis in self.components_in_file]
+        key = (time_step, tuple(axes))
+        index = self._spatial_indices.get(key)
+        if index is None:
+            data = self.get_data(time_step, list(axes))
+            index = ParticleSpatialIndex(
+                [data[axis][0] for axis in axes], axes)
+            self._spatial_indices[key] = index
+            while len(self._spatial_indices) > self.max_spatial_indices:
+                self._spatial_indices.popitem(last=False)
         else:
-            comp_to_read_units = None
-            derived_components_units = None
-        for i, component in enumerate(components_list):
-            if component in self.components_in_file:
-                comp_to_read.append(component)
-                if units_are_specified:
-                    comp_to_read_units.append(data_units[i])
-            elif component in self.derived_components:
-                derived_components.append(component)
-                if units_are_specified:
-                    derived_components_units.append(data_units[i])
-            else:
-                available_comps = self.get_list_of_available_components()
-                raise ValueError(
-                    "Component '{}' not found. ".format(component) +
-                    "Available components are {}.".format(available_comps))
-        # Read data from file
-        file_path = self._get_file_path(time_step)
-        folder_data = self._get_file_data(
-            file_path, time_step, comp_to_read, comp_to_read_units, time_units)
-        # Compute derived data
-        derived_data = self._calculate_derived_data(
-            file_path, time_step, derived_components, derived_components_units,
-            time_units)
-        # Join in a single dictionary
-        data = {**folder_data, **derived_data}
-        return data
+            self._spatial_indices.move_to_end(key)
+        return index
+
+    def get_tag_index(self, time_step):
+        """
+        Get an index of the particle tags at a given time step, which allows
+        for locating particles by their tag with a binary search. The index
+        is kept in the data cache and, if enabled, in the disk cache.
+
+        Parameters
+        ----------
+
+        time_step : int
+            Time step of the particle data.
+
+        Returns
+        -------
+        A tuple with the sorted array of tags and an array with the row
+        (i.e., the index in the particle data) of each of them.
+        """
+        if 'tag' not in self.components_in_file:
+            raise ValueError(
+                "Species '{}' has no particle tags.".format(self.species_name))
+        parts = ['tags', 'rows']
+        cache_keys = [data_cache.make_key(self, time_step, tag_index=part)
+                      for part in parts]
+        index = [data_cache.get(key) for key in cache_keys]
+        if all(entry is not None for entry in index):
+            return tuple(data for data, _ in index)
+        disk_keys = []
+        if self.disk_cache is not None:
+            source = self._get_source_signature(time_step)
+            disk_keys = [
+                self.disk_cache.make_key(
+                    'tag_index', self.species_name, source, time_step, part)
+                for part in parts]
+            index = [self.disk_cache.get(key) for key in disk_keys]
+        if any(entry is None for entry in index):
+            tags = self.get_data(time_step, ['tag'])['tag'][0]
+            rows = np.argsort(tags, kind='stable')
+            index = [(tags[rows], {}), (rows, {})]
+            for key, (data, md) in zip(disk_keys, index):
+                self.disk_cache.put(key, data, md)
+        return tuple(data_cache.put(key, data, md)[0]
+                     for key, (data, md) in zip(cache_keys, index))
+
+    def track(self, tags, components_list=[], timesteps=None,
+              data_units=None, time_units=None, n_workers=None,
+              max_in_flight=2):
+        """
+        Get the evolution of a set of particles, identified by their tag,
+        across several time steps.
+
+        At each time step, the particles are located with the tag index (see
+        `get_tag_index`) and only their data is read, i.e., only the region
+        of the file between the first and the last of these particles.
+
+        Parameters
+        ----------
+
+        tags : array
+            Tags of the particles to track.
+
+        components_list, data_units, time_units : optional
+            Components to read and their units, as in `get_data`.
+
+        timesteps : list
+            (Optional) Time steps to read. By default, all time steps of the
+            species.
+
+        n_workers, max_in_flight : int
+            (Optional) Number of worker threads and maximum number of time
+            steps being read at the same time, as in `iter_timesteps`.
+
+        Returns
+        -------
+        A dictionary where each component stores a tuple with an array of
+        shape (n_particles, n_timesteps) and a list with the metadata of
+        each time step. The value of the particles which are not present at
+        a time step is NaN.
+        """
+        components_list, data_units = self._check_components(
+            components_list, data_units)
+        if timesteps is None:
+            timesteps = self.timesteps
+        timesteps = list(timesteps)
+        tags = np.atleast_1d(np.asarray(tags))
+
+        def read_timestep(time_step):
+            sorted_tags, rows = self.get_tag_index(time_step)
+            tags_ts = tags.astype(sorted_tags.dtype)
+            found = np.zeros(len(tags_ts), dtype=bool)
+            idx = np.searchsorted(sorted_tags, tags_ts)
+            in_range = idx < len(sorted_tags)
+            found[in_range] = sorted_tags[idx[in_range]] == tags_ts[in_range]
+            # Read the rows in the same order as in the data file.
+            found_rows = rows[idx[found]]
+            order = np.argsort(found_rows)
+            data = self._read_data(time_step, components_list, data_units,
+                                   time_units, rows=found_rows[order])
+            return np.nonzero(found)[0][order], data
+
+        tracked_data = {}
+        for component in components_list:
+            tracked_data[component] = (
+                np.full((len(tags), len(timesteps)), np.nan), [])
+        generator = read_ahead(read_timestep, timesteps, n_workers,
+                               max_in_flight)
+        for i, (particles, data) in enumerate(generator):
+            for component in components_list:
+                comp_data, comp_md = data[component]
+                tracked_data[component][0][particles, i] = comp_data
+                tracked_data[component][1].append(comp_md)
+        return tracked_data
 
     def get_list_of_available_components(self, include_tags=False):
         """
         Returns a list of strings with the names of all available components.
         """
-        all_components = self.components_in_file + self.derived_components
+        all_components = (self.components_in_file + self.derived_components +
+                          list(self.sampled_fields))
         if not include_tags and 'tag' in all_components:
             all_components.remove('tag')
         return all_components
@@ -205,40 +691,245 @@ class ParticleSpecies():
         av_data = set(comps + fields)
         return data.issubset(av_data)
 
+    def _get_weight_components(self, weight):
+        """
+        Get the components by which the deposited `weight` is multiplied,
+        i.e., the macroparticle weight 'w' (if available) unless the
+        component already includes it.
+        """
+        if (weight in WEIGHTED_COMPONENTS + ['w'] or
+                'w' not in self.components_in_file):
+            return []
+        return ['w']
+
+    def _get_deposition_metadata(self, grid, weight, density, data):
+        """
+        Get the metadata of the data deposited onto a grid (see `deposit`),
+        from the SI data of the grid axes and the weight. The data of the
+        axes is only used if their range is not given in `grid`.
+        """
+        axes = sorted(grid)
+        weight_units = ''
+        if weight not in [None, 'w']:
+            weight_units = data[weight][1]['units']
+        geometry = {1: '1d', 2: '2dcartesian', 3: '3dcartesian'}[len(axes)]
+        fld_md = {'field': {'units': weight_units, 'geometry': geometry,
+                            'axis_labels': axes},
+                  'axis': {},
+                  'time': copy.deepcopy(data[axes[0]][1]['time'])}
+        for axis in axes:
+            axis_grid = np.atleast_1d(grid[axis])
+            if len(axis_grid) == 3:
+                n, ax_min, ax_max = axis_grid
+            elif len(axis_grid) == 1:
+                n = axis_grid[0]
+                ax_data = data[axis][0]
+                if len(ax_data) > 0:
+                    ax_min, ax_max = np.min(ax_data), np.max(ax_data)
+                else:
+                    ax_min, ax_max = 0., 0.
+                if ax_min == ax_max:
+                    ax_min, ax_max = ax_min - 0.5, ax_max + 0.5
+            else:
+                raise ValueError(
+                    "The grid of axis '{}' must be the number of cells or a "
+                    "list [n_cells, min, max].".format(axis))
+            ax_array = np.linspace(float(ax_min), float(ax_max), int(n))
+            spacing = ax_array[1] - ax_array[0]
+            fld_md['axis'][axis] = {'units': data[axis][1]['units'],
+                                    'array': ax_array, 'spacing': spacing,
+                                    'min': ax_array[0], 'max': ax_array[-1]}
+        if density:
+            fld_md['field']['units'] = _get_density_units(
+                weight_units, [fld_md['axis'][axis]['units']
+                               for axis in axes])
+        return fld_md
+
+    def _check_components(self, components_list, data_units):
+        """
+        Check that the requested components exist and get the list of units
+        of each of them (None if no units are specified).
+        """
+        # By default, if no list is specified, get all components.
+        if len(components_list) == 0:
+            components_list = self.get_list_of_available_components()
+        # If units are a string, assume all components should have these units
+        if isinstance(data_units, str):
+            data_units = [data_units] * len(components_list)
+        # Check that the length of components_list and data_units match
+        if data_units is not None and len(components_list) != len(data_units):
+            len_comp = len(components_list)
+            len_units = len(data_units)
+            raise ValueError(
+                'Length of components list ({})'.format(len_comp) +
+                ' and data units list ({}) do not match.'.format(len_units))
+        for component in components_list:
+            if component not in self.get_list_of_available_components(True):
+                available_comps = self.get_list_of_available_components()
+                raise ValueError(
+                    "Component '{}' not found. ".format(component) +
+                    "Available components are {}.".format(available_comps))
+        return components_list, data_units
+
+    def _read_data(self, time_step, components_list, data_units=None,
+                   time_units=None, rows=None):
+        """
+        Read the data of the specified components (or only of the given
+        rows) and convert its units. The data of all rows is kept in the
+        data cache.
+        """
+        units_are_specified = data_units is not None
+        if not units_are_specified:
+            data_units = [None] * len(components_list)
+        # Read (only once) all file components needed by the requested
+        # components, including the requirements of derived components.
+        comp_to_read = self._get_required_file_components(components_list)
+        file_path = self._get_file_path(time_step)
+        if rows is None:
+            file_data = self._get_file_data(file_path, time_step,
+                                            comp_to_read)
+        else:
+            file_data = self.data_reader.read_particle_data(
+                file_path, time_step, self.species_name, comp_to_read,
+                rows=rows)
+        # Compute derived data. Intermediate results are shared between all
+        # derived components.
+        derived_data = {}
+        for component in components_list:
+            if component in self.derived_components:
+                self._calculate_derived_data(
+                    time_step, component, file_data, derived_data,
+                    use_cache=rows is None)
+        # Gather requested data and convert units.
+        data = {}
+        for component, units in zip(components_list, data_units):
+            if component in self.derived_components:
+                comp_data, comp_md = derived_data[component]
+            elif component in self.sampled_fields:
+                comp_data, comp_md = self._get_sampled_field_data(
+                    time_step, component)
+                if rows is not None:
+                    comp_data = comp_data[rows]
+            else:
+                comp_data, comp_md = file_data[component]
+            if units_are_specified:
+                data.update(self._convert_data_units(
+                    {component: (comp_data, copy.deepcopy(comp_md))},
+                    [component], [units], time_units))
+            else:
+                data[component] = (comp_data, comp_md)
+        return data
+
     def _get_file_path(self, time_step):
         """Get the file path corresponding to the specified time step."""
         return self.timestep_to_files[time_step]
 
-    def _get_file_data(self, file_path, iteration, components_list, data_units,
-                       time_units):
-        """Read the specified components from a data file."""
-        data = self.data_reader.read_particle_data(
-            file_path, iteration, self.species_name, components_list)
-        data = self._convert_data_units(data, components_list, data_units,
-                                        time_units)
+    def _get_source_signature(self, time_step):
+        """
+        Get the signature (path, modification time and size) of the files
+        from which the species data is read at a given time step.
+        """
+        file_paths = self.data_reader.get_source_files(
+            self._get_file_path(time_step), time_step)
+        return get_source_signature(file_paths)
+
+    def _get_file_data(self, file_path, iteration, components_list):
+        """
+        Read the specified components from a data file in their original
+        units. Components which are already available in the data cache are
+        not read again.
+        """
+        data = {}
+        cache_keys = {}
+        comps_to_read = []
+        for component in components_list:
+            cache_key = data_cache.make_key(self, iteration,
+                                            component=component)
+            cached_data = data_cache.get(cache_key)
+            if cached_data is not None:
+                data[component] = cached_data
+            else:
+                cache_keys[component] = cache_key
+                comps_to_read.append(component)
+        if len(comps_to_read) > 0:
+            read_data = self.data_reader.read_particle_data(
+                file_path, iteration, self.species_name, comps_to_read)
+            for component in comps_to_read:
+                data[component] = data_cache.put(
+                    cache_keys[component], *read_data[component])
         return data
 
-    def _calculate_derived_data(
-            self, file_path, iteration, data_list, target_data_units,
-            time_units):
-        """Calculate the specified derived components."""
-        derived_data_dict = {}
-        for name in data_list:
-            data_def = get_definition(name)
-            data_name = data_def['name']
-            data_units = data_def['units']
-            required_data_list = data_def['requirements']
-            required_data_units = ['SI'] * len(required_data_list)
-            required_data = self._get_file_data(
-                file_path, iteration, required_data_list, required_data_units,
-                time_units)
-            derived_data = data_def['recipe'](required_data)
-            derived_data_md = required_data[required_data_list[0]][1]
-            derived_data_md['units'] = data_units
-            derived_data_dict[data_name] = (derived_data, derived_data_md)
-        derived_data_dict = self._convert_data_units(
-            derived_data_dict, data_list, target_data_units, time_units)
-        return derived_data_dict
+    def _get_sampled_field_data(self, time_step, component):
+        """Get the data of a sampled field component from the data cache."""
+        field, order, m = self.sampled_fields[component]
+        cache_key = data_cache.make_key(
+            self, time_step, component=component, field=field, order=order,
+            m=m)
+        cached_data = data_cache.get(cache_key)
+        if cached_data is None:
+            cached_data = data_cache.put(cache_key, *self.sample_field(
+                field, time_step, order, m=m))
+        return cached_data
+
+    def _get_required_file_components(self, components_list):
+        """
+        Get the list of file components needed to obtain the specified
+        components, including those required by derived components.
+        """
+        required_comps = []
+        pending_comps = list(components_list)
+        checked_comps = set()
+        while len(pending_comps) > 0:
+            component = pending_comps.pop(0)
+            if component in checked_comps:
+                continue
+            checked_comps.add(component)
+            if component in self.components_in_file:
+                required_comps.append(component)
+            elif component not in self.sampled_fields:
+                pending_comps += get_definition(component)['requirements']
+        return required_comps
+
+    def _calculate_derived_data(self, iteration, component, file_data,
+                                derived_data, use_cache=True):
+        """
+        Calculate a derived component in SI units.
+
+        Its requirements are obtained from `file_data` (converted to SI) or,
+        if they are also derived components, calculated recursively. The
+        SI data of all file and derived components used in the calculation
+        is stored in `derived_data` so that it can be reused. Derived
+        components are also stored in the data cache, unless `use_cache` is
+        False (e.g., when `file_data` contains only some particles).
+        """
+        if component in derived_data:
+            return derived_data[component]
+        if component in self.components_in_file:
+            comp_data, comp_md = file_data[component]
+            derived_data[component] = self._convert_data_units(
+                {component: (comp_data, copy.deepcopy(comp_md))},
+                [component], ['SI'])[component]
+            return derived_data[component]
+        cached_data = None
+        if use_cache:
+            cache_key = data_cache.make_key(self, iteration,
+                                            component=component, derived=True)
+            cached_data = data_cache.get(cache_key)
+        if cached_data is None:
+            data_def = get_definition(component)
+            required_data = {}
+            for req_comp in data_def['requirements']:
+                required_data[req_comp] = self._calculate_derived_data(
+                    iteration, req_comp, file_data, derived_data, use_cache)
+            comp_data = data_def['recipe'](required_data)
+            comp_md = copy.deepcopy(
+                required_data[data_def['requirements'][0]][1])
+            comp_md['units'] = data_def['units']
+            cached_data = (comp_data, comp_md)
+            if use_cache:
+                cached_data = data_cache.put(cache_key, comp_data, comp_md)
+        derived_data[component] = cached_data
+        return cached_data
 
     def _convert_data_units(self, data, components_list, data_units=None,
                             time_units=None):
@@ -256,8 +947,31 @@ class ParticleSpecies():
         Determine the available derived components for the data available in
         the file.
         """
+        # Derived components can also depend on other derived components.
+        available_comps = set(components_in_file)
         available_derived_comps = []
-        for component in derived_particle_data_definitions:
-            if set(component['requirements']).issubset(components_in_file):
-                available_derived_comps.append(component['name'])
+        new_comps_found = True
+        while new_comps_found:
+            new_comps_found = False
+            for component in derived_particle_data_definitions:
+                name = component['name']
+                if (name not in available_comps and
+                        set(component['requirements']).issubset(
+                            available_comps)):
+                    available_comps.add(name)
+                    available_derived_comps.append(name)
+                    new_comps_found = True
         return available_derived_comps
+
+
+def _get_density_units(data_units, axes_units):
+    """Get the units of a density from those of the data and the axes."""
+    if len(set(axes_units)) == 1:
+        volume_units = axes_units[0]
+        if len(axes_units) > 1:
+            volume_units += '^{}'.format(len(axes_units))
+    else:
+        volume_units = '(' + '*'.join(axes_units) + ')'
+    if data_units == '':
+        data_units = '1'
+    return data_units + '/' + volume_units
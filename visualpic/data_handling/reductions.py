@@ -0,0 +1,392 @@
+"""
+This file is part of VisualPIC.
+
+The module contains classes for computing reductions (min, max, sum,
+moments, covariances and quantiles) of data which is streamed in chunks.
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+
+import re
+
+import numpy as np
+
+
+# Supported reductions, in addition to quantiles ('median' and percentiles
+# such as 'p99.9').
+REDUCTION_OPS = ['min', 'max', 'abs_max', 'sum', 'count', 'mean', 'var',
+                 'std', 'integral']
+
+
+class StreamingReduction():
+
+    """
+    Reduction of data which is processed chunk by chunk.
+
+    The minimum, maximum, sum, mean and variance are exact (the moments are
+    combined with the parallel algorithm of Chan et al.). Quantiles are
+    approximate and are obtained from a `QuantileSketch` with bounded
+    memory.
+    """
+
+    def __init__(self, ops, relative_accuracy=0.01):
+        """
+        Initialize the reduction.
+
+        Parameters
+        ----------
+
+        ops : list
+            List of strings with the reductions to compute. Possible values
+            are those in `REDUCTION_OPS`, 'median' and percentiles given as
+            'p' followed by a number between 0 and 100 (e.g., 'p99.9').
+
+        relative_accuracy : float
+            Relative accuracy of the quantiles.
+        """
+        self.ops = list(ops)
+        self._quantiles = {}
+        for op in self.ops:
+            quantile = _parse_quantile(op)
+            if quantile is not None:
+                self._quantiles[op] = quantile
+            elif op not in REDUCTION_OPS:
+                raise ValueError(
+                    "Unknown reduction '{}'. Possible values are {}, ".format(
+                        op, REDUCTION_OPS) + "'median' or percentiles "
+                    "(e.g., 'p99.9').")
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.sum = 0.
+        self._mean = 0.
+        self._m2 = 0.
+        self._sketch = None
+        if len(self._quantiles) > 0:
+            self._sketch = QuantileSketch(relative_accuracy)
+
+    def update(self, data):
+        """Add a chunk of data to the reduction."""
+        data = np.asarray(data).ravel()
+        n = data.size
+        if n == 0:
+            return
+        self.min = min(self.min, np.min(data))
+        self.max = max(self.max, np.max(data))
+        chunk_sum = np.sum(data, dtype=np.float64)
+        chunk_mean = chunk_sum / n
+        chunk_m2 = np.sum(np.square(data - chunk_mean), dtype=np.float64)
+        delta = chunk_mean - self._mean
+        total = self.count + n
+        self._m2 += chunk_m2 + delta**2 * self.count * n / total
+        self._mean += delta * n / total
+        self.sum += chunk_sum
+        self.count = total
+        if self._sketch is not None:
+            self._sketch.update(data)
+
+    def get_results(self, cell_volume=None):
+        """
+        Get the result of the reductions.
+
+        Parameters
+        ----------
+
+        cell_volume : float
+            (Optional) Volume of each cell. Needed only for the 'integral'.
+
+        Returns
+        -------
+        A dictionary with the value of each reduction.
+        """
+        results = {}
+        empty = self.count == 0
+        for op in self.ops:
+            if op in self._quantiles:
+                value = np.nan
+                if not empty:
+                    value = self._sketch.get_quantile(self._quantiles[op])
+                    value = min(max(value, self.min), self.max)
+            elif op == 'min':
+                value = self.min if not empty else np.nan
+            elif op == 'max':
+                value = self.max if not empty else np.nan
+            elif op == 'abs_max':
+                value = max(abs(self.min), abs(self.max)) if not empty \
+                    else np.nan
+            elif op == 'sum':
+                value = self.sum
+            elif op == 'count':
+                value = self.count
+            elif op == 'mean':
+                value = self._mean if not empty else np.nan
+            elif op == 'var':
+                value = self._m2 / self.count if not empty else np.nan
+            elif op == 'std':
+                value = np.sqrt(self._m2 / self.count) if not empty \
+                    else np.nan
+            elif op == 'integral':
+                if cell_volume is None:
+                    raise ValueError(
+                        'The cell volume is needed to compute the integral.')
+                value = self.sum * cell_volume
+            results[op] = value
+        return results
+
+
+class StreamingMoments():
+
+    """
+    Weighted means and covariances of several variables which are processed
+    chunk by chunk, optionally grouped in bins (e.g., the slices of a
+    particle beam).
+
+    The moments of each chunk are computed around the chunk mean and
+    combined with the parallel algorithm of Chan et al., so that the result
+    is exact and numerically stable.
+    """
+
+    def __init__(self, n_vars, n_bins=1):
+        """
+        Initialize the moments.
+
+        Parameters
+        ----------
+
+        n_vars : int
+            Number of variables.
+
+        n_bins : int
+            Number of bins.
+        """
+        self.n_vars = n_vars
+        self.n_bins = n_bins
+        self.count = np.zeros(n_bins, dtype=np.int64)
+        self.weight = np.zeros(n_bins)
+        self.weight_sq = np.zeros(n_bins)
+        self.mean = np.zeros((n_bins, n_vars))
+        self._comoment = np.zeros((n_bins, n_vars, n_vars))
+
+    def update(self, values, weights=None, bins=None):
+        """
+        Add a chunk of data to the moments.
+
+        Parameters
+        ----------
+
+        values : list
+            List with an array of values of each variable.
+
+        weights : array
+            (Optional) Weight of each value. By default, all values have
+            the same weight.
+
+        bins : array
+            (Optional) Index of the bin of each value. Needed only if there
+            is more than one bin.
+        """
+        if len(values) != self.n_vars:
+            raise ValueError(
+                'Expected {} variables, got {}.'.format(
+                    self.n_vars, len(values)))
+        values = [np.asarray(v, dtype=np.float64).ravel() for v in values]
+        n = values[0].size
+        if n == 0:
+            return
+        if weights is None:
+            weights = np.ones(n)
+        weights = np.asarray(weights, dtype=np.float64).ravel()
+        if bins is None:
+            bins = np.zeros(n, dtype=np.intp)
+
+        def bin_sum(data):
+            return np.bincount(bins, weights=data, minlength=self.n_bins)
+
+        chunk_count = np.bincount(bins, minlength=self.n_bins)
+        chunk_weight = bin_sum(weights)
+        chunk_mean = np.column_stack([bin_sum(weights * v) for v in values])
+        chunk_mean /= _nonzero(chunk_weight)[:, np.newaxis]
+        deltas = np.stack([v - chunk_mean[bins, i]
+                           for i, v in enumerate(values)])
+        if self.n_bins == 1:
+            chunk_comoment = np.dot(deltas * weights, deltas.T)[np.newaxis]
+        else:
+            chunk_comoment = np.zeros((self.n_bins, self.n_vars,
+                                       self.n_vars))
+            for i in range(self.n_vars):
+                w_delta = weights * deltas[i]
+                for j in range(i, self.n_vars):
+                    chunk_comoment[:, i, j] = bin_sum(w_delta * deltas[j])
+                    chunk_comoment[:, j, i] = chunk_comoment[:, i, j]
+        # Combine with the previous moments.
+        total_weight = self.weight + chunk_weight
+        delta = chunk_mean - self.mean
+        factor = self.weight * chunk_weight / _nonzero(total_weight)
+        self._comoment += chunk_comoment + (
+            factor[:, np.newaxis, np.newaxis] * delta[:, :, np.newaxis] *
+            delta[:, np.newaxis, :])
+        self.mean += delta * (chunk_weight /
+                              _nonzero(total_weight))[:, np.newaxis]
+        self.count += chunk_count
+        self.weight = total_weight
+        self.weight_sq += bin_sum(weights**2)
+
+    def get_covariance(self, unbiased=False):
+        """
+        Get the covariance matrix of each bin, as an array of shape
+        (n_bins, n_vars, n_vars).
+
+        If `unbiased` is True, the normalization is the same as in `np.cov`
+        with `aweights`. Otherwise, the comoments are divided by the sum of
+        weights. The covariance is NaN in bins without enough data.
+        """
+        norm = self.weight
+        if unbiased:
+            norm = norm - self.weight_sq / _nonzero(norm)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            norm = np.where(norm > 0, norm, np.nan)
+            return self._comoment / norm[:, np.newaxis, np.newaxis]
+
+
+class QuantileSketch():
+
+    """
+    Sketch for approximate quantiles with bounded memory.
+
+    Values are counted in logarithmically-spaced buckets (separately for
+    positive and negative values), so that any quantile is obtained with a
+    relative accuracy given by `relative_accuracy`, independently of the
+    amount of data (as in the DDSketch algorithm). If the number of buckets
+    exceeds `max_buckets`, the buckets with the smallest magnitudes are
+    collapsed, which only affects the accuracy of values close to zero.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=4096):
+        """
+        Initialize the sketch.
+
+        Parameters
+        ----------
+
+        relative_accuracy : float
+            Relative accuracy of the quantiles.
+
+        max_buckets : int
+            Maximum number of buckets for each sign.
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('The relative accuracy must be between 0 and 1.')
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.zero_count = 0
+        self._positive = _BucketStore(max_buckets)
+        self._negative = _BucketStore(max_buckets)
+
+    def update(self, data):
+        """Add an array of values to the sketch."""
+        data = np.asarray(data, dtype=np.float64).ravel()
+        data = data[np.isfinite(data)]
+        positive = data[data > 0]
+        negative = -data[data < 0]
+        self.zero_count += data.size - positive.size - negative.size
+        self._positive.add(self._get_bucket_indices(positive))
+        self._negative.add(self._get_bucket_indices(negative))
+
+    def get_quantile(self, q):
+        """
+        Get an approximate quantile.
+
+        Parameters
+        ----------
+
+        q : float
+            The quantile, between 0 and 1.
+
+        Returns
+        -------
+        The value of the quantile.
+        """
+        n_neg = self._negative.get_count()
+        n_total = n_neg + self.zero_count + self._positive.get_count()
+        if n_total == 0:
+            return np.nan
+        rank = q * (n_total - 1)
+        if rank < n_neg:
+            # Negative values are ordered by decreasing magnitude.
+            index = self._negative.get_index_at_rank(n_neg - 1 - rank)
+            return -self._get_bucket_value(index)
+        rank -= n_neg
+        if rank < self.zero_count:
+            return 0.
+        rank -= self.zero_count
+        return self._get_bucket_value(self._positive.get_index_at_rank(rank))
+
+    def _get_bucket_indices(self, values):
+        """Get the bucket index of each (positive) value."""
+        return np.ceil(np.log(values) / self._log_gamma).astype(np.int64)
+
+    def _get_bucket_value(self, index):
+        """Get the representative value of a bucket."""
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+
+class _BucketStore():
+
+    """Contiguous array of bucket counts with an index offset."""
+
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, indices):
+        if indices.size == 0:
+            return
+        i_min = indices.min()
+        counts = np.bincount(indices - i_min)
+        if self.counts.size == 0:
+            self.offset, self.counts = i_min, counts
+        else:
+            new_offset = min(self.offset, i_min)
+            new_size = max(self.offset + self.counts.size,
+                           i_min + counts.size) - new_offset
+            merged = np.zeros(new_size, dtype=np.int64)
+            start = self.offset - new_offset
+            merged[start:start + self.counts.size] += self.counts
+            start = i_min - new_offset
+            merged[start:start + counts.size] += counts
+            self.offset, self.counts = new_offset, merged
+        excess = self.counts.size - self.max_buckets
+        if excess > 0:
+            # Collapse the buckets with the smallest magnitude.
+            self.counts[excess] += self.counts[:excess].sum()
+            self.counts = self.counts[excess:]
+            self.offset += excess
+
+    def get_count(self):
+        return int(self.counts.sum())
+
+    def get_index_at_rank(self, rank):
+        cumulative = np.cumsum(self.counts)
+        i = np.searchsorted(cumulative, rank, side='right')
+        return self.offset + min(i, self.counts.size - 1)
+
+
+def _nonzero(values):
+    """Replace the zeros of an array by ones (to be used as divisor)."""
+    return np.where(values != 0, values, 1.)
+
+
+def _parse_quantile(op):
+    """Get the quantile (between 0 and 1) of a reduction, if any."""
+    if op == 'median':
+        return 0.5
+    match = re.fullmatch(r'p(\d+(\.\d*)?)', op)
+    if match is not None:
+        percentile = float(match.group(1))
+        if percentile <= 100:
+            return percentile / 100
+    return None
@@ -0,0 +1,163 @@
+"""
+This file is part of VisualPIC.
+
+The module contains the ParticleSpatialIndex class, used for fast spatial
+queries of particle data.
+
+Copyright 2016-2020, Angel Ferran Pousa.
+License: GNU GPL-3.0.
+"""
+
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class ParticleSpatialIndex():
+
+    """
+    Spatial index of the particle positions at a given time step.
+
+    Box queries use the particle order sorted along each axis, which is
+    computed (only once) for the axes being queried. Radius and
+    nearest-neighbour queries use a KD-tree, which is built on first use.
+    """
+
+    def __init__(self, positions, axes):
+        """
+        Initialize the index.
+
+        Parameters
+        ----------
+
+        positions : list
+            List of arrays with the coordinates of the particles along each
+            axis.
+
+        axes : list
+            List of strings with the name of each axis (e.g.,
+            ['x', 'y', 'z']).
+        """
+        self.axes = list(axes)
+        self.positions = np.column_stack(
+            [np.asarray(pos, dtype=np.float64) for pos in positions])
+        self.positions.flags.writeable = False
+        self._sorted = {}
+        self._tree = None
+
+    def __len__(self):
+        return self.positions.shape[0]
+
+    def query_box(self, region=None):
+        """
+        Get the particles inside a box.
+
+        Parameters
+        ----------
+
+        region : dict
+            (Optional) Dictionary with the [min, max] limits of the box along
+            each axis, e.g., {'z': [z_min, z_max]}. The box is unbounded
+            along the axes not given. Particles on the boundary of the box
+            are included.
+
+        Returns
+        -------
+        A sorted array with the indices of the particles inside the box.
+        """
+        if region is None or len(region) == 0:
+            return np.arange(len(self))
+        # Start from the axis which selects the fewest particles.
+        candidates = None
+        for axis in region:
+            order, values = self._get_sorted(axis)
+            ax_min, ax_max = region[axis]
+            i_min = np.searchsorted(values, ax_min, side='left')
+            i_max = np.searchsorted(values, ax_max, side='right')
+            if candidates is None or i_max - i_min < len(candidates):
+                candidates = order[i_min:i_max]
+                selected_axis = axis
+        in_box = np.ones(len(candidates), dtype=bool)
+        for axis in region:
+            if axis != selected_axis:
+                ax_min, ax_max = region[axis]
+                pos = self.positions[candidates, self.axes.index(axis)]
+                in_box &= (pos >= ax_min) & (pos <= ax_max)
+        return np.sort(candidates[in_box])
+
+    def query_radius(self, point, radius):
+        """
+        Get the particles within a distance of a point.
+
+        Parameters
+        ----------
+
+        point : dict or array
+            Coordinates of the point, given as a dictionary with a value for
+            each axis or as an array in the same order as `axes`.
+
+        radius : float
+            Maximum distance to the point.
+
+        Returns
+        -------
+        A sorted array with the indices of the particles within the given
+        distance.
+        """
+        indices = self._get_tree().query_ball_point(
+            self._get_point(point), radius)
+        return np.sort(np.asarray(indices, dtype=np.int64))
+
+    def query_nearest(self, point, k=1):
+        """
+        Get the particles closest to a point.
+
+        Parameters
+        ----------
+
+        point : dict or array
+            Coordinates of the point, as in `query_radius`.
+
+        k : int
+            Number of particles to find.
+
+        Returns
+        -------
+        A tuple with the distance to the point of the closest particles and
+        their indices, both as arrays sorted by increasing distance.
+        """
+        k = min(k, len(self))
+        if k == 0:
+            return np.array([]), np.array([], dtype=np.int64)
+        distances, indices = self._get_tree().query(
+            self._get_point(point), k=k)
+        return np.atleast_1d(distances), np.atleast_1d(indices)
+
+    def _get_point(self, point):
+        """Get the coordinates of a point as an array."""
+        if isinstance(point, dict):
+            point = [point[axis] for axis in self.axes]
+        point = np.asarray(point, dtype=np.float64)
+        if point.shape != (len(self.axes),):
+            raise ValueError(
+                'The point must have one coordinate for each axis '
+                '{}.'.format(self.axes))
+        return point
+
+    def _get_sorted(self, axis):
+        """Get the particle order and the sorted positions along an axis."""
+        if axis not in self.axes:
+            raise ValueError(
+                "Axis '{}' not found. Available axes are {}.".format(
+                    axis, self.axes))
+        if axis not in self._sorted:
+            values = self.positions[:, self.axes.index(axis)]
+            order = np.argsort(values, kind='stable')
+            self._sorted[axis] = (order, values[order])
+        return self._sorted[axis]
+
+    def _get_tree(self):
+        """Get the KD-tree of the particle positions."""
+        if self._tree is None:
+            self._tree = cKDTree(self.positions, balanced_tree=False)
+        return self._tree
@@ -41,6 +41,30 @@ charge_conversion = {'nC': 1e9,
                      'fC': 1e15}
 
 
+charge_density_conversion = {'C/cm^3': 1e-6,
+                             'nC/m^3': 1e9,
+                             'pC/um^3': 1e-6}
+
+
+areal_charge_density_conversion = {'C/cm^2': 1e-4,
+                                   'nC/m^2': 1e9,
+                                   'pC/um^2': 1.}
+
+
+linear_charge_density_conversion = {'C/cm': 1e-2,
+                                    'nC/m': 1e9,
+                                    'pC/um': 1e6}
+
+
+number_density_conversion = {'1/cm^3': 1e-6}
+
+
+areal_number_density_conversion = {'1/cm^2': 1e-4}
+
+
+linear_number_density_conversion = {'1/cm': 1e-2}
+
+
 efield_conversion = {'GV/m': 1e-9,
                      'MV/m': 1e-6,
                      'T': 1/ct.c}
@@ -66,6 +90,12 @@ bfieldgradient_conversion = {'MT/m': 1e-6,
 intensity_conversion = {'W/cm^2': 1e-4}
 
 
+energy_conversion = {'eV': 1 / ct.e,
+                     'keV': 1e-3 / ct.e,
+                     'MeV': 1e-6 / ct.e,
+                     'GeV': 1e-9 / ct.e}
+
+
 potential_conversion = {'m_e*c^2/e': 1 / ((ct.m_e * ct.c**2) / ct.e),
                         'kV': 1e-3,
                         'MV': 1e-6}
@@ -80,19 +110,107 @@ class UnitConverter():
                                    's': time_conversion,
                                    'rad': angle_conversion,
                                    'C': charge_conversion,
+                                   'C/m^3': charge_density_conversion,
+                                   '1/m^3': number_density_conversion,
+                                   # Densities of 2D and 1D deposits.
+                                   'C/m^2': areal_charge_density_conversion,
+                                   'C/m': linear_charge_density_conversion,
+                                   '1/m^2': areal_number_density_conversion,
+                                   '1/m': linear_number_density_conversion,
                                    'V/m': efield_conversion,
                                    'T': bfield_conversion,
                                    'V/m^2': efieldgradient_conversion,
                                    'T/m': bfieldgradient_conversion,
                                    'm_e*c': momentum_conversion,
                                    'W/m^2': intensity_conversion,
-                                   'V': potential_conversion}
+                                   'V': potential_conversion,
+                                   'J': energy_conversion,
+                                   # Dimensionless quantities.
+                                   '': {}}
 
         self.si_units = list(self.conversion_factors.keys())
+        self._conversion_plans = {}
+
+    def get_conversion_plan(self, data_units, target_units, metadata=None):
+        """
+        Get the factor which converts data from its original units to the
+        target units in a single multiplication.
+
+        Plans are resolved once and cached, so that the unit lookups (and,
+        for some codes, the calculation of the cell volume) are not repeated
+        on each conversion.
+
+        Parameters
+        ----------
+
+        data_units : str
+            Original units of the data.
+
+        target_units : str
+            Target units. Can be 'SI' or any of the units supported by
+            `convert_data`. If None, no conversion is performed.
+
+        metadata : dict
+            (Optional) Metadata of the data. Only needed by conversions
+            which depend on the simulation grid.
+
+        Returns
+        -------
+        A tuple with the conversion factor and the resulting units.
+        """
+        if target_units is None:
+            return 1., data_units
+        key = (data_units, target_units,
+               self._get_metadata_key(data_units, metadata))
+        plan = self._conversion_plans.get(key)
+        if plan is None:
+            factor = 1.
+            units = data_units
+            if units not in self.si_units:
+                factor, units = self.get_si_conversion_factor(
+                    units, metadata)
+            if target_units != 'SI' and target_units not in self.si_units:
+                factor = factor * self.get_conversion_factor(
+                    units, target_units)
+                units = target_units
+            plan = (factor, units)
+            self._conversion_plans[key] = plan
+        return plan
+
+    def apply_conversion(self, data, factor, in_place=False):
+        """
+        Multiply data by a conversion factor.
+
+        Parameters
+        ----------
+
+        data : ndarray or float
+            The data to convert.
+
+        factor : float
+            The conversion factor.
+
+        in_place : bool
+            Whether the data can be modified in place. This is only done if
+            `data` is a writeable array of floating point type.
+
+        Returns
+        -------
+        The converted data.
+        """
+        if factor == 1.:
+            return data
+        if (in_place and isinstance(data, np.ndarray) and
+                data.flags.writeable and
+                np.issubdtype(data.dtype, np.floating)):
+            data *= factor
+            return data
+        return data * factor
 
     def convert_field_units(self, field_data, field_md,
                             target_field_units=None, target_axes_units=None,
-                            axes_to_convert=None, target_time_units=None):
+                            axes_to_convert=None, target_time_units=None,
+                            in_place=False):
         convert_field = target_field_units is not None
         # Dimmensionless fields will not be converted.
         if convert_field and field_md['field']['units'] == '':
@@ -115,88 +233,59 @@ class UnitConverter():
                 raise ValueError("Length of 'target_axes_units' and "
                                  "'axes_to_convert' do not match")
 
-        # convert to SI units the desired data (field and/or axis and/or time)
-        if convert_field or convert_axes or convert_time:
-            field_data, field_md = self.convert_field_to_si_units(
-                field_data, field_md, convert_field, convert_axes,
-                axes_to_convert, convert_time)
-
         # convert field data to desired units
-        if convert_field and (target_field_units != 'SI' and
-                              target_field_units not in self.si_units):
-            field_units = field_md['field']['units']
-            field_data = self.convert_data(field_data, field_units,
-                                           target_field_units)
-            field_md['field']['units'] = target_field_units
+        if convert_field:
+            factor, units = self.get_conversion_plan(
+                field_md['field']['units'], target_field_units, field_md)
+            field_data = self.apply_conversion(field_data, factor, in_place)
+            field_md['field']['units'] = units
 
         # convert axes data to desired units
         if convert_axes:
             for axis, target_units in zip(axes_to_convert, target_axes_units):
-                if target_units != 'SI' and target_units not in self.si_units:
-                    axis_md = field_md['axis'][axis]
-                    axis_units = axis_md['units']
-                    for data in ['array', 'spacing', 'min', 'max']:
-                        if data in axis_md:
-                            axis_md[data] = self.convert_data(
-                                axis_md[data], axis_units, target_units)
-                    axis_md['units'] = target_units
+                axis_md = field_md['axis'][axis]
+                factor, units = self.get_conversion_plan(
+                    axis_md['units'], target_units, field_md)
+                for data in ['array', 'spacing', 'min', 'max']:
+                    if data in axis_md:
+                        axis_md[data] = self.apply_conversion(
+                            axis_md[data], factor)
+                axis_md['units'] = units
 
         # convert time data to desired units
-        if convert_time and (target_time_units != 'SI' and
-                             target_time_units not in self.si_units):
-            time_units = field_md['time']['units']
-            time_value = field_md['time']['value']
-            time_value = self.convert_data(time_value, time_units,
-                                           target_time_units)
-            field_md['time']['value'] = time_value
-            field_md['time']['units'] = target_time_units
+        if convert_time:
+            self._convert_time_units(field_md, target_time_units)
 
         return field_data, field_md
 
     def convert_particle_data_units(self, data_dict, target_data_units=None,
-                                    target_time_units=None):
+                                    target_time_units=None, in_place=False):
         for var_name, var_items in data_dict.items():
             var_data, var_md = var_items
             # Convert data units
             if target_data_units is not None:
                 var_target_units = target_data_units[var_name]
                 if var_target_units is not None:
-                    var_units = var_md['units']
-                    # convert to SI
-                    if var_units not in self.si_units:
-                        var_data, var_units = self.convert_data_to_si(
-                            var_data, var_units, var_md)
-                        var_md['units'] = var_units
-                    # convert to desired units
-                    if (var_target_units != 'SI' and
-                            var_target_units not in self.si_units):
-                        var_data = self.convert_data(var_data, var_units,
-                                                     var_target_units)
-                        var_md['units'] = var_target_units
+                    factor, units = self.get_conversion_plan(
+                        var_md['units'], var_target_units, var_md)
+                    var_data = self.apply_conversion(
+                        var_data, factor, in_place)
+                    var_md['units'] = units
                     data_dict[var_name] = (var_data, var_md)
             # Convert time units
             if target_time_units is not None:
-                time_units = var_md['time']['units']
-                time_value = var_md['time']['value']
-                # Convert to SI
-                if time_units not in self.si_units:
-                    time_value, time_units = self.convert_data_to_si(
-                        time_value, time_units)
-                    var_md['time']['units'] = time_units
-                # convert to desired units
-                if (target_time_units != 'SI' and
-                        target_time_units not in self.si_units):
-                    time_value = self.convert_data(time_value, time_units,
-                                                   target_time_units)
-                    var_md['time']['units'] = target_time_units
-                var_md['time']['value'] = time_value
+                self._convert_time_units(var_md, target_time_units)
         return data_dict
 
     def convert_data(self, data, si_units, target_units):
+        conv_factor = self.get_conversion_factor(si_units, target_units)
+        return data * conv_factor
+
+    def get_conversion_factor(self, si_units, target_units):
+        """ Get the factor converting from SI units to the target units. """
         possible_units = self.get_possible_unit_conversions(si_units)
         if target_units in possible_units:
-            conv_factor = self.conversion_factors[si_units][target_units]
-            return data * conv_factor
+            return self.conversion_factors[si_units][target_units]
         else:
             error_str = ('Not possible to convert {} to {}.'
                          ' Possible units are {}').format(
@@ -204,49 +293,53 @@ class UnitConverter():
             raise ValueError(error_str)
 
     def get_possible_unit_conversions(self, si_units):
+        if si_units not in self.conversion_factors:
+            raise ValueError(
+                'Conversion of {} to other units is not supported.'.format(
+                    si_units))
         return [*self.conversion_factors[si_units].keys()]
 
     def convert_field_to_si_units(self, field_data, field_md,
                                   convert_field=True, convert_axes=True,
                                   axes_to_convert=[], convert_time=True):
-        if convert_field:
-            field_units = field_md['field']['units']
-            if field_units not in self.si_units:
-                field_data, field_units = self.convert_data_to_si(
-                    field_data, field_units, field_md)
-                field_md['field']['units'] = field_units
+        target_axes_units = None
+        if convert_axes and len(axes_to_convert) > 0:
+            target_axes_units = 'SI'
+        return self.convert_field_units(
+            field_data, field_md,
+            target_field_units='SI' if convert_field else None,
+            target_axes_units=target_axes_units,
+            axes_to_convert=axes_to_convert,
+            target_time_units='SI' if convert_time else None)
 
-        if convert_axes:
-            for axis in axes_to_convert:
-                axis_md = field_md['axis'][axis]
-                axis_units = axis_md['units']
-                if axis_units not in self.si_units:
-                    for data in ['array', 'spacing', 'min', 'max']:
-                        if data in axis_md:
-                            axis_md[data], new_units = self.convert_data_to_si(
-                                axis_md[data], axis_units, field_md)
-                    field_md['axis'][axis]['units'] = new_units
+    def convert_data_to_si(self, data, data_units, metadata=None):
+        factor, si_units = self.get_si_conversion_factor(data_units, metadata)
+        return data * factor, si_units
 
-        if convert_time:
-            time_units = field_md['time']['units']
-            time_value = field_md['time']['value']
-            if time_units not in self.si_units:
-                time_value, time_units = self.convert_data_to_si(
-                    time_value, time_units, field_md)
-                field_md['time']['value'] = time_value
-                field_md['time']['units'] = time_units
+    def get_si_conversion_factor(self, data_units, metadata=None):
+        # Has to be implemented for each simulation. Returns the factor
+        # converting data_units to SI and the SI units.
+        raise NotImplementedError
 
-        return field_data, field_md
+    def _get_metadata_key(self, data_units, metadata):
+        """
+        Get the part of the metadata that determines the conversion of
+        data_units, if any. Used to identify cached conversion plans.
+        """
+        return None
 
-    def convert_data_to_si(self, data, data_units, metadata=None):
-        # Has to be implemented for each simulation. Returs data and
-        # data_units in SI.
-        raise NotImplementedError
+    def _convert_time_units(self, md, target_time_units):
+        """ Convert the time value in a metadata dictionary. """
+        factor, units = self.get_conversion_plan(
+            md['time']['units'], target_time_units, md)
+        md['time']['value'] = self.apply_conversion(md['time']['value'],
+                                                    factor)
+        md['time']['units'] = units
 
 
 class OpenPMDUnitConverter(UnitConverter):
-    def convert_data_to_si(self, data, data_units, metadata=None):
-        return data, data_units
+    def get_si_conversion_factor(self, data_units, metadata=None):
+        return 1., data_units
 
 
 class OsirisUnitConverter(UnitConverter):
@@ -268,25 +361,27 @@ class OsirisUnitConverter(UnitConverter):
             self.osiris_unit_conversion = None
         super().__init__()
 
-    def convert_data_to_si(self, data, data_units, metadata=None):
+    def get_si_conversion_factor(self, data_units, metadata=None):
         if self.osiris_unit_conversion is not None:
             if data_units in self.osiris_unit_conversion:
                 conv_factor, si_units = self.osiris_unit_conversion[data_units]
             elif data_units == 'e':
-                n_cells = metadata['grid']['resolution']
-                sim_size = metadata['grid']['size']
-                cell_vol = np.prod(sim_size/n_cells)
-                s_d = ge.plasma_skin_depth(self.plasma_density*1e-6)
-                conv_factor = cell_vol * self.plasma_density * s_d**3 * ct.e
+                conv_factor = _get_cell_charge_factor(
+                    metadata, self.plasma_density)
                 si_units = 'C'
             else:
                 raise ValueError('Unsupported units: {}.'.format(data_units))
-            return data*conv_factor, si_units
+            return conv_factor, si_units
 
         else:
             raise ValueError('Could not perform unit conversion.'
                              ' Plasma density value not provided.')
 
+    def _get_metadata_key(self, data_units, metadata):
+        if data_units == 'e':
+            return _get_grid_key(metadata)
+        return None
+
 
 class HiPACEUnitConverter(UnitConverter):
     def __init__(self, plasma_density=None):
@@ -306,21 +401,41 @@ class HiPACEUnitConverter(UnitConverter):
             self.hipace_unit_conversion = None
         super().__init__()
 
-    def convert_data_to_si(self, data, data_units, metadata=None):
+    def get_si_conversion_factor(self, data_units, metadata=None):
         if self.hipace_unit_conversion is not None:
             if data_units in self.hipace_unit_conversion:
                 conv_factor, si_units = self.hipace_unit_conversion[data_units]
             elif data_units == 'qnorm':
-                n_cells = metadata['grid']['resolution']
-                sim_size = metadata['grid']['size']
-                cell_vol = np.prod(sim_size/n_cells)
-                s_d = ge.plasma_skin_depth(self.plasma_density*1e-6)
-                conv_factor = cell_vol * self.plasma_density * s_d**3 * ct.e
+                conv_factor = _get_cell_charge_factor(
+                    metadata, self.plasma_density)
                 si_units = 'C'
             else:
                 raise ValueError('Unsupported units: {}.'.format(data_units))
-            return data*conv_factor, si_units
+            return conv_factor, si_units
 
         else:
             raise ValueError('Could not perform unit conversion.'
                              ' Plasma density value not provided.')
+
+    def _get_metadata_key(self, data_units, metadata):
+        if data_units == 'qnorm':
+            return _get_grid_key(metadata)
+        return None
+
+
+def _get_cell_charge_factor(metadata, plasma_density):
+    """
+    Get the factor converting a charge in normalized units (as in Osiris
+    and HiPACE) to Coulomb, which depends on the cell volume.
+    """
+    n_cells = metadata['grid']['resolution']
+    sim_size = metadata['grid']['size']
+    cell_vol = np.prod(sim_size/n_cells)
+    s_d = ge.plasma_skin_depth(plasma_density*1e-6)
+    return cell_vol * plasma_density * s_d**3 * ct.e
+
+
+def _get_grid_key(metadata):
+    """ Get a hashable identifier of the grid in a metadata dictionary. """
+    return (tuple(np.atleast_1d(metadata['grid']['resolution'])),
+            tuple(np.atleast_1d(metadata['grid']['size'])))
@@ -8,6 +8,7 @@ License: GNU GPL-3.0.
 """
 
 import os
+from contextlib import nullcontext
 
 from h5py import File as H5F
 import numpy as np
@@ -50,6 +51,137 @@ class FieldReader():
                                 max_resolution_3d)
         return fld, fld_metadata
 
+    def read_fields(
+            self, file_path, iteration, field_paths, slice_i=0.5,
+            slice_j=0.5, slice_dir_i=None, slice_dir_j=None, m='all',
+            theta=0, max_resolution_3d=None):
+        """
+        Read several fields stored in the same file, which is kept open
+        while all of them are read.
+
+        Parameters
+        ----------
+
+        file_path : str
+            Path to the file containing the fields.
+
+        iteration : int
+            Iteration of the fields.
+
+        field_paths : list
+            Paths of the fields inside the file.
+
+        slice_i, slice_j, slice_dir_i, slice_dir_j, m, theta,
+        max_resolution_3d : optional
+            Same as in `read_field`. They are applied to all fields.
+
+        Returns
+        -------
+        A list with a tuple (data, metadata) for each field, as returned by
+        `read_field`.
+        """
+        with self._open_file(file_path, iteration):
+            return [self.read_field(file_path, iteration, field_path,
+                                    slice_i, slice_j, slice_dir_i,
+                                    slice_dir_j, m, theta, max_resolution_3d)
+                    for field_path in field_paths]
+
+    def read_field_chunk(self, file_path, iteration, field_path, chunk,
+                         m='all', theta=0):
+        """
+        Read a hyperslab of a field without loading the rest of the data.
+
+        Parameters
+        ----------
+
+        file_path : str
+            Path to the file containing the field.
+
+        iteration : int
+            Iteration of the field.
+
+        field_path : str
+            Path of the field inside the file.
+
+        chunk : tuple of slices
+            The region to read, with one slice per field axis in the same
+            order as in the arrays returned by `read_field`
+            (alphabetically, i.e., ['x', 'y', 'z'] or ['r', 'z']).
+
+        m : int or str
+            Azimuthal mode (only for thetaMode fields).
+
+        theta : float
+            Angle of the observation plane (only for thetaMode fields).
+            3D reconstructions (theta=None) are not supported.
+
+        Returns
+        -------
+        An array with the data of the chunk, in the same units as the
+        data returned by `read_field`.
+        """
+        return self._read_field_chunk(file_path, iteration, field_path,
+                                      tuple(chunk), m, theta)
+
+    def read_field_polar(self, file_path, iteration, field_path,
+                         n_theta=None, m='all', max_resolution_3d=None):
+        """
+        Sample a thetaMode field on its native polar grid, i.e., at several
+        equally-spaced angles on the (r, z) grid, without reconstructing it
+        in 3D.
+
+        Parameters
+        ----------
+
+        file_path : str
+            Path to the file containing the field.
+
+        iteration : int
+            Iteration of the field.
+
+        field_path : str
+            Path of the field inside the file.
+
+        n_theta : int
+            (Optional) Number of angles.
+
+        m : int or str
+            Azimuthal mode.
+
+        max_resolution_3d : list
+            Maximum longitudinal and transverse resolution of the 3D
+            reconstruction, as in `read_field`.
+
+        Returns
+        -------
+        An array (theta, r, z) with the field, in the same units as the
+        data returned by `read_field`.
+        """
+        return self._read_field_polar(file_path, iteration, field_path,
+                                      n_theta, m, max_resolution_3d)
+
+    def get_source_files(self, file_path, iteration):
+        """
+        Get the paths of the data files from which a field is read at a
+        given iteration.
+
+        Parameters
+        ----------
+
+        file_path : str
+            Path to the field file (if any).
+
+        iteration : int
+            Iteration of the field data.
+
+        Returns
+        -------
+        A list of file paths.
+        """
+        if file_path is None:
+            return []
+        return [file_path]
+
     def _readjust_metadata(self, field_metadata, slice_dir_i, slice_dir_j,
                            theta, max_resolution_3d):
         geom = field_metadata['field']['geometry']
@@ -120,56 +252,73 @@ class FieldReader():
             slice_i=0.5, slice_dir_i=None, max_resolution_3d=None):
         raise NotImplementedError
 
+    def _read_field_chunk(self, file_path, iteration, field_path, chunk,
+                          m='all', theta=0):
+        raise NotImplementedError
+
+    def _read_field_polar(self, file_path, iteration, field_path, n_theta,
+                          m, max_resolution_3d):
+        raise NotImplementedError
+
     def _read_field_metadata(self, file_path, iteration, field_path):
         raise NotImplementedError
 
+    def _open_file(self, file_path, iteration):
+        """
+        Context manager which keeps a data file open while several fields
+        are read from it. The readers which open the file in each read do
+        not need it.
+        """
+        return nullcontext()
+
 
 class OsirisFieldReader(FieldReader):
     def __init__(self, *args, **kwargs):
         return super().__init__(*args, **kwargs)
 
     def _read_field_1d(self, file_path, iteration, field_path, field_md):
-        file = H5F(file_path, 'r')
-        return file[field_path]
+        with H5F(file_path, 'r') as file:
+            return file[field_path][()]
 
     def _read_field_2d_cart(
             self, file_path, iteration, field_path, field_md, slice_i=0.5,
             slice_dir_i=None):
-        file = H5F(file_path, 'r')
-        fld = file[field_path]
-        if slice_dir_i is not None:
-            fld_shape = fld.shape
-            axis_order = ['z', 'x']
+        with H5F(file_path, 'r') as file:
+            fld = file[field_path]
             slice_list = [slice(None)] * fld.ndim
-            axis_idx_i = axis_order.index(slice_dir_i)
-            axis_elements_i = fld_shape[axis_idx_i]
-            slice_idx_i = int(round(axis_elements_i * slice_i))
-            slice_list[axis_idx_i] = slice_idx_i
-            fld = fld[tuple(slice_list)]
-        return fld
+            if slice_dir_i is not None:
+                fld_shape = fld.shape
+                axis_order = ['z', 'x']
+                axis_idx_i = axis_order.index(slice_dir_i)
+                axis_elements_i = fld_shape[axis_idx_i]
+                slice_idx_i = int(round(axis_elements_i * slice_i))
+                slice_list[axis_idx_i] = slice_idx_i
+            return fld[tuple(slice_list)]
 
     def _read_field_3d_cart(
             self, file_path, iteration, field_path, field_md, slice_i=0.5,
             slice_j=0.5, slice_dir_i=None, slice_dir_j=None):
-        file = H5F(file_path, 'r')
-        fld = file[field_path]
-        if slice_dir_i is not None:
-            fld_shape = fld.shape
-            axis_order = ['x', 'y', 'z']
+        with H5F(file_path, 'r') as file:
+            fld = file[field_path]
             slice_list = [slice(None)] * fld.ndim
-            axis_idx_i = axis_order.index(slice_dir_i)
-            axis_elements_i = fld_shape[axis_idx_i]
-            slice_idx_i = int(round(axis_elements_i * slice_i))
-            slice_list[axis_idx_i] = slice_idx_i
-            if slice_dir_j is not None:
-                axis_idx_j = axis_order.index(slice_dir_j)
-                axis_elements_j = fld_shape[axis_idx_j]
-                slice_idx_j = int(round(axis_elements_j * slice_j))
-                slice_list[axis_idx_j] = slice_idx_j
-            fld = fld[tuple(slice_list)]
-        else:
-            fld = fld[:]
-        return fld
+            if slice_dir_i is not None:
+                fld_shape = fld.shape
+                axis_order = ['x', 'y', 'z']
+                axis_idx_i = axis_order.index(slice_dir_i)
+                axis_elements_i = fld_shape[axis_idx_i]
+                slice_idx_i = int(round(axis_elements_i * slice_i))
+                slice_list[axis_idx_i] = slice_idx_i
+                if slice_dir_j is not None:
+                    axis_idx_j = axis_order.index(slice_dir_j)
+                    axis_elements_j = fld_shape[axis_idx_j]
+                    slice_idx_j = int(round(axis_elements_j * slice_j))
+                    slice_list[axis_idx_j] = slice_idx_j
+            return fld[tuple(slice_list)]
+
+    def _read_field_chunk(self, file_path, iteration, field_path, chunk,
+                          m='all', theta=0):
+        with H5F(file_path, 'r') as file:
+            return file[field_path][chunk]
 
     def _read_field_metadata(self, file_path, iteration, field_path):
         file = H5F(file_path, 'r')
@@ -267,8 +416,8 @@ class HiPACEFieldReader(FieldReader):
     def _read_field_3d_cart(
             self, file_path, iteration, field_path, field_md, slice_i=0.5,
             slice_j=0.5, slice_dir_i=None, slice_dir_j=None):
-        file = H5F(file_path, 'r')
-        fld = file[field_path]
+        with H5F(file_path, 'r') as file:
+            fld = file[field_path][()]
         fld = np.moveaxis(fld, 0, 2)
         if slice_dir_i is not None:
             fld_shape = fld.shape
@@ -286,6 +435,14 @@ class HiPACEFieldReader(FieldReader):
             fld = fld[tuple(slice_list)]
         return fld
 
+    def _read_field_chunk(self, file_path, iteration, field_path, chunk,
+                          m='all', theta=0):
+        # Data is stored with the axis order ['z', 'x', 'y'].
+        chunk_x, chunk_y, chunk_z = chunk
+        with H5F(file_path, 'r') as file:
+            fld = file[field_path][chunk_z, chunk_x, chunk_y]
+        return np.moveaxis(fld, 0, 2)
+
     def _read_field_metadata(self, file_path, iteration, field_path):
         file = H5F(file_path, 'r')
         md = {}
@@ -349,6 +506,16 @@ class OpenPMDFieldReader(FieldReader):
         self._opmd_reader = opmd_reader
         return super().__init__(*args, **kwargs)
 
+    def get_source_files(self, file_path, iteration):
+        return self._opmd_reader.get_iteration_files(iteration)
+
+    def _open_file(self, file_path, iteration):
+        # openPMD-viewer opens the file of the iteration in each read. While
+        # it is already open, HDF5 reuses it instead of opening it again.
+        if self._opmd_reader.backend == 'h5py':
+            return H5F(self._opmd_reader.iteration_to_file[iteration], 'r')
+        return nullcontext()
+
     def _read_field_1d(self, file_path, iteration, field_path, field_md):
         field, *comp = field_path.split('/')
         if len(comp) > 0:
@@ -442,10 +609,10 @@ class OpenPMDFieldReader(FieldReader):
             comp = None
         if comp in ['x', 'y']:
             fld_r, info = self._opmd_reader.read_field_circ(
-                iteration, field, '/r', None, None, m, theta,
+                iteration, field, 'r', None, None, m, theta,
                 max_resolution_3d)
             fld_t, *_ = self._opmd_reader.read_field_circ(
-                iteration, field, '/t', None, None, m, theta,
+                iteration, field, 't', None, None, m, theta,
                 max_resolution_3d)
             if theta is None:
                 # This reconstruction leads to problems on axis
@@ -484,6 +651,43 @@ class OpenPMDFieldReader(FieldReader):
             fld = fld[tuple(slice_list)]
         return fld
 
+    def _read_field_chunk(self, file_path, iteration, field_path, chunk,
+                          m='all', theta=0):
+        field, *comp = field_path.split('/')
+        if len(comp) > 0:
+            comp = comp[0]
+        else:
+            comp = None
+        _, params = self._opmd_reader.read_openPMD_params(iteration)
+        field_md = params['fields_metadata'][field]
+        if field_md['geometry'] == 'thetaMode':
+            if theta is None:
+                raise NotImplementedError(
+                    'Chunk reading not supported for 3D reconstructions '
+                    'of thetaMode fields.')
+            return self._opmd_reader.read_circ_field_chunk(
+                iteration, field, comp, chunk, m, theta)
+        # Reorder the chunk slices to match the axis order in the file.
+        axis_labels = field_md['axis_labels']
+        sorted_labels = sorted(axis_labels)
+        file_chunk = tuple(
+            chunk[sorted_labels.index(label)] for label in axis_labels)
+        fld = self._opmd_reader.read_field_chunk(
+            iteration, field, comp, file_chunk)
+        # Make sure the array indices are ordered alphabetically.
+        axes_sort = np.argsort(np.array(axis_labels))
+        return np.moveaxis(fld, axes_sort, np.arange(fld.ndim))
+
+    def _read_field_polar(self, file_path, iteration, field_path, n_theta,
+                          m, max_resolution_3d):
+        field, *comp = field_path.split('/')
+        if len(comp) > 0:
+            comp = comp[0]
+        else:
+            comp = None
+        return self._opmd_reader.read_circ_field_polar(
+            iteration, field, comp, n_theta, m, max_resolution_3d)
+
     def _read_field_metadata(self, file_path, iteration, field_path):
         # Get name of field and component.
         field, *comp = field_path.split('/')
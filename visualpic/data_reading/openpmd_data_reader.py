@@ -7,7 +7,13 @@ Some of the methods below include code from openPMD-viewer (see at
 https://github.com/openPMD/openPMD-viewer).
 """
 
+import os
+import re
+import threading
+
 import h5py
+import numpy as np
+from scipy import constants
 from openpmd_viewer.openpmd_timeseries.data_reader import DataReader
 from openpmd_viewer.openpmd_timeseries.data_reader.h5py_reader import (
     field_reader as fr)
@@ -24,13 +30,249 @@ class OpenPMDDataReader(DataReader):
 
     This class is derived from the original openPMD `DataReader` to extend its
     functionality and provide a method which returns only the field metadata.
+
+    Since the openPMD-api series is not thread safe, all data access is
+    serialized with a lock so that the reader can be shared among threads.
+    Concurrent reads of different iterations would not run in parallel
+    anyway with the h5py backend, since h5py has its own global lock.
     """
 
     def __init__(self, backend):
         """ Initialize class. """
         super().__init__(backend)
+        self._lock = threading.RLock()
+        self._series_files = None
+
+    def list_iterations(self, path_to_dir):
+        with self._lock:
+            self.path_to_dir = path_to_dir
+            self._series_files = None
+            return super().list_iterations(path_to_dir)
+
+    def get_iteration_files(self, iteration):
+        """
+        Get the paths of the files containing the data of an iteration.
+
+        With the openpmd-api backend, all files of the series are returned
+        if the file of the iteration cannot be identified (e.g., for
+        group-based series).
+        """
+        if self.backend == 'h5py':
+            return [self.iteration_to_file[iteration]]
+        if os.path.isfile(self.path_to_dir):
+            return [self.path_to_dir]
+        files = self._get_series_files()
+        if iteration in files:
+            return files[iteration]
+        return [f for it_files in files.values() for f in it_files]
+
+    def _get_series_files(self):
+        """
+        Get a dictionary relating each iteration to the paths of its files
+        in the folder of the series, which is listed only once after
+        `list_iterations`.
+        """
+        with self._lock:
+            if self._series_files is None:
+                self._series_files = {}
+                for file_name in sorted(os.listdir(self.path_to_dir)):
+                    match = re.search(r'(\d+)(\.(?!\d).+$)', file_name)
+                    if match is not None:
+                        self._series_files.setdefault(
+                            int(match.group(1)), []).append(
+                                os.path.join(self.path_to_dir, file_name))
+            return self._series_files
+
+    def read_openPMD_params(self, *args, **kwargs):
+        with self._lock:
+            return super().read_openPMD_params(*args, **kwargs)
+
+    def read_field_cartesian(self, *args, **kwargs):
+        with self._lock:
+            return super().read_field_cartesian(*args, **kwargs)
+
+    def read_field_circ(self, *args, **kwargs):
+        with self._lock:
+            return super().read_field_circ(*args, **kwargs)
+
+    def read_species_data(self, *args, **kwargs):
+        with self._lock:
+            return super().read_species_data(*args, **kwargs)
+
+    def get_grid_parameters(self, *args, **kwargs):
+        with self._lock:
+            return super().get_grid_parameters(*args, **kwargs)
+
+    def read_species_chunk(self, iteration, species, record_comp, extensions,
+                           start, stop):
+        """ Read a range of particles of a species (see
+        `_read_species_chunk`). """
+        with self._lock:
+            return self._read_species_chunk(
+                iteration, species, record_comp, extensions, start, stop)
+
+    def get_species_size(self, iteration, species, record_comp):
+        """ Get the number of particles of a species. """
+        with self._lock:
+            if self.backend == 'h5py':
+                filename = self.iteration_to_file[iteration]
+                with h5py.File(filename, 'r') as dfile:
+                    species_grp = get_species_group_h5py(
+                        dfile, iteration, species)
+                    record = species_grp[get_species_record_path(
+                        record_comp)]
+                    return int(fr.get_shape(record)[0])
+            elif self.backend == 'openpmd-api':
+                species_io = self.series.iterations[iteration].particles[
+                    species]
+                component = get_species_component_io(
+                    species_io, get_species_record_path(record_comp))
+                return int(component.shape[0])
 
     def read_field_metadata(self, iteration, field_name, component_name):
+        """ Read the field metadata (see `_read_field_metadata`). """
+        with self._lock:
+            return self._read_field_metadata(
+                iteration, field_name, component_name)
+
+    def read_field_chunk(self, iteration, field_name, component_name,
+                         chunk):
+        """ Read a hyperslab of a field (see `_read_field_chunk`). """
+        with self._lock:
+            return self._read_field_chunk(
+                iteration, field_name, component_name, chunk)
+
+    def read_circ_field_chunk(self, iteration, field_name, component_name,
+                              chunk, m='all', theta=0.):
+        """
+        Read a region of a thetaMode field in the plane given by `theta`.
+
+        Only the azimuthal modes in the radial and longitudinal range of the
+        region are read from disk, and then combined as in
+        `read_field_circ`.
+
+        Parameters:
+        -----------
+        iteration : int
+            The iteration at which the data should be read.
+        field_name : str
+            Name of the field (e.g., `'E'`, `'B'`, `'rho'`, etc.).
+        component_name : str
+            Name of the field component (e.g., `'r'`, `'x'`, `'t'`, etc.)
+        chunk : tuple of slices
+            The region to read, given as a slice along r and a slice along
+            z. The r slice refers to the symmetric radial grid (of 2*Nr
+            points, with the values below the axis first) of the arrays
+            returned by `read_field_circ`.
+        m : int or str
+            The azimuthal mode to read, or 'all' for the sum of all modes.
+        theta : float
+            Angle of the plane of observation with respect to the x axis.
+
+        Returns:
+        --------
+        A 2D array (r, z) with the data of the region in SI units.
+        """
+        with self._lock:
+            if component_name in ['x', 'y']:
+                fld_r, below_axis = self._read_circ_field_chunk(
+                    iteration, field_name, 'r', chunk, m, theta)
+                fld_t, _ = self._read_circ_field_chunk(
+                    iteration, field_name, 't', chunk, m, theta)
+                if component_name == 'x':
+                    fld = np.cos(theta) * fld_r - np.sin(theta) * fld_t
+                else:
+                    fld = np.sin(theta) * fld_r + np.cos(theta) * fld_t
+                # Revert the sign below the axis
+                fld[below_axis] *= -1
+            else:
+                fld, _ = self._read_circ_field_chunk(
+                    iteration, field_name, component_name, chunk, m, theta)
+            return fld
+
+    def read_circ_field_polar(self, iteration, field_name, component_name,
+                              n_theta=None, m='all', max_resolution_3d=None):
+        """
+        Sample a thetaMode field on a regular polar grid.
+
+        Instead of reconstructing the field on a 3D Cartesian grid, the
+        azimuthal modes are evaluated at `n_theta` equally-spaced angles
+        on the native (r, z) grid.
+
+        Parameters:
+        -----------
+        iteration : int
+            The iteration at which the data should be read.
+        field_name : str
+            Name of the field (e.g., `'E'`, `'B'`, `'rho'`, etc.).
+        component_name : str
+            Name of the field component (e.g., `'r'`, `'x'`, `'t'`, etc.)
+        n_theta : int
+            Number of angles. By default, 4*M+1 for a field with M azimuthal
+            modes, which represents exactly any quadratic quantity of the
+            field (e.g., the intensity).
+        m : int or str
+            The azimuthal mode to read, or 'all' for the sum of all modes.
+        max_resolution_3d : list of int or None
+            Maximum longitudinal and transverse resolution of the 3D
+            reconstruction, as in `read_field_circ`. The polar grid is
+            reduced accordingly.
+
+        Returns:
+        --------
+        A 3D array (theta, r, z) with the data in SI units, where the angles
+        are theta_j = 2*pi*j/n_theta and r >= 0.
+        """
+        with self._lock:
+            if component_name in ['x', 'y']:
+                components = ['r', 't']
+            else:
+                components = [component_name]
+            if n_theta is None:
+                n_modes = self._get_field_shape(
+                    iteration, field_name, components[0])[0]
+                n_theta = 2 * n_modes - 1
+            samples = []
+            for component in components:
+                modes = self._read_circ_field_modes(
+                    iteration, field_name, component, max_resolution_3d)
+                samples.append(sample_modes_on_polar_grid(modes, n_theta, m))
+            if component_name in ['x', 'y']:
+                theta = get_polar_angles(n_theta)[:, np.newaxis, np.newaxis]
+                fld_r, fld_t = samples
+                if component_name == 'x':
+                    return np.cos(theta) * fld_r - np.sin(theta) * fld_t
+                return np.sin(theta) * fld_r + np.cos(theta) * fld_t
+            return samples[0]
+
+    def _read_circ_field_modes(self, iteration, field_name, component_name,
+                               max_resolution_3d=None):
+        """
+        Read the azimuthal modes of a thetaMode field as an array of shape
+        (modes, r, z), reducing the resolution as in `read_field_circ`.
+        """
+        _, params = self.read_openPMD_params(iteration)
+        axis_labels = params['fields_metadata'][field_name]['axis_labels']
+        r_first = axis_labels[0] == 'r'
+        shape = self._get_field_shape(iteration, field_name, component_name)
+        if r_first:
+            n_r, n_z = shape[1:]
+        else:
+            n_z, n_r = shape[1:]
+        step_r, step_z = get_circ_resolution_steps(
+            n_r, n_z, max_resolution_3d)
+        r_slice = slice(None, None, step_r)
+        z_slice = slice(None, None, step_z)
+        if r_first:
+            return self._read_field_chunk(
+                iteration, field_name, component_name,
+                (slice(None), r_slice, z_slice))
+        modes = self._read_field_chunk(
+            iteration, field_name, component_name,
+            (slice(None), z_slice, r_slice))
+        return np.swapaxes(modes, 1, 2)
+
+    def _read_field_metadata(self, iteration, field_name, component_name):
         """
         Read the field metadata.
 
@@ -69,6 +311,10 @@ class OpenPMDDataReader(DataReader):
 
         # Axis metadata.
         md['axis'] = {}
+        if field_geometry == 'thetaMode' and component_name in ['x', 'y']:
+            # Cartesian components are computed from the 'r' and 't'
+            # components, which share the same grid.
+            component_name = 'r'
         info = self.get_field_meta_info(
             iteration, field_name, component_name, axis_labels, field_geometry,
             t)
@@ -82,6 +328,215 @@ class OpenPMDDataReader(DataReader):
 
         return md
 
+    def _read_field_chunk(self, iteration, field_name, component_name,
+                          chunk):
+        """
+        Read a hyperslab of a field without loading the whole dataset.
+
+        Parameters:
+        -----------
+        iteration : int
+            The iteration at which the data should be read.
+        field_name : str
+            Name of the field (e.g., `'E'`, `'B'`, `'rho'`, etc.).
+        component_name : str
+            Name of the field component (e.g., `'r'`, `'x'`, `'t'`, etc.)
+        chunk : tuple of slices
+            The region to read, with one slice per dimension in the order in
+            which the data is stored in the file.
+
+        Returns:
+        --------
+        An array with the data of the chunk in SI units.
+        """
+        if self.backend == 'h5py':
+            filename = self.iteration_to_file[iteration]
+            if component_name is None:
+                field_path = field_name
+            else:
+                field_path = fr.join_infile_path(field_name, component_name)
+            with h5py.File(filename, 'r') as dfile:
+                group, dset = fr.find_dataset(dfile, iteration, field_path)
+                shape = fr.get_shape(dset)
+                offset, extent, steps = get_chunk_limits(chunk, shape)
+                unit_si = dset.attrs['unitSI']
+                if isinstance(dset, h5py.Group):
+                    # Constant dataset.
+                    data = np.full(extent, dset.attrs['value'])
+                else:
+                    data = dset[tuple(
+                        slice(o, o + e) for o, e in zip(offset, extent))]
+        elif self.backend == 'openpmd-api':
+            it = self.series.iterations[iteration]
+            field = it.meshes[field_name]
+            if field.scalar:
+                component = next(field.items())[1]
+            else:
+                component = field[component_name]
+            offset, extent, steps = get_chunk_limits(chunk, component.shape)
+            data = component.load_chunk(offset, extent)
+            self.series.flush()
+            unit_si = component.unit_SI
+        data = data[tuple(slice(None, None, step) for step in steps)]
+        if unit_si != 1.0:
+            data = data * unit_si
+        return data
+
+    def _read_species_chunk(self, iteration, species, record_comp,
+                            extensions, start, stop):
+        """
+        Read a range of particles of a species record component without
+        loading the whole dataset. As in `read_species_data`, positions
+        include the position offset and momenta are normalized.
+
+        Parameters:
+        -----------
+        iteration : int
+            The iteration at which the data should be read.
+        species : str
+            Name of the species (in the openPMD file).
+        record_comp : str
+            The record component to read, as in `read_species_data` (e.g.,
+            'x', 'uz', 'w', 'charge' or 'id').
+        extensions : list of str
+            The extensions that the openPMD series complies with.
+        start, stop : int
+            Indices of the first and (past the) last particle to read.
+
+        Returns:
+        --------
+        An array with the data of the particles in SI units.
+        """
+        n = stop - start
+        record_path = get_species_record_path(record_comp)
+        if self.backend == 'h5py':
+            filename = self.iteration_to_file[iteration]
+            dfile = h5py.File(filename, 'r')
+            species_grp = get_species_group_h5py(dfile, iteration, species)
+
+            def read(path, output_type=np.float64):
+                dset = species_grp[path]
+                if isinstance(dset, h5py.Group):
+                    # Constant dataset.
+                    data = np.full(n, dset.attrs['value'])
+                else:
+                    data = dset[start:stop]
+                return apply_unit_si(data, dset.attrs['unitSI'], output_type)
+
+            def get_attribute(record, attribute):
+                return species_grp[record].attrs[attribute]
+
+        elif self.backend == 'openpmd-api':
+            species_io = self.series.iterations[iteration].particles[species]
+
+            def read(path, output_type=np.float64):
+                component = get_species_component_io(species_io, path)
+                if component.constant:
+                    data = np.full(n, component.get_attribute('value'))
+                else:
+                    data = component.load_chunk([start], [n])
+                    self.series.flush()
+                return apply_unit_si(data, component.unit_SI, output_type)
+
+            def get_attribute(record, attribute):
+                return species_io[record].get_attribute(attribute)
+
+        try:
+            output_type = np.uint64 if record_path == 'id' else np.float64
+            data = read(record_path, output_type)
+            # For ED-PIC: if the data is weighted for a full macroparticle,
+            # divide by the weight with the proper power.
+            record = record_path.split('/')[0]
+            if 'ED-PIC' in extensions and record != 'weighting':
+                macro_weighted = get_attribute(record, 'macroWeighted')
+                weighting_power = get_attribute(record, 'weightingPower')
+                if (macro_weighted == 1) and (weighting_power != 0):
+                    data *= read('weighting') ** (-weighting_power)
+            if record_comp in ['x', 'y', 'z', 'r']:
+                data += read('positionOffset/' + record_comp)
+            elif record_comp in ['ux', 'uy', 'uz', 'ur']:
+                m = read('mass')
+                # Normalize only if the particle mass is non-zero
+                if np.all(m != 0):
+                    data *= 1. / (m * constants.c)
+        finally:
+            if self.backend == 'h5py':
+                dfile.close()
+        return data
+
+    def _read_circ_field_chunk(self, iteration, field_name, component_name,
+                               chunk, m, theta):
+        """
+        Read and combine the azimuthal modes of a region of a thetaMode
+        field. Returns the data and a boolean array indicating which rows of
+        the region are below the axis.
+        """
+        _, params = self.read_openPMD_params(iteration)
+        axis_labels = params['fields_metadata'][field_name]['axis_labels']
+        r_first = axis_labels[0] == 'r'
+        shape = self._get_field_shape(iteration, field_name, component_name)
+        if r_first:
+            n_modes, n_r, _ = shape
+        else:
+            n_modes, _, n_r = shape
+        r_slice, z_slice = chunk
+        # Map the requested indices of the symmetric radial grid to the
+        # radial indices of the data in the file.
+        r_sym_idx = np.arange(2 * n_r)[r_slice]
+        below_axis = r_sym_idx < n_r
+        r_idx = np.where(below_axis, n_r - 1 - r_sym_idx, r_sym_idx - n_r)
+        if len(r_idx) == 0:
+            r_min, r_max = 0, 0
+        else:
+            r_min, r_max = r_idx.min(), r_idx.max() + 1
+        r_range = slice(r_min, r_max)
+        if r_first:
+            modes = self._read_field_chunk(
+                iteration, field_name, component_name,
+                (slice(None), r_range, z_slice))
+        else:
+            modes = self._read_field_chunk(
+                iteration, field_name, component_name,
+                (slice(None), z_slice, r_range))
+            modes = np.swapaxes(modes, 1, 2)
+        # Multipliers of each mode above and below the axis.
+        mult_above_axis = np.zeros(n_modes)
+        mult_below_axis = np.zeros(n_modes)
+        if m in ['all', 0]:
+            mult_above_axis[0] = 1
+            mult_below_axis[0] = 1
+        for mode in range(1, int(n_modes / 2) + 1):
+            if m in ['all', mode]:
+                cos = np.cos(mode * theta)
+                sin = np.sin(mode * theta)
+                mult_above_axis[2*mode-1:2*mode+1] = [cos, sin]
+                mult_below_axis[2*mode-1:2*mode+1] = [
+                    (-1) ** mode * cos, (-1) ** mode * sin]
+        fld_above = np.tensordot(mult_above_axis, modes, axes=(0, 0))
+        fld_below = np.tensordot(mult_below_axis, modes, axes=(0, 0))
+        fld = np.where(below_axis[:, np.newaxis],
+                       fld_below[r_idx - r_min], fld_above[r_idx - r_min])
+        return fld, below_axis
+
+    def _get_field_shape(self, iteration, field_name, component_name):
+        """ Get the shape of a field dataset. """
+        if self.backend == 'h5py':
+            filename = self.iteration_to_file[iteration]
+            if component_name is None:
+                field_path = field_name
+            else:
+                field_path = fr.join_infile_path(field_name, component_name)
+            with h5py.File(filename, 'r') as dfile:
+                group, dset = fr.find_dataset(dfile, iteration, field_path)
+                return tuple(fr.get_shape(dset))
+        elif self.backend == 'openpmd-api':
+            field = self.series.iterations[iteration].meshes[field_name]
+            if field.scalar:
+                component = next(field.items())[1]
+            else:
+                component = field[component_name]
+            return tuple(component.shape)
+
     def get_field_meta_info(self, iteration, field, comp, axis_labels,
                             geometry, t):
         """ Get the `FieldMetaInformation` of the field. """
@@ -102,6 +557,48 @@ class OpenPMDDataReader(DataReader):
                     self.series, iteration, field, comp, axis_labels, t)
 
 
+def get_species_record_path(record_comp):
+    """ Get the path of a species record component in the openPMD file. """
+    record_paths = {'x': 'position/x',
+                    'y': 'position/y',
+                    'z': 'position/z',
+                    'r': 'position/r',
+                    'ux': 'momentum/x',
+                    'uy': 'momentum/y',
+                    'uz': 'momentum/z',
+                    'ur': 'momentum/r',
+                    'w': 'weighting'}
+    return record_paths.get(record_comp, record_comp)
+
+
+def get_species_group_h5py(dfile, iteration, species):
+    """ Get the HDF5 group of a species. """
+    base_path = '/data/{0}'.format(iteration)
+    particles_path = dfile.attrs['particlesPath'].decode()
+    return dfile[fr.join_infile_path(base_path, particles_path, species)]
+
+
+def get_species_component_io(species, record_path):
+    """ Get an openPMD-api record component of a species. """
+    if '/' in record_path:
+        record_name, component_name = record_path.split('/')
+    else:
+        record_name, component_name = record_path, None
+    record = species[record_name]
+    if record.scalar:
+        return next(record.items())[1]
+    return record[component_name]
+
+
+def apply_unit_si(data, unit_si, output_type):
+    """ Convert the data to the output type and scale it to SI units. """
+    if data.dtype != output_type:
+        data = data.astype(output_type)
+    if np.issubdtype(data.dtype, np.floating) and unit_si != 1.0:
+        data *= unit_si
+    return data
+
+
 def read_cartesian_field_metadata_h5py(filename, iteration, field_name,
                                        component_name, axis_labels, t):
     """
@@ -274,6 +771,79 @@ def read_circ_field_metadata_io(series, iteration, field_name, component_name,
         return info
 
 
+def get_chunk_limits(chunk, shape):
+    """
+    Get the offset, extent and step along each dimension of a chunk given
+    as a tuple of slices.
+    """
+    offset = []
+    extent = []
+    steps = []
+    for chunk_slice, n in zip(chunk, shape):
+        start, stop, step = chunk_slice.indices(n)
+        if step < 1:
+            raise ValueError('Only positive slice steps are supported.')
+        offset.append(start)
+        extent.append(max(stop - start, 0))
+        steps.append(step)
+    return offset, extent, steps
+
+
+def get_circ_resolution_steps(n_r, n_z, max_resolution_3d):
+    """
+    Get the steps along r and z with which a thetaMode field of `n_r` by
+    `n_z` points is subsampled for a 3D reconstruction with a maximum
+    resolution `max_resolution_3d` (as in `read_field_circ`).
+    """
+    step_r, step_z = 1, 1
+    if max_resolution_3d is not None:
+        max_res_lon, max_res_transv = max_resolution_3d
+        if n_z > max_res_lon:
+            step_z = int(np.round(n_z / max_res_lon))
+        if n_r > max_res_transv / 2:
+            step_r = int(np.round(n_r / (max_res_transv / 2)))
+    return step_r, step_z
+
+
+def get_polar_angles(n_theta):
+    """ Get the angles of a regular polar grid with `n_theta` points. """
+    return 2 * np.pi * np.arange(n_theta) / n_theta
+
+
+def sample_modes_on_polar_grid(modes, n_theta, m='all'):
+    """
+    Evaluate the azimuthal modes (modes, r, z) of a field at `n_theta`
+    equally-spaced angles. Returns an array of shape (n_theta, r, z).
+    """
+    n_modes = modes.shape[0]
+    theta = get_polar_angles(n_theta)
+    mult = np.zeros((n_theta, n_modes))
+    if m in ['all', 0]:
+        mult[:, 0] = 1
+    for mode in range(1, int(n_modes / 2) + 1):
+        if m in ['all', mode]:
+            mult[:, 2*mode-1] = np.cos(mode * theta)
+            mult[:, 2*mode] = np.sin(mode * theta)
+    return np.tensordot(mult, modes, axes=(1, 0)).astype(modes.dtype)
+
+
+def get_modes_from_polar_grid(fld_polar):
+    """
+    Get the azimuthal modes (modes, r, z) of data sampled on a regular polar
+    grid (theta, r, z), using the same convention as openPMD (i.e., mode 0
+    followed by the cos and sin parts of each higher mode).
+    """
+    n_theta = fld_polar.shape[0]
+    n_m = (n_theta - 1) // 2
+    coeffs = np.fft.rfft(fld_polar, axis=0)
+    modes = np.empty((2 * n_m + 1,) + fld_polar.shape[1:],
+                     dtype=fld_polar.dtype)
+    modes[0] = coeffs[0].real / n_theta
+    modes[1::2] = 2 * coeffs[1:n_m+1].real / n_theta
+    modes[2::2] = -2 * coeffs[1:n_m+1].imag / n_theta
+    return modes
+
+
 def determine_field_units(field_name):
     """ Return the corresponding units of the field. """
     # TODO: Make more robust implementation using unit_dimension attributes.
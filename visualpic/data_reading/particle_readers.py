@@ -16,21 +16,69 @@ class ParticleReader():
         return super().__init__(*args, **kwargs)
 
     def read_particle_data(
-            self, file_path, iteration, species_name, component_list=[]):
+            self, file_path, iteration, species_name, component_list=[],
+            rows=None):
+        """
+        Read the data of several components of a particle species.
+
+        Parameters
+        ----------
+
+        file_path : str
+            Path to the file containing the particle data.
+
+        iteration : int
+            Iteration of the data.
+
+        species_name : str
+            Name of the particle species.
+
+        component_list : list
+            List of strings with the names of the components to read.
+
+        rows : array or slice
+            (Optional) Sorted array with the indices of the particles to
+            read, or a slice with a contiguous range of particles (which is
+            read without loading the rest of the data). If not given, all
+            particles are read.
+
+        Returns
+        -------
+        A dictionary where each component stores a tuple with the data
+        array and the metadata dictionary.
+        """
         data_dict = {}
         for component in component_list:
             metadata = self._read_component_metadata(
                 file_path, iteration, species_name, component)
             data = self._read_component_data(
-                file_path, iteration, species_name, component)
+                file_path, iteration, species_name, component, rows)
             data_dict[component] = (data, metadata)
         return data_dict
 
+    def get_source_files(self, file_path, iteration):
+        """
+        Get the paths of the data files from which the particle data is
+        read at a given iteration.
+        """
+        if file_path is None:
+            return []
+        return [file_path]
+
+    def get_number_of_particles(self, file_path, iteration, species_name,
+                                component):
+        """
+        Get the number of particles of a species (from the shape of the data
+        of the given component, which is not read).
+        """
+        raise NotImplementedError()
+
     def _read_component_metadata(
             self, file_path, iteration, species, component):
         raise NotImplementedError()
 
-    def _read_component_data(self, file_path, iteration, species, component):
+    def _read_component_data(self, file_path, iteration, species, component,
+                             rows=None):
         raise NotImplementedError()
 
 
@@ -47,16 +95,19 @@ class OsirisParticleReader(ParticleReader):
                                'tag': 'tag'}
         return super().__init__(*args, **kwargs)
 
-    def _read_component_data(self, file_path, iteration, species, component):
+    def get_number_of_particles(self, file_path, iteration, species_name,
+                                component):
         with H5F(file_path, 'r') as file_handle:
-            data = file_handle[self.name_relations[component]]
-            if component == 'tag':
-                # Apply Cantor pairing function
-                print(data)
-                a = data[:, 0]
-                b = data[:, 1]
-                data = 1/2*(a+b)*(a+b+1)+b
-            return np.array(data)
+            return file_handle[self.name_relations[component]].shape[0]
+
+    def _read_component_data(self, file_path, iteration, species, component,
+                             rows=None):
+        with H5F(file_path, 'r') as file_handle:
+            data = _read_rows(file_handle[self.name_relations[component]],
+                              rows)
+        if component == 'tag':
+            data = cantor_pairing(data[:, 0], data[:, 1])
+        return data
 
     def _read_component_metadata(
             self, file_path, iteration, species, component):
@@ -76,6 +127,8 @@ class OsirisParticleReader(ParticleReader):
                     idx = 0
                 metadata['units'] = self._numpy_bytes_to_string(
                     file_handle[units_path].attrs['UNITS'][idx])
+            else:
+                metadata['units'] = ''
             # Read time data.
             metadata['time'] = {}
             metadata['time']['value'] = file_handle.attrs['TIME'][0]
@@ -116,20 +169,19 @@ class HiPACEParticleReader(ParticleReader):
                                'tag': 'tag'}
         return super().__init__(*args, **kwargs)
 
-    def _read_component_data(self, file_path, iteration, species, component):
+    def get_number_of_particles(self, file_path, iteration, species_name,
+                                component):
         with H5F(file_path, 'r') as file_handle:
-            if component in self.name_relations:
-                hp_name = self.name_relations[component]
-            else:
-                hp_name = component
-            data = file_handle[hp_name]
-            if component == 'tag':
-                # Apply Cantor pairing function
-                print(data)
-                a = data[:, 0]
-                b = data[:, 1]
-                data = 1/2*(a+b)*(a+b+1)+b
-            return np.array(data)
+            return file_handle[self._get_hipace_name(component)].shape[0]
+
+    def _read_component_data(self, file_path, iteration, species, component,
+                             rows=None):
+        with H5F(file_path, 'r') as file_handle:
+            data = _read_rows(file_handle[self._get_hipace_name(component)],
+                              rows)
+        if component == 'tag':
+            data = cantor_pairing(data[:, 0], data[:, 1])
+        return data
 
     def _read_component_metadata(
             self, file_path, iteration, species, component):
@@ -159,6 +211,11 @@ class HiPACEParticleReader(ParticleReader):
             metadata['grid']['size_units'] = 'c/\\omega_p'
         return metadata
 
+    def _get_hipace_name(self, component):
+        if component in self.name_relations:
+            return self.name_relations[component]
+        return component
+
 
 class OpenPMDParticleReader(ParticleReader):
     def __init__(self, opmd_reader, *args, **kwargs):
@@ -175,16 +232,46 @@ class OpenPMDParticleReader(ParticleReader):
                                'w': 'w'}
         return super().__init__(*args, **kwargs)
 
-    def _read_component_data(self, file_path, iteration, species, component):
+    def get_source_files(self, file_path, iteration):
+        return self._opmd_reader.get_iteration_files(iteration)
+
+    def get_number_of_particles(self, file_path, iteration, species_name,
+                                component):
+        return self._opmd_reader.get_species_size(
+            iteration, species_name, self.name_relations[component])
+
+    def _read_component_data(self, file_path, iteration, species, component,
+                             rows=None):
+        # The rows are read directly from the file, as a range of particles
+        # between the first and the last of them. Without rows, the full
+        # component is read by openPMD-viewer.
         record_comp = self.name_relations[component]
         t, params = self._opmd_reader.read_openPMD_params(iteration)
         extensions = params['extensions']
-        data = self._opmd_reader.read_species_data(
-            iteration, species, record_comp, extensions)
+        if rows is None:
+            def read(record_comp):
+                return self._opmd_reader.read_species_data(
+                    iteration, species, record_comp, extensions)
+        else:
+            if isinstance(rows, slice):
+                start, stop, _ = rows.indices(self.get_number_of_particles(
+                    file_path, iteration, species, component))
+                stop = max(start, stop)
+            else:
+                rows = np.asarray(rows)
+                start, stop = 0, 0
+                if len(rows) > 0:
+                    start, stop = int(rows.min()), int(rows.max()) + 1
+
+            def read(record_comp):
+                data = self._opmd_reader.read_species_chunk(
+                    iteration, species, record_comp, extensions, start, stop)
+                if not isinstance(rows, slice):
+                    data = data[rows - start]
+                return data
+        data = read(record_comp)
         if record_comp in ['charge', 'mass']:
-            w = self._opmd_reader.read_species_data(
-                iteration, species, 'w', extensions)
-            data = data * w
+            data = data * read('w')
         return data
 
     def _read_component_metadata(
@@ -244,3 +331,31 @@ class OpenPMDParticleReader(ParticleReader):
             metadata['grid']['size'] = None
             metadata['grid']['size_units'] = None
         return metadata
+
+
+def cantor_pairing(a, b):
+    """
+    Combine two arrays of non-negative integers (e.g., the node and the
+    particle index of the tags of Osiris and HiPACE) into a single unique
+    integer using the Cantor pairing function. The calculation is performed
+    with 64-bit integers, so that it is exact.
+    """
+    a = np.asarray(a).astype(np.uint64)
+    b = np.asarray(b).astype(np.uint64)
+    return (a + b) * (a + b + np.uint64(1)) // np.uint64(2) + b
+
+
+def _read_rows(dataset, rows=None):
+    """
+    Read the given rows (a sorted array of indices or a slice) of an HDF5
+    dataset. Only the slab between the first and the last row is read from
+    disk.
+    """
+    if rows is None:
+        return dataset[()]
+    if isinstance(rows, slice):
+        return dataset[rows]
+    if len(rows) == 0:
+        return np.empty((0,) + dataset.shape[1:], dtype=dataset.dtype)
+    slab = dataset[rows[0]:rows[-1] + 1]
+    return slab[rows - rows[0]]
@@ -9,6 +9,10 @@ License: GNU GPL-3.0.
 
 
 import sys
+import asyncio
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
@@ -186,3 +190,117 @@ def get_previous_timestep(current_time_step, time_steps):
         return time_steps[current_index - 1]
     else:
         return current_time_step
+
+
+def read_ahead(function, items, n_workers=None, max_in_flight=2):
+    """
+    Generator which applies a function to a sequence of items using a pool of
+    worker threads, yielding the results in the same order as the items.
+
+    While the caller processes one result, the following items are already
+    being processed in the background. The number of pending results is
+    limited to `max_in_flight` in order to bound the memory usage.
+
+    Parameters:
+    -----------
+    function : callable
+        Function taking a single item as argument.
+
+    items : iterable
+        Items to which the function is applied.
+
+    n_workers : int
+        Number of worker threads. By default, equal to `max_in_flight`. If
+        0, the items are processed in the calling thread, without a pool.
+
+    max_in_flight : int
+        Maximum number of results being computed or waiting to be yielded.
+
+    Returns:
+    --------
+    A generator of the function results.
+    """
+    if n_workers == 0:
+        for item in items:
+            yield function(item)
+        return
+    max_in_flight = max(1, max_in_flight)
+    if n_workers is None:
+        n_workers = max_in_flight
+    items = iter(items)
+    futures = deque()
+    executor = ThreadPoolExecutor(max_workers=n_workers)
+    try:
+        for item in items:
+            futures.append(executor.submit(function, item))
+            if len(futures) >= max_in_flight:
+                break
+        while len(futures) > 0:
+            result = futures.popleft().result()
+            for item in items:
+                futures.append(executor.submit(function, item))
+                break
+            yield result
+    finally:
+        # Cancel pending work if the generator is not fully consumed.
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def stack_timestep_data(data_list):
+    """
+    Stack a list of equally-shaped arrays (one per time step) into a single
+    array with time as the first dimension.
+
+    Parameters:
+    -----------
+    data_list : list
+        List of arrays.
+
+    Returns:
+    --------
+    An array of shape (n_timesteps, ...).
+    """
+    shapes = set(np.shape(data) for data in data_list)
+    if len(shapes) > 1:
+        raise ValueError(
+            'Data of different time steps cannot be stacked due to '
+            'different shapes {}.'.format(shapes))
+    return np.stack(data_list)
+
+
+async def run_in_executor(function, *args, executor=None, semaphore=None,
+                          **kwargs):
+    """
+    Run a blocking function in an executor without blocking the event loop.
+
+    If the calling task is cancelled before the function starts, the
+    function is not executed. If it is cancelled while waiting for the
+    semaphore, no executor slot is used.
+
+    Parameters:
+    -----------
+    function : callable
+        The function to run.
+
+    *args, **kwargs
+        Arguments of the function.
+
+    executor : concurrent.futures.Executor
+        (Optional) Executor in which to run the function. By default, the
+        default executor of the event loop.
+
+    semaphore : asyncio.Semaphore
+        (Optional) Semaphore used to limit the number of concurrent calls.
+
+    Returns:
+    --------
+    The result of the function.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(function, *args, **kwargs)
+    if semaphore is None:
+        return await loop.run_in_executor(executor, call)
+    async with semaphore:
+        return await loop.run_in_executor(executor, call)
@@ -221,6 +221,11 @@ class VTKVisualizer():
         """
         Add a particle species to the 3D visualization.
 
+        Each particle is rendered as a sphere. For species with a very large
+        number of particles, consider instead depositing them onto a grid
+        with `species.get_deposited_field` and adding the result with
+        `add_field`.
+
         Parameters
         ----------
 
@@ -1265,7 +1270,8 @@ class VolumetricField():
             min_fld = np.min(fld_data)
             max_fld = np.max(fld_data)
             self._original_data_range = [min_fld, max_fld]
-            fld_data = self._normalize_field(fld_data)
+            fld_data = self._normalize_field(
+                fld_data, data_range=self._original_data_range)
             # Make sure the array is contiguous, otherwise this can lead to
             # errors in vtk_data_import.SetImportVoidPointer in some cases when
             # trimming in the y or z planes is applied, or when the array has
@@ -1380,17 +1386,20 @@ class VolumetricField():
             z = z[zmin:zmax]
         return x, y, z
 
-    def _normalize_field(self, fld_data):
+    def _normalize_field(self, fld_data, data_range=None):
         # Normalizing to a range between 0-255 is not only useful to simplify
         # setting the colormaps and opacities. It also prevents large numbers
         # in the fields which might lead to problems with vtk depending on the
         # GPU used.
+        # The range of the data is only computed if not already known.
+        if (self.vmin is None or self.vmax is None) and data_range is None:
+            data_range = [np.min(fld_data), np.max(fld_data)]
         if self.vmax is None:
-            max_value = np.max(fld_data)
+            max_value = data_range[1]
         else:
             max_value = self.vmax
         if self.vmin is None:
-            min_value = np.min(fld_data)
+            min_value = data_range[0]
         else:
             min_value = self.vmin
         fld_data -= min_value
@@ -1725,23 +1734,18 @@ class ScatterSpecies():
             z_range = [np.min(z_arr), np.max(z_arr)]
             y_range = [np.min(y_arr), np.max(y_arr)]
             x_range = [np.min(x_arr), np.max(x_arr)]
-        elements_to_keep = np.ones_like(x_arr)
-        if self.xtrim is not None:
-            x_trim_range = self._determine_trimming_range(self.xtrim, x_range)
-            elements_to_keep = np.where((x_arr > x_trim_range[0]) &
-                                        (x_arr < x_trim_range[1]),
-                                        elements_to_keep, 0)
-        if self.ytrim is not None:
-            y_trim_range = self._determine_trimming_range(self.ytrim, y_range)
-            elements_to_keep = np.where((y_arr > y_trim_range[0]) &
-                                        (y_arr < y_trim_range[1]),
-                                        elements_to_keep, 0)
-        if self.ztrim is not None:
-            z_trim_range = self._determine_trimming_range(self.ztrim, z_range)
-            elements_to_keep = np.where((z_arr > z_trim_range[0]) &
-                                        (z_arr < z_trim_range[1]),
-                                        elements_to_keep, 0)
-        elements_to_keep = np.array(elements_to_keep, dtype=bool)
+        trim_region = {}
+        for axis, trim, axis_range in [('x', self.xtrim, x_range),
+                                       ('y', self.ytrim, y_range),
+                                       ('z', self.ztrim, z_range)]:
+            if trim is not None:
+                trim_region[axis] = self._determine_trimming_range(
+                    trim, axis_range)
+        # Use the spatial index of the species, which is only built once per
+        # time step, to find the particles within the trimming region.
+        spatial_index = self.species.get_spatial_index(
+            self._current_timestep, ['x', 'y', 'z'])
+        elements_to_keep = spatial_index.query_box(trim_region)
         part_arr = part_arr[elements_to_keep]
         if self.color_according_to is not None:
             color_arr = color_arr[elements_to_keep]